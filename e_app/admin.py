@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import (User,Vendor,Customer,ProductImage,Cart,Category,CartItem,Product,Order,OrderItem,Payment,Address)
+from .models import (User,Vendor,Customer,ProductImage,Cart,Category,CartItem,Product,Order,OrderItem,Payment,Address,deferred_order_totals)
 # Register your models here.
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -51,7 +51,8 @@ class ProductAdmin(admin.ModelAdmin):
     
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('customer','created_at')
+    list_display = ('customer','item_count','subtotal','created_at')
+    readonly_fields = ('item_count','subtotal')
     inlines = [CartItemInline]
     
 @admin.register(Order)
@@ -61,6 +62,11 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ('customer__user__username',)
     inlines = [OrderItemInline]
     
+    def save_related(self,request,form,formsets,change):
+        # one total refresh for the whole inline formset
+        with deferred_order_totals():
+            super().save_related(request,form,formsets,change)
+    
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('order','payment_id','method','status','created_at')
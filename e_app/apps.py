@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class EAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'e_app'
+    
+    def ready(self):
+        # signal receivers that live outside models.py
+        from . import caching, images, search  # noqa: F401
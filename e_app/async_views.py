@@ -0,0 +1,142 @@
+"""
+Async read path for the public catalog.
+
+DRF views are sync only, so these are plain Django async views covering the
+read side of ProductListView and CategoryViewSet plus a public vendor
+storefront. Rows are read through the async ORM: under an ASGI worker (see
+render.yaml) a process keeps serving other requests while one waits on the
+database, where a sync worker would sit blocked. Search, keyset cursors and
+serializers are the sync views' own, so payloads are interchangeable; product
+lists here are always keyset pages (`?cursor=`, as HomePage.jsx uses), with
+`?facets=` counts as in facets.py.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from .facets import aproduct_facets, in_stock, requested_facets
+from .models import Category, Product, Vendor
+from .pagination import ProductKeysetPagination
+from .search import search_products
+from .serializers import CategorySerializer, ProductDetailSerializer, ProductListSerializer
+
+# ?param -> (lookup, parser), the same filters as facets.ProductFilter
+PRODUCT_FILTERS = {
+    'category': ('category_id', int),
+    'price__gte': ('price__gte', Decimal),
+    'price__lte': ('price__lte', Decimal),
+}
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def _error(detail, status):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def _parse_filters(params, ignore=()):
+    lookups = {}
+    errors = {}
+    for param, (lookup, parse) in PRODUCT_FILTERS.items():
+        raw = params.get(param)
+        if param in ignore or raw in (None, ''):
+            continue
+        try:
+            lookups[lookup] = parse(raw)
+        except (ValueError, InvalidOperation):
+            errors[param] = ["Enter a number."]
+    stock = params.get('in_stock', '').lower()
+    if 'in_stock' not in ignore and stock not in ('', 'unknown'):
+        if stock not in BOOLEANS:
+            errors['in_stock'] = ["Enter a valid boolean."]
+        else:
+            lookups['stock'] = BOOLEANS[stock]
+    return lookups, errors
+
+
+def _apply_filters(queryset, lookups, search):
+    lookups = dict(lookups)
+    if 'stock' in lookups:
+        queryset = queryset.filter(in_stock(lookups.pop('stock')))
+    return search_products(queryset.filter(**lookups), search)
+
+
+async def _filter_products(queryset, params):
+    lookups, errors = _parse_filters(params)
+    category_id = lookups.get('category_id')
+    if category_id is not None and not await Category.objects.filter(pk=category_id).aexists():
+        errors['category'] = ["Select a valid choice. That choice is not one of the available choices."]
+    if errors:
+        return None, errors
+    return _apply_filters(queryset, lookups, params.get('search', '')), None
+
+
+async def _product_page(request, queryset, **extra):
+    request = Request(request)
+    try:
+        facets = requested_facets(request.query_params)
+    except APIException as exc:
+        return JsonResponse(exc.detail, status=exc.status_code)
+    base = queryset
+    queryset, errors = await _filter_products(queryset, request.query_params)
+    if errors:
+        return JsonResponse(errors, status=400)
+    paginator = ProductKeysetPagination()
+    try:
+        page = await paginator.apaginate_queryset(queryset, request)
+    except APIException as exc:
+        return _error(exc.detail, exc.status_code)
+    data = ProductListSerializer(page, many=True, context={'request': request}).data
+    if facets:
+        search = request.query_params.get('search', '')
+
+        def filtered(ignore):
+            # the parameters were checked above
+            return _apply_filters(base, _parse_filters(request.query_params, ignore)[0], search)
+
+        extra['facets'] = await aproduct_facets(filtered, facets)
+    return JsonResponse({**extra, **paginator.get_paginated_data(data)})
+
+
+@require_GET
+async def product_list(request):
+    return await _product_page(request, Product.objects.filter(is_active=True))
+
+
+@require_GET
+async def product_detail(request, slug):
+    queryset = (
+        Product.objects.filter(is_active=True)
+        .select_related('category', 'vendor__user')
+        .prefetch_related('images')
+    )
+    try:
+        product = await queryset.aget(slug=slug)
+    except Product.DoesNotExist:
+        return _error("No Product matches the given query.", 404)
+    data = ProductDetailSerializer(product, context={'request': Request(request)}).data
+    return JsonResponse(data)
+
+
+@require_GET
+async def category_list(request):
+    categories = [category async for category in Category.objects.all()]
+    return JsonResponse(CategorySerializer(categories, many=True).data, safe=False)
+
+
+@require_GET
+async def vendor_storefront(request, slug):
+    try:
+        vendor = await Vendor.objects.filter(is_active=True).aget(slug=slug)
+    except Vendor.DoesNotExist:
+        return _error("No Vendor matches the given query.", 404)
+    vendor_data = {
+        'id': vendor.id,
+        'shop_name': vendor.shop_name,
+        'slug': vendor.slug,
+        'description': vendor.description,
+    }
+    products = Product.objects.filter(is_active=True, vendor=vendor)
+    return await _product_page(request, products, vendor=vendor_data)
@@ -0,0 +1,106 @@
+"""
+Stateless JWT authentication.
+
+Tokens issued through `token_for_user` carry the user's role, staff flags and
+vendor / customer profile ids. `ClaimsJWTAuthentication` turns such a token
+into a `ClaimsUser` without touching the database, and
+`request.user.vendor_profile` / `.customer_profile` are built from the ids on
+first use: deferred model instances holding only the pk, which is all the
+views filter on (any other field loads on access). Tokens minted before the
+claims existed still authenticate through the usual User lookup.
+
+Being stateless, deactivating a user or changing their role or profiles only
+takes effect once their access token expires (SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']):
+refreshing re-reads the user and writes current claims into the new tokens.
+"""
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Customer, User, Vendor
+
+ROLE_CLAIM = 'role'
+
+
+def user_with_profiles(**lookup):
+    # the user and both profiles in one query
+    return User.objects.select_related('vendor_profile', 'customer_profile').filter(**lookup).first()
+
+
+def profile_claims(user):
+    """Claims describing `user`; select_related the profiles to avoid two queries."""
+    vendor = getattr(user, 'vendor_profile', None)
+    customer = getattr(user, 'customer_profile', None)
+    return {
+        ROLE_CLAIM: user.role,
+        'username': user.username,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'vendor_id': vendor.pk if vendor else None,
+        'customer_id': customer.pk if customer else None,
+    }
+
+
+def token_for_user(user):
+    """A refresh token with profile claims; access tokens made from it inherit them."""
+    refresh = RefreshToken.for_user(user)
+    for claim, value in profile_claims(user).items():
+        refresh[claim] = value
+    return refresh
+
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return token_for_user(user)
+
+
+class TokenRefreshWithClaimsSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = user_with_profiles(**{api_settings.USER_ID_FIELD: user_id}) if user_id else None
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        # rotated refresh tokens would otherwise carry login-time claims forever
+        for claim, value in profile_claims(user).items():
+            refresh[claim] = value
+        return super().validate({**attrs, 'refresh': str(refresh)})
+
+
+class ClaimsUser(TokenUser):
+    """request.user for tokens with profile claims."""
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def role(self):
+        return self.token.get(ROLE_CLAIM)
+
+    @cached_property
+    def vendor_profile(self):
+        return self._profile(Vendor, 'vendor_id', User.vendor_profile)
+
+    @cached_property
+    def customer_profile(self):
+        return self._profile(Customer, 'customer_id', User.customer_profile)
+
+    def _profile(self, model, claim, descriptor):
+        pk = self.token.get(claim)
+        if pk is None:
+            # same error as the real reverse one-to-one accessor
+            raise descriptor.RelatedObjectDoesNotExist(f"User has no {descriptor.related.name}.")
+        return model.from_db(model.objects.db, ['id', 'user_id'], [pk, self.id])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if ROLE_CLAIM not in validated_token or api_settings.USER_ID_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        return ClaimsUser(validated_token)
@@ -0,0 +1,257 @@
+"""
+Benchmark helpers.
+
+`run_load` sends GET requests at a running server from a pool of client
+threads, each holding one keep-alive connection, and reports throughput and
+latency percentiles. It measures from the outside, so the same numbers can
+be taken against a sync (WSGI) and an async (ASGI) worker of the same build.
+
+`endpoint_scenarios` / `run_scenario` drive the main API endpoints in-process
+through the test client against a seeded dataset (see seeding.py), recording
+latency and SQL query counts per request; `compare_results` flags
+regressions against a saved run.
+
+`run_checkouts` has many buyers check out the same product at once, each on
+its own thread and database connection, to measure how checkout throughput
+holds up on one hot product (see inventory.py's hot-SKU mode).
+"""
+import http.client
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from django.db import DatabaseError, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .authentication import token_for_user, user_with_profiles
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+@dataclass
+class LoadResult:
+    url: str
+    concurrency: int
+    elapsed: float
+    errors: int = 0
+    latencies: list = field(default_factory=list)
+
+    @property
+    def requests(self):
+        return len(self.latencies) + self.errors
+
+    @property
+    def throughput(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        ms = [latency * 1000 for latency in self.latencies]
+        return {
+            'url': self.url,
+            'concurrency': self.concurrency,
+            'requests': self.requests,
+            'errors': self.errors,
+            'req_per_s': round(self.throughput, 1),
+            'p50_ms': _round(percentile(ms, 0.50)),
+            'p90_ms': _round(percentile(ms, 0.90)),
+            'p99_ms': _round(percentile(ms, 0.99)),
+            'max_ms': _round(ms[-1] if ms else None),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def _client(url, count, headers, timeout):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    connection = connection_class(parts.netloc, timeout=timeout)
+    latencies, errors = [], 0
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+                continue
+            if response.status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+    return latencies, errors
+
+
+def run_load(url, concurrency=32, total=1000, headers=None, timeout=30):
+    """GET `url` `total` times from `concurrency` connections at once."""
+    headers = {'Connection': 'keep-alive', **(headers or {})}
+    shares = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda count: _client(url, count, headers, timeout), shares))
+    result = LoadResult(url=url, concurrency=concurrency, elapsed=time.perf_counter() - started)
+    for latencies, errors in outcomes:
+        result.latencies.extend(latencies)
+        result.errors += errors
+    result.latencies.sort()
+    return result
+
+
+# in-process endpoint benchmarks
+
+@dataclass
+class Scenario:
+    name: str
+    # (client, iteration) -> response
+    request: object
+
+
+def _bearer(user):
+    token = token_for_user(user_with_profiles(pk=user.pk)).access_token
+    return {'HTTP_AUTHORIZATION': f"Bearer {token}"}
+
+
+def endpoint_scenarios(dataset):
+    """The main API endpoints, rotating over realistic parameters."""
+    from .seeding import NOUNS
+
+    customers = [(user, _bearer(user)) for user in dataset.customer_users]
+    vendor_auth = [_bearer(user) for user in dataset.vendor_users]
+    list_params = [
+        {},
+        {'cursor': ''},
+        {'ordering': 'price'},
+        {'category': dataset.category_ids[0]},
+        {'search': NOUNS[0].lower()},
+    ]
+    order_params = [{}, {'status': 'PLACED'}]
+
+    def customer(i):
+        return customers[i % len(customers)]
+
+    def place_order(client, i):
+        user, auth = customer(i)
+        items = [
+            {'product_id': dataset.product_ids[(i * 7 + n) % len(dataset.product_ids)], 'quantity': 1}
+            for n in range(2)
+        ]
+        payload = {'address_id': dataset.address_ids[user.pk], 'items': items}
+        return client.post(reverse('customer-orders'), payload, format='json', **auth)
+
+    return [
+        Scenario('products-list', lambda client, i: client.get(
+            reverse('products-list'), list_params[i % len(list_params)])),
+        Scenario('product-detail', lambda client, i: client.get(
+            reverse('products-detail', kwargs={'slug': dataset.product_slugs[i % len(dataset.product_slugs)]}))),
+        Scenario('cart', lambda client, i: client.get(reverse('customer-cart'), **customer(i)[1])),
+        Scenario('order-create', place_order),
+        Scenario('vendor-orders', lambda client, i: client.get(
+            reverse('vendor-orders'), order_params[i % len(order_params)], **vendor_auth[i % len(vendor_auth)])),
+        Scenario('dashboard', lambda client, i: client.get(
+            reverse('vendor-dashboard'), **vendor_auth[i % len(vendor_auth)])),
+    ]
+
+
+def run_scenario(client, scenario, iterations, warmup=0):
+    for i in range(warmup):
+        scenario.request(client, i)
+    latencies, queries, errors = [], [], 0
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = scenario.request(client, warmup + i)
+            latencies.append(time.perf_counter() - started)
+        queries.append(len(captured))
+        if response.status_code >= 400:
+            errors += 1
+    return summarize(latencies, queries, errors)
+
+
+def summarize(latencies, queries, errors=0):
+    ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        'iterations': len(ms),
+        'errors': errors,
+        'req_per_s': round(len(ms) / (sum(ms) / 1000), 1) if ms else 0.0,
+        'mean_ms': _round(statistics.fmean(ms) if ms else None),
+        'p50_ms': _round(percentile(ms, 0.50)),
+        'p95_ms': _round(percentile(ms, 0.95)),
+        'p99_ms': _round(percentile(ms, 0.99)),
+        'queries_mean': _round(statistics.fmean(queries) if queries else None),
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+def compare_results(current, baseline, threshold=0.2):
+    """
+    Regressions of `current` against `baseline` (both as written by the
+    benchmark command): p95 latency up by more than `threshold`, more SQL
+    queries on average, or new errors.
+    """
+    regressions = []
+    for name, now in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        if before.get('p95_ms') and now['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if before.get('queries_mean') is not None and now['queries_mean'] > before['queries_mean'] + 0.01:
+            regressions.append(f"{name}: queries {before['queries_mean']} -> {now['queries_mean']}")
+        if now['errors'] > before.get('errors', 0):
+            regressions.append(f"{name}: errors {before.get('errors', 0)} -> {now['errors']}")
+    return regressions
+
+
+# checkout contention
+
+def run_checkouts(product_id, buyers, orders_per_buyer, quantity=1):
+    """
+    Every (customer, address) in `buyers` places `orders_per_buyer` orders for
+    `quantity` of one product, all buyers at once. The result's req_per_s is
+    orders per second of wall-clock time; refused or failed checkouts are errors.
+    """
+    from .orders import CheckoutError, place_order
+
+    def buyer(customer, address):
+        latencies, errors = [], 0
+        try:
+            for _ in range(orders_per_buyer):
+                started = time.perf_counter()
+                try:
+                    place_order(customer, address, {product_id: quantity})
+                except (CheckoutError, DatabaseError):
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+        finally:
+            # the thread's own connections
+            connections.close_all()
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(buyers)) as pool:
+        outcomes = list(pool.map(lambda pair: buyer(*pair), buyers))
+    result = LoadResult(url=f"checkout product {product_id}", concurrency=len(buyers),
+                        elapsed=time.perf_counter() - started)
+    for latencies, errors in outcomes:
+        result.latencies.extend(latencies)
+        result.errors += errors
+    result.latencies.sort()
+    return result
@@ -0,0 +1,213 @@
+"""
+Cache helpers.
+
+Every cached entry is tied to one or more names (tags) through version tokens.
+Invalidating a name just deletes its token, so the next reader gets a fresh
+token, sees a mismatch and rebuilds; a reader that raced the invalidation can
+only store under the dead token. Entries still get a long timeout, purely so
+dead versions are evicted. Tokens start with the time they were minted, which
+is never earlier than the write that forced them, so they double as
+Last-Modified times for conditional GETs.
+
+Tags used for the public catalog:
+    product-list        any product list page
+    product:<id>        one product (detail page)
+    category:<id>       one category
+    vendor:<id>         one vendor
+    categories          the category endpoints
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.response import Response
+
+from .conditional import latest, make_etag, not_modified, set_validators
+from .metrics import record_cache
+from .models import Category, OrderItem, Product, ProductImage, Vendor
+
+ENTRY_TIMEOUT = 60 * 60 * 24
+
+
+def _version_key(name):
+    return f"version:{name}"
+
+
+def new_token():
+    return f"{time.time_ns()}.{uuid.uuid4().hex[:12]}"
+
+
+def token_timestamp(token):
+    try:
+        return int(token.split('.', 1)[0]) / 1e9
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_versions(names):
+    """
+    Current token per name, creating tokens for names that have none yet.
+    None when the cache can't hand them out (an outage, with IGNORE_EXCEPTIONS
+    every read comes back empty): callers must then not cache or validate.
+    """
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(list(keys))
+    for key in keys.keys() - found.keys():
+        # add() so concurrent readers settle on a single token
+        cache.add(key, new_token(), None)
+        found[key] = cache.get(key)
+    if any(token is None for token in found.values()):
+        return None
+    return {keys[key]: token for key, token in found.items()}
+
+
+def invalidate(names):
+    keys = [_version_key(name) for name in set(names)]
+    if keys:
+        # after commit, or a reader could cache what is about to be rolled back
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_products(product_ids, lists=True):
+    tags = [f"product:{product_id}" for product_id in product_ids]
+    invalidate(['product-list', *tags] if lists else tags)
+
+
+# response cache for public catalog endpoints
+
+class CachedResponseMixin:
+    """
+    Serve `list` and `retrieve` of a read-only catalog viewset from the shared
+    cache. Responses are keyed by host, path and the normalised query string;
+    they don't depend on who is asking, so authenticated reads share entries
+    with anonymous ones. Views say which tags an entry depends on through
+    `get_cache_tags`, which runs before the response is built so a write that
+    lands while we render invalidates what we are about to store; views that
+    don't override it aren't cached.
+
+    The same tag versions make the ETag and Last-Modified, so a client
+    revalidating a current copy gets a 304 straight from the cache.
+    """
+    cache_timeout = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_tags(self):
+        # tags the response depends on; None serves it uncached
+        return None
+
+    def get_response_cache_key(self, request):
+        params = sorted(request.query_params.lists())
+        raw = f"{request.scheme}://{request.get_host()}{request.path}?{params}"
+        digest = hashlib.sha1(raw.encode()).hexdigest()
+        return f"response:{self.basename}:{self.action}:{digest}"
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        data = None
+        entry = cache.get(key)
+        if entry is not None:
+            tags, versions, data = entry
+            if get_versions(tags) != versions:
+                data = None
+        if data is None:
+            tags = self.get_cache_tags()
+            versions = get_versions(tags) if tags is not None else None
+        if versions is None:
+            # uncached, and without validators: they would match whatever the data is
+            return handler(request, *args, **kwargs)
+
+        etag = make_etag(key, request.accepted_media_type, sorted(versions.items()))
+        last_modified = latest(*(token_timestamp(token) for token in versions.values()))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            record_cache(hit=True)
+            return response
+
+        record_cache(hit=data is not None)
+        if data is not None:
+            response = Response(data)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            timeout = self.cache_timeout or getattr(settings, 'CATALOG_CACHE_TIMEOUT', ENTRY_TIMEOUT)
+            cache.set(key, (tags, versions, response.data), timeout)
+        return set_validators(response, etag, last_modified)
+
+
+# vendor dashboard
+
+def vendor_dashboard_name(vendor_id):
+    return f"vendor-dashboard:{vendor_id}"
+
+
+def vendor_dashboard_key(vendor_id):
+    """The dashboard's cache key, None while the cache is down."""
+    name = vendor_dashboard_name(vendor_id)
+    versions = get_versions([name])
+    if versions is None:
+        return None
+    return f"vendor_dashboard_{vendor_id}_{versions[name]}"
+
+
+def invalidate_vendor_dashboards(vendor_ids):
+    invalidate(vendor_dashboard_name(vendor_id) for vendor_id in vendor_ids if vendor_id)
+
+
+# invalidation
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def _product_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_products([instance.pk])
+    invalidate_vendor_dashboards([instance.vendor_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def _product_image_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_products([instance.product_id])
+    vendor_ids = Product.objects.filter(pk=instance.product_id).values_list('vendor_id', flat=True)
+    invalidate_vendor_dashboards(list(vendor_ids))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def _order_item_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_vendor_dashboards([instance.vendor_id])
+
+
+@receiver(post_save, sender=Category)
+def _category_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # ?search= list pages rank on category names
+        invalidate(['categories', 'product-list', f"category:{instance.pk}"])
+
+
+@receiver(post_delete, sender=Category)
+def _category_deleted(sender, instance, **kwargs):
+    # products drop to no category, so category filtered lists change too
+    invalidate(['categories', 'product-list', f"category:{instance.pk}"])
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def _vendor_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # and on shop names
+        invalidate(['product-list', f"vendor:{instance.pk}"])
@@ -0,0 +1,118 @@
+"""
+Cart writes.
+
+A batch of add / set / remove operations is folded into one net change per
+product and applied in a single transaction with a fixed number of queries:
+one DELETE for removals, one upsert for absolute quantities and, for
+increments, an insert-if-missing followed by one `quantity = quantity + n`
+UPDATE, so concurrent adds to the same line never lose each other. Bulk
+writes skip the CartItem signals; the cart totals are refreshed once at the
+end. The changed lines' stock holds follow in the same transaction
+(reservations.reserve), so a line the stock can't cover is refused.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Prefetch, Value, When, prefetch_related_objects
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from .models import CartItem, Product, deferred_cart_totals
+from .reservations import reserve
+from .upserts import upsert
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+MAX_CART_OPERATIONS = 100
+
+
+class CartError(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Invalid cart operation.'
+    default_code = 'cart_error'
+
+
+def parse_cart_operations(payload):
+    """
+    Validate a list of {"op", "product_id", "quantity"} into {product_id: (mode, quantity)}
+    where mode is 'add' (relative) or 'set' (absolute, 0 removes the line).
+    Operations on the same product are folded in order.
+    """
+    if not isinstance(payload, list) or not payload:
+        raise CartError("`operations` must be a non-empty list.")
+    if len(payload) > MAX_CART_OPERATIONS:
+        raise CartError(f"At most {MAX_CART_OPERATIONS} operations per request.")
+    changes = {}
+    for idx, operation in enumerate(payload):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise CartError(f"Each operation needs an 'op' of {', '.join(CART_OPERATIONS)} (operation index {idx}).")
+        op = operation['op']
+        try:
+            product_id = int(operation['product_id'])
+            quantity = 0 if op == 'remove' else int(operation['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise CartError(f"'product_id' and 'quantity' must be integers (operation index {idx}).")
+        if quantity < (1 if op == 'add' else 0):
+            raise CartError(f"Quantity out of range (operation index {idx}).")
+
+        mode, current = changes.get(product_id, ('add', 0))
+        if op == 'add':
+            changes[product_id] = (mode, current + quantity)
+        else:
+            changes[product_id] = ('set', quantity)
+    return changes
+
+
+def _per_line(quantities):
+    return Case(
+        *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+@transaction.atomic
+def apply_cart_operations(cart, changes):
+    """Apply parsed operations to `cart`; unknown or inactive products raise NotFound."""
+    wanted = [pid for pid, (mode, quantity) in changes.items() if mode == 'add' or quantity]
+    available = set(Product.objects.filter(pk__in=wanted, is_active=True).values_list('pk', flat=True))
+    missing = sorted(set(wanted) - available)
+    if missing:
+        raise NotFound(f"Product with id {missing[0]} not found.")
+
+    removed = [pid for pid, (mode, quantity) in changes.items() if mode == 'set' and not quantity]
+    sets = {pid: quantity for pid, (mode, quantity) in changes.items() if mode == 'set' and quantity}
+    adds = {pid: quantity for pid, (mode, quantity) in changes.items() if mode == 'add'}
+    now = timezone.now()
+
+    with deferred_cart_totals():
+        if removed:
+            cart.items.filter(product_id__in=removed).delete()
+        if sets:
+            upsert(
+                CartItem,
+                [CartItem(cart=cart, product_id=pid, quantity=quantity) for pid, quantity in sets.items()],
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'updated_at'],
+            )
+        if adds:
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=pid, quantity=0) for pid in adds],
+                ignore_conflicts=True,
+            )
+            cart.items.filter(product_id__in=list(adds)).update(
+                quantity=F('quantity') + _per_line(adds),
+                updated_at=now,
+            )
+        deferred_cart_totals.changed(cart.pk)
+
+    # hold what the lines now say
+    holds = {pid: 0 for pid in removed}
+    holds.update(sets)
+    if adds:
+        holds.update(cart.items.filter(product_id__in=list(adds)).values_list('product_id', 'quantity'))
+    reserve(cart, holds)
+
+
+def prefetch_cart_lines(cart):
+    # everything CartSerializer reads, in one query
+    lines = CartItem.objects.select_related('product').order_by('id')
+    prefetch_related_objects([cart], Prefetch('items', queryset=lines))
+    return cart
@@ -0,0 +1,49 @@
+"""
+Conditional GET.
+
+Views work out their validators from something cheap (cache version tokens,
+or one MAX(updated_at) aggregate) and call `not_modified` before building the
+body, so a repeat view with a matching If-None-Match / If-Modified-Since gets
+a 304 without serializing anything. Responses carry `Cache-Control: no-cache`:
+browsers keep the body but revalidate every time, which is what makes the 304s
+happen.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def latest(*timestamps):
+    """Newest of datetimes / epoch seconds as whole epoch seconds, None if none known."""
+    seconds = [
+        int(value.timestamp()) if hasattr(value, 'timestamp') else int(value)
+        for value in timestamps if value is not None
+    ]
+    return max(seconds) if seconds else None
+
+
+def set_validators(response, etag, last_modified=None, private=False):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified=None, private=False):
+    """A 304 (or 412) response if the client's copy is current, else None."""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+    if response is None:
+        return None
+    return set_validators(response, etag, last_modified, private=private)
@@ -0,0 +1,132 @@
+"""
+Catalog filters and facet counts.
+
+ProductFilter is ProductListView's filter set: ?category=, ?price__gte=,
+?price__lte= and ?in_stock= (stock that isn't held in carts, Product.available).
+
+`?facets=1`, or a list such as `?facets=category,price`, adds a `facets`
+block to product list pages: products per category, a price histogram and
+in-stock counts for the current search and filters, so the home page can
+show which filters lead anywhere before they are picked. Each facet is one
+grouped aggregate query over the filtered catalog, whatever its size, and
+ignores its own parameters: with a category picked the category counts
+still show what the other categories hold. The block is part of the list
+response and cached with it.
+"""
+from django.db.models import Count, F, Q
+from django_filters import rest_framework as django_filters
+from rest_framework.exceptions import ValidationError
+
+from .models import Product
+
+# facet -> the list parameters it ignores
+FACETS = {
+    'category': ('category',),
+    'price': ('price__gte', 'price__lte'),
+    'stock': ('in_stock',),
+}
+# lower bounds of the price buckets, the last one is open ended
+PRICE_BUCKETS = (0, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def in_stock(value=True):
+    condition = Q(stock__gt=F('reserved'))
+    return condition if value else ~condition
+
+
+class ProductFilter(django_filters.FilterSet):
+    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
+
+    class Meta:
+        model = Product
+        fields = {
+            'category': ['exact'],
+            'price': ['gte', 'lte'],
+        }
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(in_stock(value))
+
+
+def requested_facets(params):
+    """The facet names asked for with ?facets=, in FACETS order; [] when there are none."""
+    raw = params.get('facets', '').strip().lower()
+    if raw in ('', '0', 'false'):
+        return []
+    if raw in ('1', 'true', 'all'):
+        return list(FACETS)
+    names = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = names - set(FACETS)
+    if unknown:
+        raise ValidationError({'facets': [f"Unknown facet(s): {', '.join(sorted(unknown))}. "
+                                          f"Choose from {', '.join(FACETS)}."]})
+    return [name for name in FACETS if name in names]
+
+
+def _category_rows(queryset):
+    return (
+        queryset.order_by()
+        .values('category_id', 'category__name', 'category__slug')
+        .annotate(count=Count('pk'))
+        .order_by('-count', F('category__name').asc(nulls_last=True))
+    )
+
+
+def _category_facet(rows):
+    return [
+        {'id': row['category_id'], 'name': row['category__name'], 'slug': row['category__slug'], 'count': row['count']}
+        for row in rows
+    ]
+
+
+def _price_buckets():
+    return list(zip(PRICE_BUCKETS, [*PRICE_BUCKETS[1:], None]))
+
+
+def _price_counts():
+    # COUNT(*) FILTER (WHERE price >= 0 AND price < 250), ... in one pass
+    counts = {}
+    for index, (low, high) in enumerate(_price_buckets()):
+        bucket = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        counts[f'bucket_{index}'] = Count('pk', filter=bucket)
+    return counts
+
+
+def _price_facet(totals):
+    return [
+        {'min': low, 'max': high, 'count': totals[f'bucket_{index}']}
+        for index, (low, high) in enumerate(_price_buckets())
+    ]
+
+
+STOCK_COUNTS = {
+    'in_stock': Count('pk', filter=in_stock(True)),
+    'out_of_stock': Count('pk', filter=in_stock(False)),
+}
+
+
+def product_facets(filtered, names):
+    """
+    Count the `names` facets. `filtered(ignore)` returns the list's queryset
+    with its search and filters applied, less the parameters in `ignore`.
+    """
+    facets = {}
+    if 'category' in names:
+        facets['category'] = _category_facet(_category_rows(filtered(FACETS['category'])))
+    if 'price' in names:
+        facets['price'] = _price_facet(filtered(FACETS['price']).order_by().aggregate(**_price_counts()))
+    if 'stock' in names:
+        facets['stock'] = filtered(FACETS['stock']).order_by().aggregate(**STOCK_COUNTS)
+    return facets
+
+
+async def aproduct_facets(filtered, names):
+    """product_facets for the async views."""
+    facets = {}
+    if 'category' in names:
+        facets['category'] = _category_facet([row async for row in _category_rows(filtered(FACETS['category']))])
+    if 'price' in names:
+        facets['price'] = _price_facet(await filtered(FACETS['price']).order_by().aaggregate(**_price_counts()))
+    if 'stock' in names:
+        facets['stock'] = await filtered(FACETS['stock']).order_by().aaggregate(**STOCK_COUNTS)
+    return facets
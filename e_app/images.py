@@ -0,0 +1,131 @@
+"""
+Product image derivatives.
+
+Every uploaded ProductImage gets resized copies for the places it is shown:
+a thumbnail (cart lines, order rows), a card (catalog grids) and a detail
+image, each as WebP with a JPEG fallback for browsers without WebP. An upload
+queues a background job (jobs.py) that renders them with Pillow, so the
+request doesn't wait; `process_images` renders whatever is still pending,
+e.g. images uploaded before derivatives existed.
+
+The result is recorded on the row:
+
+    derivatives = {"card": {"width": 480, "height": 360,
+                            "webp": "products/derived/12/card.webp",
+                            "jpeg": "products/derived/12/card.jpg"}, ...}
+
+and copied to Product.primary_image_derivatives for the primary image, so
+list serializers can pick a size without touching the images table.
+"""
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .caching import invalidate_products, invalidate_vendor_dashboards
+from .jobs import job
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# longest edge in pixels; originals are never upscaled
+DERIVATIVE_SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1200,
+}
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVATIVE_DIR = 'products/derived'
+
+
+def derivative_name(image_id, size, extension):
+    return f"{DERIVATIVE_DIR}/{image_id}/{size}.{extension}"
+
+
+def _flatten(picture):
+    # JPEG has no alpha channel and WebP/JPEG no palettes
+    if picture.mode in ('RGBA', 'LA') or (picture.mode == 'P' and 'transparency' in picture.info):
+        picture = picture.convert('RGBA')
+        background = Image.new('RGB', picture.size, (255, 255, 255))
+        background.paste(picture, mask=picture.getchannel('A'))
+        return background
+    return picture.convert('RGB')
+
+
+def render_derivatives(product_image):
+    """Write every size and format of `product_image` to storage, return (width, height, derivatives)."""
+    storage = product_image.image.storage
+    with storage.open(product_image.image.name, 'rb') as fh:
+        with Image.open(fh) as original:
+            original = _flatten(ImageOps.exif_transpose(original))
+    derivatives = {}
+    for size, edge in DERIVATIVE_SIZES.items():
+        picture = original.copy()
+        picture.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        variant = {'width': picture.width, 'height': picture.height}
+        for key, (format_name, extension, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            picture.save(buffer, format_name, **options)
+            name = derivative_name(product_image.pk, size, extension)
+            # same name on reprocessing, not storage's "_<random>" alternative
+            storage.delete(name)
+            variant[key] = storage.save(name, ContentFile(buffer.getvalue()))
+        derivatives[size] = variant
+    return original.width, original.height, derivatives
+
+
+def process_image(image_id):
+    """Render one image's derivatives and record them; returns the new status."""
+    product_image = ProductImage.objects.filter(pk=image_id).first()
+    if product_image is None:
+        return None
+    try:
+        width, height, derivatives = render_derivatives(product_image)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError, ValueError):
+        logger.warning("could not render derivatives for product image %s", image_id, exc_info=True)
+        ProductImage.objects.filter(pk=image_id).update(derivatives_status='failed')
+        return 'failed'
+    with transaction.atomic():
+        # unless the file was replaced meanwhile
+        updated = ProductImage.objects.filter(pk=image_id, image=product_image.image.name).update(
+            width=width, height=height, derivatives=derivatives, derivatives_status='ready',
+        )
+        if updated:
+            Product.sync_primary_image(product_image.product_id)
+            invalidate_products([product_image.product_id])
+            vendor_ids = Product.objects.filter(pk=product_image.product_id).values_list('vendor_id', flat=True)
+            invalidate_vendor_dashboards(list(vendor_ids))
+    return 'ready' if updated else 'pending'
+
+
+@job('images.render_derivatives')
+def render_derivatives_job(image_id):
+    process_image(image_id)
+
+
+@receiver(pre_save, sender=ProductImage)
+def _image_replaced(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    stored = ProductImage.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+    if stored != instance.image.name:
+        instance.width = instance.height = None
+        instance.derivatives = {}
+        instance.derivatives_status = 'pending'
+        instance._image_replaced = True
+
+
+@receiver(post_save, sender=ProductImage)
+def _image_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or getattr(instance, '_image_replaced', False):
+        instance._image_replaced = False
+        render_derivatives_job.enqueue(instance.pk)
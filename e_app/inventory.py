@@ -0,0 +1,214 @@
+"""
+Stock bookkeeping.
+
+All writes are single conditional UPDATEs over the affected product rows so
+concurrent checkouts can never take stock below zero, nor below what other
+carts hold (Product.reserved, see reservations.py).
+
+Hot-SKU mode. Every checkout of a product updates its one row, so during a
+promotion checkouts of a popular product queue on that row's lock. A product
+switched to hot mode (`shard_stock`, `manage.py hot_stock`) has its
+available stock split over N StockShard rows instead. A decrement picks a
+random shard and takes the units there with a conditional UPDATE, moving on
+to the next shard when that one runs short, and only locks every shard when
+no single one can cover the quantity. Holds come out of the shards the same
+way and go back into one when released, so the product row isn't written
+by checkouts, carts or cancellations at all. `consolidate_stock`, run by
+run_worker, writes the totals back into Product.stock / reserved for
+display and evens out drained shards.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation, StockShard
+
+
+def per_product(quantities, default=None):
+    # CASE id WHEN 1 THEN 3 WHEN 7 THEN 1 ... END
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(default) if default is not None else None,
+        output_field=IntegerField(),
+    )
+
+
+def hot_products(product_ids):
+    """{product_id: shard count} for the products in hot-SKU mode among `product_ids`."""
+    return dict(Product.objects.filter(pk__in=list(product_ids), stock_shards__gt=0).values_list('pk', 'stock_shards'))
+
+
+def decrement_stock(quantities, held=None, hot=None):
+    """
+    Take {product_id: quantity} out of stock with one UPDATE that skips any row
+    without enough unreserved stock. `held` is {product_id: units} the buyer
+    holds themselves: those count as available and are released. `hot` is
+    `hot_products(quantities)` if the caller already knows it. Returns False
+    when a row was skipped; the caller must then roll back its transaction,
+    since the other rows were already updated.
+    """
+    if not quantities:
+        return True
+    held = held or {}
+    hot = hot_products(quantities) if hot is None else hot
+    plain = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in hot}
+    if plain:
+        wanted = per_product(plain)
+        credit = per_product({product_id: held[product_id] for product_id in plain if held.get(product_id)}, default=0)
+        updated = Product.objects.filter(
+            pk__in=list(plain), stock_shards=0, stock__gte=wanted + F('reserved') - credit,
+        ).update(
+            stock=F('stock') - wanted,
+            reserved=F('reserved') - credit,
+            updated_at=timezone.now(),
+        )
+        if updated != len(plain):
+            return False
+    for product_id, shards in hot.items():
+        # held units already left the shards
+        change = held.get(product_id, 0) - quantities[product_id]
+        if change < 0 and not take_from_shards(product_id, shards, -change):
+            return False
+        if change > 0:
+            return_to_shards(product_id, shards, change)
+    return True
+
+
+def increment_stock(quantities):
+    """Put {product_id: quantity} back into stock with one UPDATE, e.g. for cancelled order lines."""
+    if not quantities:
+        return
+    hot = hot_products(quantities)
+    plain = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in hot}
+    if plain:
+        Product.objects.filter(pk__in=list(plain)).update(
+            stock=F('stock') + per_product(plain),
+            updated_at=timezone.now(),
+        )
+    for product_id, shards in hot.items():
+        return_to_shards(product_id, shards, quantities[product_id])
+
+
+# hot-SKU shards
+
+def take_from_shards(product_id, shards, quantity):
+    """Take `quantity` units of a hot product, False if all its shards together don't have them."""
+    start = random.randrange(shards)
+    for offset in range(shards):
+        index = (start + offset) % shards
+        taken = StockShard.objects.filter(product_id=product_id, index=index, stock__gte=quantity).update(
+            stock=F('stock') - quantity,
+        )
+        if taken:
+            return True
+    # no single shard has enough: lock them all and take from several
+    rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+    if sum(row.stock for row in rows) < quantity:
+        return False
+    for row in rows:
+        part = min(row.stock, quantity)
+        row.stock -= part
+        quantity -= part
+    StockShard.objects.bulk_update(rows, ['stock'])
+    return True
+
+
+def return_to_shards(product_id, shards, quantity):
+    StockShard.objects.filter(product_id=product_id, index=random.randrange(shards)).update(
+        stock=F('stock') + quantity,
+    )
+
+
+def _split(total, shards):
+    return [total // shards + (1 if index < total % shards else 0) for index in range(shards)]
+
+
+def _held(product_id):
+    return StockReservation.objects.filter(product_id=product_id).aggregate(held=Sum('quantity'))['held'] or 0
+
+
+@transaction.atomic
+def shard_stock(product_id, shards):
+    """Switch a product to hot-SKU mode over `shards` shards, or re-split it over a new number."""
+    if shards < 1:
+        raise ValueError("A hot product needs at least one shard.")
+    product = Product.objects.select_for_update().get(pk=product_id)
+    if product.stock_shards:
+        available = sum(StockShard.objects.select_for_update().filter(product=product).values_list('stock', flat=True))
+    else:
+        available = max(product.stock - product.reserved, 0)
+    StockShard.objects.filter(product=product).delete()
+    StockShard.objects.bulk_create([
+        StockShard(product=product, index=index, stock=stock) for index, stock in enumerate(_split(available, shards))
+    ])
+    held = _held(product_id)
+    Product.objects.filter(pk=product_id).update(stock_shards=shards, stock=available + held, reserved=held)
+
+
+@transaction.atomic
+def unshard_stock(product_id):
+    """Leave hot-SKU mode: the shards' stock goes back into the product row."""
+    product = Product.objects.select_for_update().get(pk=product_id)
+    if not product.stock_shards:
+        return
+    available = sum(StockShard.objects.select_for_update().filter(product=product).values_list('stock', flat=True))
+    StockShard.objects.filter(product=product).delete()
+    held = _held(product_id)
+    Product.objects.filter(pk=product_id).update(stock_shards=0, stock=available + held, reserved=held)
+
+
+def restock_shards(product_id, quantity):
+    """Add `quantity` units to a hot product, spread over its shards."""
+    shards = hot_products([product_id]).get(product_id)
+    if not shards:
+        raise ValueError(f"Product {product_id} is not in hot-SKU mode.")
+    for index, part in enumerate(_split(quantity, shards)):
+        if part:
+            StockShard.objects.filter(product_id=product_id, index=index).update(stock=F('stock') + part)
+
+
+def consolidate_stock():
+    """
+    Write every hot product's shard and hold totals back into Product.stock and
+    reserved, and even out the shards of products where one ran dry. Returns the
+    ids of the products whose stock changed.
+    """
+    shard_total = StockShard.objects.filter(product=OuterRef('pk')).values('product').annotate(
+        total=Sum('stock')).values('total')
+    held_total = StockReservation.objects.filter(product=OuterRef('pk')).values('product').annotate(
+        total=Sum('quantity')).values('total')
+    rows = Product.objects.filter(stock_shards__gt=0).annotate(
+        available=Coalesce(Subquery(shard_total), 0),
+        held=Coalesce(Subquery(held_total), 0),
+    ).values('pk', 'stock', 'reserved', 'stock_shards', 'available', 'held').order_by('pk')
+
+    changed = []
+    for row in rows:
+        if (row['stock'], row['reserved']) != (row['available'] + row['held'], row['held']):
+            # recount in the UPDATE itself, and only while the product is still sharded:
+            # after unshard_stock the row holds the stock and the snapshot above is stale
+            updated = Product.objects.filter(pk=row['pk'], stock_shards__gt=0).update(
+                stock=Coalesce(Subquery(shard_total), 0) + Coalesce(Subquery(held_total), 0),
+                reserved=Coalesce(Subquery(held_total), 0),
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                continue
+            changed.append(row['pk'])
+        _rebalance(row['pk'], row['stock_shards'])
+    return changed
+
+
+@transaction.atomic
+def _rebalance(product_id, shards):
+    counts = dict(StockShard.objects.filter(product_id=product_id).values_list('index', 'stock'))
+    total = sum(counts.values())
+    if len(counts) != shards or total < shards or min(counts.values()) > 0:
+        return
+    rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+    for row, stock in zip(rows, _split(sum(row.stock for row in rows), shards)):
+        row.stock = stock
+    StockShard.objects.bulk_update(rows, ['stock'])
@@ -0,0 +1,195 @@
+"""
+Background jobs.
+
+Work that doesn't have to finish inside the request goes into the Job table
+and is run by `manage.py run_worker`. Functions become jobs with the `job`
+decorator and are queued with `enqueue` (or `<function>.enqueue(...)`):
+
+    @job('images.render')
+    def render(image_id): ...
+
+    render.enqueue(image.pk)
+
+The row is inserted in the caller's transaction, so a job queued inside
+`transaction.atomic()` only becomes visible to workers when that transaction
+commits, and disappears with it on rollback: no job ever runs against data
+that was never committed, and none is lost between commit and enqueue.
+
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it (postgres, mysql 8), so any number of worker processes share the
+queue without blocking each other; elsewhere (sqlite) a conditional UPDATE
+decides which worker gets a job. A failed job is retried with exponential
+backoff until max_attempts; a worker that dies mid-job leaves it `running`
+and another worker reclaims it once JOBS_LEASE_SECONDS has passed, or marks
+it failed if that was its last attempt, so a job that kills its worker
+isn't picked up forever. Every attempt records its duration on the row and
+in the worker's job_duration_seconds histogram.
+
+With JOBS_EAGER set (tests, a dev box without a worker) jobs still get a row
+but run in-process right after the enqueueing transaction commits.
+"""
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import registry
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 10
+BACKOFF_MAX = 60 * 60
+LEASE_SECONDS = 10 * 60
+MAX_ERROR_LENGTH = 4000
+
+_registry = {}
+
+
+class UnknownJob(LookupError):
+    pass
+
+
+def job(name, max_attempts=DEFAULT_MAX_ATTEMPTS, priority=0):
+    """Register a function as a job; it gains `.enqueue(*args, **kwargs)`."""
+    def decorator(func):
+        if name in _registry and _registry[name] is not func:
+            raise ValueError(f"Job {name!r} is already registered.")
+        _registry[name] = func
+        func.job_name = name
+        func.enqueue = lambda *args, **kwargs: enqueue(
+            name, args, kwargs, priority=priority, max_attempts=max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, args=(), kwargs=None, *, delay=None, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queue job `name`; args and kwargs must be JSON serializable."""
+    if name not in _registry:
+        raise UnknownJob(f"Unknown job {name!r}.")
+    run_at = timezone.now() + (delay or timedelta(0))
+    queued = Job.objects.create(
+        name=name, args=list(args), kwargs=kwargs or {},
+        run_at=run_at, priority=priority, max_attempts=max_attempts,
+    )
+    if getattr(settings, 'JOBS_EAGER', False):
+        using = router.db_for_write(Job)
+        transaction.on_commit(lambda: run_claimed(claim_job(queued.pk, 'eager')), using=using)
+    return queued
+
+
+def backoff(attempts):
+    """Seconds before retry number `attempts`, doubling, with jitter so retries don't line up."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.75, 1.25)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _lease_seconds():
+    return getattr(settings, 'JOBS_LEASE_SECONDS', LEASE_SECONDS)
+
+
+def _abandoned(now):
+    return Q(status='running', locked_at__lt=now - timedelta(seconds=_lease_seconds()))
+
+
+def _claimable(now, names=None):
+    ready = Q(status='queued', run_at__lte=now) | (_abandoned(now) & Q(attempts__lt=F('max_attempts')))
+    queryset = Job.objects.filter(ready)
+    if names:
+        queryset = queryset.filter(name__in=names)
+    return queryset
+
+
+def _claim_update(worker, now):
+    return dict(status='running', locked_by=worker, locked_at=now, started_at=now, attempts=F('attempts') + 1)
+
+
+def claim_jobs(worker, limit=1, names=None):
+    """Mark up to `limit` runnable jobs as running for `worker` and return them."""
+    now = timezone.now()
+    Job.objects.filter(_abandoned(now), attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, locked_by='', locked_at=None,
+        last_error="The worker running the last attempt stopped before it finished.",
+    )
+    candidates = _claimable(now, names).order_by('-priority', 'run_at', 'id')
+    connection = connections[router.db_for_write(Job)]
+    with transaction.atomic(using=connection.alias):
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(**_claim_update(worker, now))
+        else:
+            # no SKIP LOCKED: whoever's conditional UPDATE lands first gets the job
+            ids = [
+                job_id for job_id in candidates.values_list('id', flat=True)[:limit]
+                if _claimable(now).filter(id=job_id).update(**_claim_update(worker, now))
+            ]
+    return list(Job.objects.filter(id__in=ids, locked_by=worker).order_by('-priority', 'run_at', 'id'))
+
+
+def claim_job(job_id, worker):
+    now = timezone.now()
+    if Job.objects.filter(id=job_id, status='queued').update(**_claim_update(worker, now)):
+        return Job.objects.get(id=job_id)
+    return None
+
+
+def run_claimed(claimed):
+    """Run one claimed job and record the outcome: 'done', 'retry' or 'failed'."""
+    if claimed is None:
+        return None
+    func = _registry.get(claimed.name)
+    started = time.perf_counter()
+    error = None
+    try:
+        if func is None:
+            raise UnknownJob(f"Unknown job {claimed.name!r}.")
+        func(*claimed.args, **claimed.kwargs)
+    except Exception:
+        error = traceback.format_exc()[-MAX_ERROR_LENGTH:]
+    duration = time.perf_counter() - started
+    now = timezone.now()
+
+    if error is None:
+        result, changes = 'done', dict(status='done', finished_at=now, last_error='')
+    elif claimed.attempts < claimed.max_attempts and func is not None:
+        result = 'retry'
+        changes = dict(status='queued', run_at=now + timedelta(seconds=backoff(claimed.attempts)), last_error=error)
+    else:
+        result, changes = 'failed', dict(status='failed', finished_at=now, last_error=error)
+    # unless the lease ran out and another worker took the job over
+    Job.objects.filter(id=claimed.id, locked_by=claimed.locked_by).update(
+        duration_ms=duration * 1000, locked_by='', locked_at=None, **changes,
+    )
+    registry.observe_job(claimed.name, result, duration)
+    log = logger.info if result == 'done' else logger.warning
+    log("job %s #%s %s in %.1fms (attempt %s/%s)%s", claimed.name, claimed.id, result, duration * 1000,
+        claimed.attempts, claimed.max_attempts, f"\n{error}" if error else '')
+    return result
+
+
+def release_jobs(claimed):
+    """Hand claimed jobs that never started back to the queue."""
+    for job in claimed:
+        Job.objects.filter(id=job.id, locked_by=job.locked_by, status='running').update(
+            status='queued', locked_by='', locked_at=None, attempts=F('attempts') - 1,
+        )
+
+
+def prune_jobs(keep_days):
+    """Delete jobs that finished more than `keep_days` days ago."""
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    deleted, _ = Job.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff).delete()
+    return deleted
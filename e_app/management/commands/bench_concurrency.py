@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from e_app.benchmarking import run_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test running servers at increasing concurrency and compare them. To see what an "
+        "ASGI worker buys over a sync one, start one worker of each and point this at both:\n"
+        "  gunicorn ecom.wsgi:application -w 1 -b :8000\n"
+        "  gunicorn ecom.asgi:application -w 1 -k uvicorn_worker.UvicornWorker -b :8001\n"
+        "  manage.py bench_concurrency 'http://127.0.0.1:8000/api/products/?cursor=' "
+        "'http://127.0.0.1:8001/api/async/products/?cursor='"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+        parser.add_argument('--requests', type=int, default=500, help="Requests per URL and concurrency level.")
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--header', action='append', default=[], help="Extra request header, 'Name: value'.")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        headers = {}
+        for header in options['header']:
+            name, sep, value = header.partition(':')
+            if not sep:
+                raise CommandError(f"Bad header {header!r}, expected 'Name: value'.")
+            headers[name.strip()] = value.strip()
+
+        results = []
+        for url in options['urls']:
+            if options['warmup']:
+                run_load(url, concurrency=1, total=options['warmup'], headers=headers)
+            for concurrency in options['concurrency']:
+                result = run_load(url, concurrency=concurrency, total=options['requests'], headers=headers)
+                results.append(result.as_dict())
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        columns = ['concurrency', 'req_per_s', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'errors']
+        for url in options['urls']:
+            self.stdout.write(self.style.MIGRATE_HEADING(url))
+            self.stdout.write(''.join(f"{column:>12}" for column in columns))
+            for row in results:
+                if row['url'] == url:
+                    self.stdout.write(''.join(f"{str(row[column]):>12}" for column in columns))
@@ -0,0 +1,80 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from e_app.benchmarking import run_checkouts
+from e_app.inventory import consolidate_stock, shard_stock, unshard_stock
+from e_app.models import Address, Customer, Order, Product, User, Vendor
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and have many buyers check out one product at once, "
+        "first with its stock in the product row, then split over stock shards (hot-SKU mode), "
+        "and report orders per second and checkout latency for each. Run it against postgres: "
+        "sqlite takes one database-wide write lock, so shards can't help there."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=16, help="Concurrent buyers, one thread each.")
+        parser.add_argument('--orders', type=int, default=25, help="Orders per buyer and run.")
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 4, 16], help="Runs, 0 = not sharded.")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the test database between runs.")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        if options['buyers'] < 1 or options['orders'] < 1:
+            raise CommandError("--buyers and --orders must be positive.")
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            if connection.vendor == 'sqlite':
+                self.stderr.write("sqlite serialises all writes, expect no difference between the runs.")
+            results = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        columns = ['shards', 'req_per_s', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'errors', 'stock_ok']
+        self.stdout.write(f"{options['buyers']} buyers x {options['orders']} orders of one product")
+        self.stdout.write(''.join(f"{column:>12}" for column in columns))
+        for row in results:
+            self.stdout.write(''.join(f"{str(row[column]):>12}" for column in columns))
+
+    def run(self, options):
+        cache.clear()
+        runs = options['shards']
+        orders = options['buyers'] * options['orders']
+        vendor = Vendor.objects.create(user=User.objects.create(username='bench-hot-vendor', role='vendor'),
+                                       shop_name='Bench hot shop')
+        product = Product.objects.create(vendor=vendor, name='Hot product', price=10, stock=orders * len(runs))
+        buyers = []
+        for i in range(options['buyers']):
+            user = User.objects.create(username=f'bench-hot-buyer-{i}', role='customer')
+            customer = Customer.objects.create(user=user)
+            address = Address.objects.create(customer=customer, line='1 Bench St', city='Pune', state='MH',
+                                             pincode='411001', is_default=True)
+            buyers.append((customer, address))
+
+        results = []
+        for shards in runs:
+            if shards:
+                shard_stock(product.pk, shards)
+            else:
+                unshard_stock(product.pk)
+            before = Product.objects.get(pk=product.pk).stock
+            placed_before = Order.objects.count()
+            result = run_checkouts(product.pk, buyers, options['orders']).as_dict()
+            consolidate_stock()
+            sold = Order.objects.count() - placed_before
+            result['shards'] = shards
+            # every order took exactly one unit, none got lost or sold twice
+            result['stock_ok'] = Product.objects.get(pk=product.pk).stock == before - sold
+            results.append(result)
+        return results
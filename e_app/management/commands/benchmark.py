@@ -0,0 +1,102 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework.test import APIClient
+
+from e_app.benchmarking import compare_results, endpoint_scenarios, run_scenario
+from e_app.seeding import DatasetSize, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and time the main API endpoints in-process: "
+        "p50/p95/p99 latency, throughput and SQL queries per endpoint. Write the results "
+        "with --output and check a later run against them with --compare."
+    )
+
+    def add_arguments(self, parser):
+        defaults = DatasetSize()
+        for name, value in defaults.as_dict().items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=value)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=100, help="Timed requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--endpoint', action='append', default=[], help="Only run these endpoints.")
+        parser.add_argument('--cold-cache', action='store_true', help="Clear the cache before every request.")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the test database between runs.")
+        parser.add_argument('--output', help="Write results as JSON to this path.")
+        parser.add_argument('--compare', help="Baseline JSON from an earlier --output.")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed p95 slowdown, 0.2 = 20%%.")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        size = DatasetSize(**{name: options[name] for name in DatasetSize().as_dict()})
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as fh:
+                baseline = json.load(fh)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = self.run(size, options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f"REGRESSION {regression}"))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+            elif options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regression(s)")
+
+    def run(self, size, options):
+        cache.clear()
+        dataset = seed_dataset(size, seed=options['seed'])
+        scenarios = endpoint_scenarios(dataset)
+        if options['endpoint']:
+            unknown = set(options['endpoint']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['endpoint']]
+
+        client = APIClient()
+        endpoints = {}
+        for scenario in scenarios:
+            if options['cold_cache']:
+                request = scenario.request
+                scenario.request = lambda client, i, request=request: (cache.clear(), request(client, i))[1]
+            endpoints[scenario.name] = run_scenario(client, scenario, options['iterations'], options['warmup'])
+        return {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'dataset': size.as_dict(),
+                'seed': options['seed'],
+                'iterations': options['iterations'],
+                'cold_cache': options['cold_cache'],
+            },
+            'endpoints': endpoints,
+        }
+
+    def report(self, results):
+        columns = ['req_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_mean', 'queries_max', 'errors']
+        self.stdout.write(f"{'endpoint':<16}" + ''.join(f"{column:>13}" for column in columns))
+        for name, row in results['endpoints'].items():
+            self.stdout.write(f"{name:<16}" + ''.join(f"{str(row[column]):>13}" for column in columns))
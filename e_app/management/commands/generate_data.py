@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from e_app.seeding import BATCH_SIZE, DatasetSize, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the configured database with a large deterministic synthetic dataset: vendors, products "
+        "with images, customers with carts, and orders. Rows are bulk inserted in batches without "
+        "per-row signals, so millions of rows load in minutes. Run rebuild_search_index afterwards "
+        "if you pass --skip-search-index. Use a different --seed to add a second dataset next to "
+        "an existing one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendors', type=int, default=100)
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--images', type=int, default=2, help="Image rows per product.")
+        parser.add_argument('--customers', type=int, default=10_000)
+        parser.add_argument('--cart-items', type=int, default=5, help="Cart lines per customer.")
+        parser.add_argument('--orders', type=int, default=200_000)
+        parser.add_argument('--order-items', type=int, default=3, help="Lines per order.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--skip-search-index', action='store_true')
+
+    def handle(self, *args, **options):
+        size = DatasetSize(**{name: options[name] for name in DatasetSize().as_dict()})
+        if size.products and not size.vendors:
+            raise CommandError("--products needs at least one vendor.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        started = time.perf_counter()
+        last = [started]
+
+        def progress(counts):
+            now = time.perf_counter()
+            if now - last[0] >= 5 and options['verbosity'] > 0:
+                last[0] = now
+                rows = sum(counts.values())
+                self.stdout.write(f"  {rows:,} rows, {rows / (now - started):,.0f} rows/s")
+
+        dataset = seed_dataset(
+            size,
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            index_search=not options['skip_search_index'],
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - started
+        total = sum(dataset.counts.values())
+        for label, rows in dataset.counts.items():
+            self.stdout.write(f"{label:<14}{rows:>14,}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)"
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from e_app.caching import invalidate_products
+from e_app.inventory import consolidate_stock, restock_shards, shard_stock, unshard_stock
+from e_app.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch products in and out of hot-SKU mode, where their stock is split over shard rows "
+        "so concurrent checkouts don't queue on one row lock (see e_app/inventory.py). Use it "
+        "before a promotion and switch back after; without options it shows the products' shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='+', type=int)
+        parser.add_argument('--shards', type=int, help="Split the stock over this many shards.")
+        parser.add_argument('--off', action='store_true', help="Move the stock back into the product row.")
+        parser.add_argument('--restock', type=int, help="Add this many units to a hot product.")
+
+    def handle(self, *args, **options):
+        ids = options['product_ids']
+        missing = set(ids) - set(Product.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if missing:
+            raise CommandError(f"Unknown product(s): {', '.join(map(str, sorted(missing)))}")
+        if options['shards'] is not None and options['off']:
+            raise CommandError("--shards and --off don't go together.")
+        try:
+            for product_id in ids:
+                if options['off']:
+                    unshard_stock(product_id)
+                elif options['shards'] is not None:
+                    shard_stock(product_id, options['shards'])
+                if options['restock']:
+                    restock_shards(product_id, options['restock'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        consolidate_stock()
+        invalidate_products(ids)
+
+        products = Product.objects.filter(pk__in=ids).annotate(in_shards=Sum('shards__stock')).order_by('pk')
+        for product in products:
+            mode = f"{product.stock_shards} shards, {product.in_shards or 0} in shards" if product.stock_shards else "not sharded"
+            self.stdout.write(f"{product.pk} {product.name}: stock {product.stock}, reserved {product.reserved} ({mode})")
@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from e_app.images import process_image
+from e_app.models import ProductImage
+
+# images per pool task: each task's thread connects once and closes on the way out
+CHUNK_SIZE = 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Render thumbnail, card and detail derivatives (WebP + JPEG) for product images. "
+        "By default only images still pending, e.g. uploaded before derivatives existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help="Retry images that failed before.")
+        parser.add_argument('--all', action='store_true', help="Re-render every image.")
+        parser.add_argument('--product', type=int, action='append', default=[], help="Only this product's images.")
+        parser.add_argument('--workers', type=int, default=1)
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(derivatives_status__in=['pending', 'failed'] if options['failed'] else ['pending'])
+        if options['product']:
+            images = images.filter(product_id__in=options['product'])
+        image_ids = list(images.values_list('id', flat=True))
+        if options['workers'] < 1:
+            raise CommandError("--workers must be positive.")
+
+        def work(chunk):
+            try:
+                return [process_image(image_id) for image_id in chunk]
+            finally:
+                # the pool thread's own connections
+                connections.close_all()
+
+        chunks = [image_ids[start:start + CHUNK_SIZE] for start in range(0, len(image_ids), CHUNK_SIZE)]
+        started = time.perf_counter()
+        counts = {}
+        done = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            if options['workers'] > 1:
+                results = pool.map(work, chunks)
+            else:
+                results = ([process_image(image_id) for image_id in chunk] for chunk in chunks)
+            for statuses in results:
+                for status in statuses:
+                    counts[status] = counts.get(status, 0) + 1
+                reported, done = done, done + len(statuses)
+                if options['verbosity'] > 1 or done // 500 > reported // 500:
+                    self.stdout.write(f"  {done}/{len(image_ids)}")
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f"{count} {status}" for status, count in sorted(counts.items(), key=str)) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(image_ids)} image(s) in {elapsed:.1f}s: {summary}"
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from e_app.models import Product
+from e_app.search import REINDEX_BATCH_SIZE, reindex_product_ids
+
+
+class Command(BaseCommand):
+    help = "Rebuild product search documents (and the fallback term index) for every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REINDEX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+        total = 0
+        batch = []
+        for product_id in product_ids.iterator(chunk_size=options['batch_size']):
+            batch.append(product_id)
+            if len(batch) >= options['batch_size']:
+                reindex_product_ids(batch, options['batch_size'])
+                total += len(batch)
+                batch = []
+        if batch:
+            reindex_product_ids(batch, options['batch_size'])
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} products"))
@@ -0,0 +1,104 @@
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from e_app.caching import invalidate_products
+from e_app.inventory import consolidate_stock
+from e_app.jobs import claim_jobs, prune_jobs, release_jobs, run_claimed, worker_name
+from e_app.metrics import registry
+from e_app.reservations import release_expired
+
+PRUNE_INTERVAL = 60 * 60
+SWEEP_INTERVAL = 60
+CONSOLIDATE_INTERVAL = 10
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs from the Job table (see e_app/jobs.py). Start as many worker "
+        "processes as you need; they share the queue without running a job twice. "
+        "Workers also release expired stock reservations and consolidate the stock "
+        "shards of hot products. "
+        "SIGTERM / Ctrl-C finishes the current job, then exits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', action='append', default=[], help="Only run jobs with this name.")
+        parser.add_argument('--batch', type=int, default=1, help="Jobs claimed per round trip.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty.")
+        parser.add_argument('--max-jobs', type=int, default=0, help="Exit after this many jobs, 0 for no limit.")
+        parser.add_argument('--keep-days', type=float, default=7, help="Delete finished jobs older than this.")
+        parser.add_argument('--metrics-port', type=int, help="Serve job_duration_seconds for Prometheus on this port.")
+        parser.add_argument('--no-sweep', action='store_true',
+                            help="Leave expired stock reservations and stock shards to other workers.")
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1:
+            raise CommandError("--batch must be positive.")
+        worker = worker_name()
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            stopping.set()
+
+        previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self.work(worker, stopping, options)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def work(self, worker, stopping, options):
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(('', options['metrics_port']), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.stdout.write(f"Worker {worker} started.")
+        counts, done, last_prune, last_sweep, last_consolidate = {}, 0, 0.0, 0.0, 0.0
+        while not stopping.is_set():
+            if options['keep_days'] and time.monotonic() - last_prune > PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                prune_jobs(options['keep_days'])
+            if not options['no_sweep'] and time.monotonic() - last_sweep > SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                release_expired()
+            if not options['no_sweep'] and time.monotonic() - last_consolidate > CONSOLIDATE_INTERVAL:
+                last_consolidate = time.monotonic()
+                invalidate_products(consolidate_stock())
+            # like a request: drop connections that broke or outlived CONN_MAX_AGE
+            close_old_connections()
+            claimed = claim_jobs(worker, limit=options['batch'], names=options['job'] or None)
+            if not claimed:
+                if options['burst']:
+                    break
+                stopping.wait(options['sleep'])
+                continue
+            for index, job in enumerate(claimed):
+                if stopping.is_set():
+                    release_jobs(claimed[index:])
+                    break
+                result = run_claimed(job)
+                counts[result] = counts.get(result, 0) + 1
+                done += 1
+            if options['max_jobs'] and done >= options['max_jobs']:
+                break
+        close_old_connections()
+        summary = ', '.join(f"{count} {result}" for result, count in sorted(counts.items())) or 'no jobs'
+        self.stdout.write(f"Worker {worker} stopped: {summary}.")
@@ -0,0 +1,266 @@
+"""
+Request instrumentation.
+
+`MetricsMiddleware` measures every request: SQL query count and time (a
+database execute wrapper), serializer time (BaseSerializer.data, timed once
+per top-level serializer), response cache hits and misses (reported by
+caching.py and the dashboard) and total latency. Staff get the breakdown in a
+`Server-Timing` header, readable in the browser's network panel; every
+request feeds the histograms served in Prometheus text format by MetricsView,
+labelled with the DRF view and action. Requests slower than
+SLOW_REQUEST_MS are logged with the same breakdown.
+
+Metrics live in process memory, so each worker reports its own series; job
+workers serve theirs with `run_worker --metrics-port`.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+@dataclass
+class RequestMetrics:
+    queries: int = 0
+    db_time: float = 0.0
+    serializer_time: float = 0.0
+    serializer_depth: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is None:
+        return
+    if hit:
+        metrics.cache_hits += 1
+    else:
+        metrics.cache_misses += 1
+
+
+# registry
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}_total{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, labelnames, buckets
+        # labels -> [per bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, labels, value):
+        row = self.values.setdefault(labels, [0] * (len(self.buckets) + 2))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[index] += 1
+        row[-2] += 1
+        row[-1] += value
+
+    def samples(self):
+        for labels, row in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, row):
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {count}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {row[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {row[-2]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {row[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        labels = ('view', 'action')
+        self.latency = Histogram('http_request_duration_seconds', "Request latency.", labels, LATENCY_BUCKETS)
+        self.db_time = Histogram('http_request_db_duration_seconds', "SQL time per request.", labels, LATENCY_BUCKETS)
+        self.queries = Histogram('http_request_db_queries', "SQL queries per request.", labels, QUERY_BUCKETS)
+        self.serializer_time = Histogram(
+            'http_request_serializer_duration_seconds', "Serializer time per request.", labels, LATENCY_BUCKETS)
+        self.responses = Counter('http_responses', "Responses by status code.", (*labels, 'status'))
+        self.cache = Counter('http_response_cache', "Response cache lookups.", (*labels, 'result'))
+        # filled by job workers, see jobs.py
+        self.jobs = Histogram('job_duration_seconds', "Background job run time.", ('job', 'result'), LATENCY_BUCKETS)
+
+    def observe(self, view, action, status, total, metrics):
+        labels = (view, action)
+        with self.lock:
+            self.latency.observe(labels, total)
+            self.db_time.observe(labels, metrics.db_time)
+            self.queries.observe(labels, metrics.queries)
+            self.serializer_time.observe(labels, metrics.serializer_time)
+            self.responses.inc((*labels, status))
+            if metrics.cache_hits:
+                self.cache.inc((*labels, 'hit'), metrics.cache_hits)
+            if metrics.cache_misses:
+                self.cache.inc((*labels, 'miss'), metrics.cache_misses)
+
+    def observe_job(self, name, result, duration):
+        with self.lock:
+            self.jobs.observe((name, result), duration)
+
+    def render(self):
+        lines = []
+        metrics = (self.latency, self.db_time, self.queries, self.serializer_time, self.responses, self.cache, self.jobs)
+        with self.lock:
+            for metric in metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# collection
+
+def _query_timer(metrics):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics.queries += 1
+            metrics.db_time += time.perf_counter() - started
+    return wrapper
+
+
+def instrument_serializers():
+    """Time BaseSerializer.data; nested and list children only count once."""
+    data = serializers.BaseSerializer.data
+    if getattr(data.fget, 'instrumented', False):
+        return
+
+    def timed_data(self):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            return data.fget(self)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return data.fget(self)
+        finally:
+            metrics.serializer_depth -= 1
+            metrics.serializer_time += time.perf_counter() - started
+
+    timed_data.instrumented = True
+    serializers.BaseSerializer.data = property(timed_data)
+
+
+def view_labels(view_func, method):
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__name__', 'unknown'), method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return cls.__name__, actions.get(method.lower(), method.lower())
+
+
+def server_timing(total, metrics):
+    return ', '.join([
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'ser;dur={metrics.serializer_time * 1000:.1f}',
+        f'cache;desc="hit={metrics.cache_hits} miss={metrics.cache_misses}"',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class MetricsMiddleware:
+    # async capable, so async views under ASGI aren't pushed into a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        instrument_serializers()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, started = self.start(request)
+        try:
+            with self.query_timer(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start(request)
+        try:
+            with self.query_timer(metrics):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_labels(view_func, request.method)
+
+    def start(self, request):
+        metrics = RequestMetrics()
+        request._metrics_view = ('unmatched', request.method.lower())
+        return metrics, _current.set(metrics), time.perf_counter()
+
+    def query_timer(self, metrics):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(_query_timer(metrics)))
+        return stack
+
+    def finish(self, request, response, metrics, started):
+        total = time.perf_counter() - started
+        view, action = request._metrics_view
+        registry.observe(view, action, response.status_code, total, metrics)
+        # DRF puts the authenticated user back on the Django request
+        user = getattr(request, 'user', None)
+        if user is not None and getattr(user, 'is_staff', False):
+            response['Server-Timing'] = server_timing(total, metrics)
+        if total * 1000 >= getattr(settings, 'SLOW_REQUEST_MS', 1000):
+            logger.warning(
+                "slow request %s %s view=%s action=%s status=%s total=%.1fms db=%.1fms queries=%d serializer=%.1fms",
+                request.method, request.path, view, action, response.status_code, total * 1000,
+                metrics.db_time * 1000, metrics.queries, metrics.serializer_time * 1000,
+            )
+        return response
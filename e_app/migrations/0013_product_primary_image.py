@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_primary_image(apps, schema_editor):
+    Product = apps.get_model('e_app', 'Product')
+    ProductImage = apps.get_model('e_app', 'ProductImage')
+    seen = set()
+    # flagged images first, then oldest upload per product
+    for image in ProductImage.objects.order_by('product_id', '-is_primary', 'id').iterator():
+        if image.product_id in seen:
+            continue
+        seen.add(image.product_id)
+        Product.objects.filter(pk=image.product_id).update(
+            primary_image_id=image.pk,
+            primary_image_path=image.image.name,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('e_app', '0012_remove_product_e_app_produ_slug_8aca1d_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='e_app.productimage'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_primary_image, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# postgres only: weighted tsvector maintained by the database plus trigram matching on names
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE e_app_productsearchdocument ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(category, '') || ' ' || coalesce(vendor, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX e_app_search_vector_gin ON e_app_productsearchdocument USING GIN (search_vector)",
+    "CREATE INDEX e_app_search_name_trgm ON e_app_productsearchdocument USING GIN (name gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS e_app_search_name_trgm",
+    "DROP INDEX IF EXISTS e_app_search_vector_gin",
+    "ALTER TABLE e_app_productsearchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('e_app', '0014_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='e_app.product')),
+                ('name', models.TextField()),
+                ('category', models.TextField(blank=True)),
+                ('vendor', models.TextField(blank=True)),
+                ('description', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='e_app.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('term', 'product'), name='unique_search_term_product')],
+            },
+        ),
+        migrations.RunPython(_run_on_postgres(POSTGRES_FORWARD), _run_on_postgres(POSTGRES_BACKWARD)),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:52
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_vendor(apps, schema_editor):
+    # cart checkouts used to leave OrderItem.vendor empty, the dashboard now filters on it
+    OrderItem = apps.get_model('e_app', 'OrderItem')
+    Product = apps.get_model('e_app', 'Product')
+    OrderItem.objects.filter(vendor__isnull=True).update(
+        vendor=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('vendor_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('e_app', '0015_product_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_vendor, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:51
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model('e_app', 'Cart')
+    CartItem = apps.get_model('e_app', 'CartItem')
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(count=Sum('quantity')).values('count')), Value(0)),
+        subtotal=Coalesce(
+            Subquery(lines.annotate(total=Sum(F('product__price') * F('quantity'))).values('total')),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('e_app', '0016_backfill_orderitem_vendor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('e_app', '0019_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['vendor', 'status', 'id'], name='e_app_order_vendor__28afb4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['vendor', 'id'], name='e_app_order_vendor__3d3563_idx'),
+        ),
+    ]
@@ -1,10 +1,16 @@
+import contextvars
+from contextlib import contextmanager
+from functools import partial
 from django.db import models
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
-from django.utils.text import slugify
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from decimal import Decimal
 from phonenumber_field.modelfields import PhoneNumberField
+from .slugs import save_with_slug
 # Base Abstract model 
 
 class BaseModel(models.Model):
@@ -38,9 +44,9 @@ class Vendor(BaseModel):
     is_active = models.BooleanField(default=True)
     
     def save(self,*args,**kwargs):
-        if not self.slug:
-            self.slug = slugify(self.shop_name)
-        super().save(*args,**kwargs)
+        if self.slug:
+            return super().save(*args,**kwargs)
+        return save_with_slug(self,partial(super().save,*args,**kwargs),'shop_name')
             
     def __str__(self):
         return self.shop_name
@@ -64,9 +70,9 @@ class Category(BaseModel):
     slug = models.SlugField(max_length=100,unique=True,blank=True)
     
     def save(self,*args,**kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args,**kwargs)
+        if self.slug:
+            return super().save(*args,**kwargs)
+        return save_with_slug(self,partial(super().save,*args,**kwargs),'name')
     
     def __str__(self):
         return self.name
@@ -92,8 +98,17 @@ class Product(BaseModel):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10,decimal_places=2,db_index=True)
     stock = models.PositiveIntegerField()
+    # units held by StockReservation rows, maintained by reservations.py
+    reserved = models.PositiveIntegerField(default=0)
+    # hot-SKU mode: 0 keeps the stock in this row, n splits it over n StockShard rows (inventory.py)
+    stock_shards = models.PositiveSmallIntegerField(default=0)
     status = models.CharField(max_length=20,choices=PRODUCT_STATUS,default='active')
     is_active = models.BooleanField(default=True)
+    # denormalised primary image so list pages never touch the images table
+    primary_image = models.ForeignKey('ProductImage',on_delete=models.SET_NULL,null=True,blank=True,related_name='+')
+    primary_image_path = models.CharField(max_length=255,blank=True,default='')
+    # the primary image's ProductImage.derivatives, so cards can pick a size without a join
+    primary_image_derivatives = models.JSONField(null=True,blank=True)
     
     class Meta:
         indexes = [
@@ -101,7 +116,9 @@ class Product(BaseModel):
             models.Index(fields=['created_at']),
             models.Index(fields=['is_active']),
             models.Index(fields=['category','price']),
-            
+            # keyset pagination of the public catalog, see pagination.ProductKeysetPagination
+            models.Index(fields=['is_active','created_at','id']),
+            models.Index(fields=['is_active','price','id']),
             ]
         
         constraints = [
@@ -111,40 +128,127 @@ class Product(BaseModel):
             )
         ]
     
+    @classmethod
+    def from_db(cls,db,field_names,values):
+        instance = super().from_db(db,field_names,values)
+        # carts are only repriced when this changes, see _product_saved_reprice_carts
+        instance._loaded_price = instance.__dict__.get('price')
+        return instance
+    
     def save(self,*args,**kwargs):
-        if not self.slug:
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1 
-            # 2 vendors can have same product slug field this will make sure they will not duplicates 
-            while Product.objects.filter(vendor = self.vendor, slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug           
-        super().save(*args,**kwargs)
+        if self.slug:
+            return super().save(*args,**kwargs)
+        # 2 vendors can have same product slug, so it is only unique per vendor
+        return save_with_slug(self,partial(super().save,*args,**kwargs),'name',scope=('vendor_id',))
+    
+    @classmethod
+    def sync_primary_image(cls,product_id):
+        # flagged image first, otherwise the oldest upload
+        image = ProductImage.objects.filter(product_id=product_id).order_by('-is_primary','id').first()
+        cls.objects.filter(pk=product_id).update(
+            primary_image=image,
+            primary_image_path=image.image.name if image else '',
+            primary_image_derivatives=image.derivatives if image else None,
+            updated_at=timezone.now(),
+        )
+    
+    @classmethod
+    def sync_primary_images(cls,products):
+        # sync_primary_image for a whole queryset in one UPDATE, for bulk loaders
+        images = ProductImage.objects.filter(product=OuterRef('pk')).order_by('-is_primary','id')
+        products.update(
+            primary_image=Subquery(images.values('pk')[:1]),
+            primary_image_path=Coalesce(Subquery(images.values('image')[:1]),Value('')),
+            primary_image_derivatives=Subquery(images.values('derivatives')[:1]),
+            updated_at=timezone.now(),
+        )
         
+    @property
+    def available(self):
+        # available to sell: stock not held in someone's cart
+        return max(self.stock - self.reserved,0)
+    
     def __str__(self):
         return f"{self.name} ({self.vendor.shop_name})"
     
     
         
 # ProductImage
+DERIVATIVE_STATUS = (
+    ('pending','Pending'),
+    ('ready','Ready'),
+    ('failed','Failed'),
+)
+
 class ProductImage(BaseModel):
     product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name="images",db_index=True)
     image = models.ImageField(upload_to='products/')
     is_primary = models.BooleanField(default=False,db_index=True)
+    # resized copies made off the request cycle, see e_app/images.py
+    width = models.PositiveIntegerField(null=True,blank=True)
+    height = models.PositiveIntegerField(null=True,blank=True)
+    derivatives = models.JSONField(default=dict,blank=True)
+    derivatives_status = models.CharField(max_length=10,choices=DERIVATIVE_STATUS,default='pending',db_index=True)
     
     def __str__(self):
         return f"Image of {self.product.name}"
 
 
+# Search
+
+class ProductSearchDocument(models.Model):
+    # flattened text per product, on postgres a generated weighted tsvector column sits next to it
+    product = models.OneToOneField(Product,on_delete=models.CASCADE,primary_key=True,related_name='search_document')
+    name = models.TextField()
+    category = models.TextField(blank=True)
+    vendor = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Search document of {self.name}"
+
+
+class SearchTerm(models.Model):
+    # inverted index for databases without full text search (sqlite, mysql)
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name='search_terms')
+    weight = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term','product'],name='unique_search_term_product')
+        ]
+    
+    def __str__(self):
+        return f"{self.term} -> {self.product_id}"
+
+
 # Cart
 
 class Cart(BaseModel):
     customer = models.OneToOneField(Customer,on_delete=models.CASCADE,related_name="cart")
+    # maintained from CartItem/Product changes, see refresh_totals; item_count counts units
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=10,decimal_places=2,default=Decimal('0'))
     
     def total_price(self):
-        return sum((item.subtotal() for item in self.items.all()),Decimal('0'))
+        return self.subtotal
+    
+    @classmethod
+    def refresh_totals(cls,cart_ids):
+        # one UPDATE for any number of carts (ids or a values('pk') queryset),
+        # priced at the products' current prices; stamps updated_at for conditional GETs
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+        count = lines.annotate(count=Sum('quantity')).values('count')
+        subtotal = lines.annotate(total=Sum(F('product__price') * F('quantity'))).values('total')
+        if not isinstance(cart_ids,models.QuerySet):
+            cart_ids = list(cart_ids)
+        cls.objects.filter(pk__in=cart_ids).update(
+            item_count=Coalesce(Subquery(count),Value(0)),
+            subtotal=Coalesce(Subquery(subtotal),Value(Decimal('0')),output_field=MONEY_FIELD),
+            updated_at=timezone.now(),
+        )
     
     def __str__(self):
         return f"Cart of {self.customer.user.username}"
@@ -164,6 +268,33 @@ class CartItem(BaseModel):
     
     def __str__(self):
         return f"{self.product.name} X {self.quantity}"
+
+
+# a slice of a hot product's stock, see inventory.py
+class StockShard(BaseModel):
+    product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name="shards")
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('product','index')
+    
+    def __str__(self):
+        return f"{self.product_id}[{self.index}]: {self.stock}"
+
+
+# a cart line's hold on stock until expires_at, see reservations.py
+class StockReservation(BaseModel):
+    cart = models.ForeignKey(Cart,on_delete=models.CASCADE,related_name="reservations")
+    product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name="reservations")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        unique_together = ('cart','product')
+    
+    def __str__(self):
+        return f"{self.quantity} X {self.product_id} until {self.expires_at}"
     
     
 # Order 
@@ -175,6 +306,14 @@ ORDER_STATUS = (
     ('cancelled','Cancelled'),
 )
 
+MONEY_FIELD = DecimalField(max_digits=10,decimal_places=2)
+
+
+def line_total_sum():
+    # cancelled lines aren't charged
+    return Sum(F('price') * F('quantity'),filter=~Q(status='CANCELLED'),output_field=MONEY_FIELD)
+
+
 class Order(BaseModel):
     customer = models.ForeignKey(Customer,on_delete=models.CASCADE,related_name='orders')
     address = models.ForeignKey("Address",on_delete=models.SET_NULL,null=True,blank=True)
@@ -183,13 +322,36 @@ class Order(BaseModel):
     is_active = models.BooleanField(default=True)
     
     def update_total(self):
-        # Calculate the total from related order items and persist using a queryset update
-        total = sum((item.subtotal() for item in self.items.all()), Decimal('0'))
+        # Sum the stored line prices in the database and persist using a queryset update
+        total = self.items.aggregate(total=line_total_sum())['total'] or Decimal('0')
         # Update DB directly to avoid triggering save() recursion
         Order.objects.filter(pk=self.pk).update(total_amount=total)
         # Keep instance in sync
         self.total_amount = total
     
+    @classmethod
+    def refresh_totals(cls,order_ids):
+        # one UPDATE for any number of orders, each total is a correlated SUM(price * quantity)
+        totals = OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(
+            total=line_total_sum()).values('total')
+        cls.objects.filter(pk__in=list(order_ids)).update(
+            total_amount=Coalesce(Subquery(totals),Value(Decimal('0')),output_field=MONEY_FIELD)
+        )
+    
+    @classmethod
+    def refresh_statuses(cls,order_ids):
+        # one UPDATE deriving each order's status from its items, see orders.transition_items
+        items = OrderItem.objects.filter(order=OuterRef('pk'))
+        live = items.exclude(status='CANCELLED')
+        cls.objects.filter(pk__in=list(order_ids)).update(status=Case(
+            When(~Exists(items),then=F('status')),
+            When(~Exists(live),then=Value('cancelled')),
+            When(~Exists(live.exclude(status='DELIVERD')),then=Value('delivered')),
+            When(~Exists(live.exclude(status__in=['SHIPPED','DELIVERD'])),then=Value('shipped')),
+            When(Exists(live.exclude(status='PLACED')),then=Value('processing')),
+            default=Value('pending'),
+        ))
+    
     def save(self,*args,**kwargs):
         # Save normally. Do not call update_total() here to avoid recursive saves.
         super().save(*args,**kwargs)
@@ -208,11 +370,17 @@ class OrderItem(BaseModel):
     
     class Meta:
         unique_together = ('order','product')
+        indexes = [
+            # the vendor order feed, newest first, optionally by status (VendorOrderView)
+            models.Index(fields=['vendor','status','id']),
+            models.Index(fields=['vendor','id']),
+        ]
     
 
     
     def subtotal(self):
-        return self.product.price * self.quantity
+        # price is captured at checkout, later product price changes don't apply
+        return self.price * self.quantity
     
     def __str__(self):
         return f"{self.product.name} X {self.quantity}"
@@ -250,6 +418,41 @@ class Address(BaseModel):
     
     def __str__(self):
         return f"{self.line}, {self.city}"
+
+
+# Background jobs, see e_app/jobs.py
+JOB_STATUS = (
+    ('queued','Queued'),
+    ('running','Running'),
+    ('done','Done'),
+    ('failed','Failed'),
+)
+
+class Job(BaseModel):
+    name = models.CharField(max_length=100,db_index=True)
+    args = models.JSONField(default=list,blank=True)
+    kwargs = models.JSONField(default=dict,blank=True)
+    status = models.CharField(max_length=10,choices=JOB_STATUS,default='queued')
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100,blank=True,default='')
+    locked_at = models.DateTimeField(null=True,blank=True)
+    started_at = models.DateTimeField(null=True,blank=True)
+    finished_at = models.DateTimeField(null=True,blank=True)
+    # of the last attempt
+    duration_ms = models.FloatField(null=True,blank=True)
+    last_error = models.TextField(blank=True,default='')
+    
+    class Meta:
+        indexes = [
+            # the worker's claim query
+            models.Index(fields=['status','run_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
     
 # Signals
     
@@ -259,22 +462,85 @@ def  create_cart_for_customer(sender,instance,created,**kwargs):
         Cart.objects.create(customer= instance)
 
 
-# Keep order totals in sync when order items change
+# Keep the denormalised primary image on Product in sync
+@receiver(post_save, sender=ProductImage)
+def _product_image_saved(sender, instance, **kwargs):
+    Product.sync_primary_image(instance.product_id)
+
+
+@receiver(post_delete, sender=ProductImage)
+def _product_image_deleted(sender, instance, **kwargs):
+    Product.sync_primary_image(instance.product_id)
+
+
+# Keep order and cart totals in sync when their lines change
+class DeferredTotals:
+    """
+    Refresh a parent's totals when one of its lines is saved or deleted.
+    Inside `with <instance>():` the parents are only collected and refreshed
+    once, in one UPDATE, when the block exits cleanly; nested blocks hand
+    their parents to the outermost one.
+    """
+    def __init__(self, name, refresh):
+        self._pending = contextvars.ContextVar(name, default=None)
+        self._refresh = refresh
+
+    @contextmanager
+    def __call__(self):
+        pending = self._pending.get()
+        if pending is not None:
+            yield pending
+            return
+        pending = set()
+        token = self._pending.set(pending)
+        try:
+            yield pending
+        finally:
+            self._pending.reset(token)
+        if pending:
+            self._refresh(pending)
+
+    def changed(self, pk):
+        if pk is None:
+            return
+        pending = self._pending.get()
+        if pending is not None:
+            pending.add(pk)
+        else:
+            self._refresh([pk])
+
+
+deferred_order_totals = DeferredTotals('deferred_order_totals', lambda ids: Order.refresh_totals(ids))
+deferred_cart_totals = DeferredTotals('deferred_cart_totals', lambda ids: Cart.refresh_totals(ids))
+
+
 @receiver(post_save, sender=OrderItem)
 def _order_item_saved(sender, instance, created, **kwargs):
-    try:
-        order = instance.order
-        order.update_total()
-    except Exception:
-        pass
+    deferred_order_totals.changed(instance.order_id)
 
 
 @receiver(post_delete, sender=OrderItem)
 def _order_item_deleted(sender, instance, **kwargs):
     # instance.order may not be available after delete, so use order_id
-    try:
-        order = Order.objects.filter(pk=getattr(instance, 'order_id', None)).first()
-        if order:
-            order.update_total()
-    except Exception:
-        pass
\ No newline at end of file
+    deferred_order_totals.changed(instance.order_id)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def _cart_item_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        deferred_cart_totals.changed(instance.cart_id)
+
+
+@receiver(post_save, sender=Product)
+def _product_saved_reprice_carts(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if created or raw:
+        return
+    if update_fields is not None and 'price' not in update_fields:
+        return
+    # description, image or is_active edits leave cart totals (and cart ETags) alone
+    loaded = getattr(instance, '_loaded_price', None)
+    if loaded is not None and loaded == instance.price:
+        return
+    Cart.refresh_totals(Cart.objects.filter(items__product=instance).values('pk'))
+    instance._loaded_price = instance.price
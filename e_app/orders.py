@@ -0,0 +1,247 @@
+"""
+Order placement.
+
+Checkout costs the same handful of queries whatever the number of lines: one
+DELETE of the buyer's own stock holds (reservations.py), one plain SELECT
+for the products, one conditional stock UPDATE that turns those holds into
+the sale, one INSERT for the order and one bulk INSERT for its items. No
+product rows are locked: the SELECT only prices the lines and gives early,
+readable errors, and the conditional UPDATE alone keeps stock from going
+below zero or below what other carts hold, so concurrent checkouts of the
+same products don't queue behind each other's reads. When it comes up short
+the expired holds on those products are swept and it is tried once more.
+Hot-SKU products take their stock from shards instead (inventory.py). Bulk
+inserts skip the OrderItem signals, the total is computed here once.
+
+VendorOrderFilter backs the vendor order feed, whose pages are keyset pages
+over the (vendor, status, id) index on OrderItem.
+
+Vendors move their items through ITEM_TRANSITIONS with transition_items: one
+locking SELECT to tell which items can move, one conditional UPDATE for all
+of them and one UPDATE rolling the parent orders' status forward. Cancelling,
+there or through cancel_order, also puts the stock back with one grouped
+UPDATE and refreshes the totals, which don't count cancelled lines.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+import django_filters
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from .caching import invalidate_products, invalidate_vendor_dashboards
+from .inventory import decrement_stock, increment_stock
+from .models import Order, OrderItem, Product, deferred_cart_totals
+from .reservations import release_expired, take_holds
+
+
+class CheckoutError(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Unable to place the order.'
+    default_code = 'checkout_error'
+
+
+# target status -> statuses a vendor may move an item from, forward only
+ITEM_TRANSITIONS = {
+    'ACCEPTED': ('PLACED',),
+    'PACKED': ('PLACED', 'ACCEPTED'),
+    'SHIPPED': ('PLACED', 'ACCEPTED', 'PACKED'),
+    'DELIVERD': ('SHIPPED',),
+    'CANCELLED': ('PLACED', 'ACCEPTED', 'PACKED'),
+}
+# the frontend spells it correctly
+STATUS_ALIASES = {'DELIVERED': 'DELIVERD'}
+MAX_TRANSITION_ITEMS = 500
+
+
+class OrderStatusError(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Invalid status change.'
+    default_code = 'invalid_status'
+
+
+def target_status(value):
+    """Normalise a requested item status, raising OrderStatusError if items can't be moved to it."""
+    value = STATUS_ALIASES.get(str(value).upper(), str(value).upper())
+    if value not in ITEM_TRANSITIONS:
+        raise OrderStatusError(f"Invalid status value, expected one of: {', '.join(ITEM_TRANSITIONS)}.")
+    return value
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+class VendorOrderFilter(django_filters.FilterSet):
+    # ?status=PLACED,ACCEPTED&created_after=2024-01-01&created_before=2024-01-31 (inclusive days)
+    status = CharInFilter(field_name='status')
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+
+    class Meta:
+        model = OrderItem
+        fields = ['status', 'created']
+
+
+def parse_order_lines(items_payload):
+    """Validate the `items` payload of OrderView.post into {product_id: quantity}."""
+    if not isinstance(items_payload, list) or not items_payload:
+        raise CheckoutError("`items` must be a non-empty list.")
+    lines = {}
+    for idx, item in enumerate(items_payload):
+        if not isinstance(item, dict):
+            raise CheckoutError(f"Each item must include 'product_id' and 'quantity' (item index {idx}).")
+        product_id = item.get('product_id') or item.get('product')
+        quantity = item.get('quantity')
+        if product_id is None or quantity is None:
+            raise CheckoutError(f"Each item must include 'product_id' and 'quantity' (item index {idx}).")
+        try:
+            product_id = int(product_id)
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            raise CheckoutError(f"Quantity must be an integer (item index {idx}).")
+        if quantity < 1:
+            raise CheckoutError("Quantity must be at least 1.")
+        # the same product twice becomes one line, OrderItem is unique per (order, product)
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
+
+@transaction.atomic
+def place_order(customer, address, lines):
+    """Create an order for {product_id: quantity}, taking the stock in the same transaction."""
+    # holds before products, the order reservations.reserve locks them in
+    held = take_holds(customer, lines)
+    try:
+        products = _take_stock(lines, held)
+    except CheckoutError:
+        # the units may sit in other carts' expired holds nobody swept yet
+        if not release_expired(product_ids=list(lines)):
+            raise
+        products = _take_stock(lines, held)
+
+    total = sum((products[pid].price * qty for pid, qty in lines.items()), Decimal('0'))
+    order = Order.objects.create(customer=customer, address=address, total_amount=total)
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=products[product_id],
+            vendor_id=products[product_id].vendor_id,
+            quantity=quantity,
+            price=products[product_id].price,
+        )
+        for product_id, quantity in lines.items()
+    ])
+    # bulk writes send no signals: stock shows on product pages, orders on dashboards
+    invalidate_products(lines)
+    invalidate_vendor_dashboards({product.vendor_id for product in products.values()})
+    return order
+
+
+def _take_stock(lines, held):
+    """Take the order's stock, or raise CheckoutError having taken none; returns the products."""
+    products = Product.objects.in_bulk(list(lines))
+    hot = {}
+    for product_id, quantity in lines.items():
+        product = products.get(product_id)
+        if product is None:
+            raise NotFound(f"Product with id {product_id} not found.")
+        if product.stock_shards:
+            # Product.stock is only a snapshot, the shards decide
+            hot[product_id] = product.stock_shards
+            continue
+        available = product.available + held.get(product_id, 0)
+        if available < quantity:
+            raise CheckoutError(
+                f"Not enough stock for product '{product.name}' (requested {quantity}, available {available})."
+            )
+    with transaction.atomic():
+        if not decrement_stock(lines, held, hot):
+            # leaving the savepoint undoes the rows that were taken
+            raise CheckoutError("Not enough stock to place this order.")
+    return products
+
+
+@transaction.atomic
+def place_cart_order(customer, address, cart):
+    """Turn the cart into an order and empty it."""
+    lines = dict(cart.items.select_for_update().values_list('product_id', 'quantity'))
+    if not lines:
+        raise CheckoutError("Cart is empty. Provide items to order or add items to cart.")
+    order = place_order(customer, address, lines)
+    with deferred_cart_totals():
+        cart.items.all().delete()
+    return order
+
+
+def order_for_response(order_id):
+    # everything OrderSerializer touches, in two queries
+    return (
+        Order.objects
+        .select_related('customer__user', 'address__customer__user')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+        .get(pk=order_id)
+    )
+
+
+def transition_items(vendor, item_ids, target):
+    """
+    Move `vendor`'s items `item_ids` to `target` where ITEM_TRANSITIONS allows it.
+    Returns one result per id: updated, unchanged, invalid_transition or not_found.
+    """
+    sources = ITEM_TRANSITIONS[target]
+    with transaction.atomic():
+        rows = {
+            row['id']: row for row in
+            OrderItem.objects.select_for_update().filter(vendor=vendor, id__in=item_ids)
+            .values('id', 'status', 'order_id', 'product_id', 'quantity')
+        }
+        movable = [pk for pk, row in rows.items() if row['status'] in sources]
+        if movable:
+            # an update skips the OrderItem signals, the bookkeeping is done here
+            OrderItem.objects.filter(vendor=vendor, id__in=movable, status__in=sources).update(
+                status=target, updated_at=timezone.now())
+            order_ids = {rows[pk]['order_id'] for pk in movable}
+            if target == 'CANCELLED':
+                _restock([rows[pk] for pk in movable])
+                Order.refresh_totals(order_ids)
+            Order.refresh_statuses(order_ids)
+            invalidate_vendor_dashboards([vendor.pk])
+
+    moved = set(movable)
+    results = []
+    for pk in item_ids:
+        row = rows.get(pk)
+        if row is None:
+            results.append({'id': pk, 'result': 'not_found'})
+        elif pk in moved:
+            results.append({'id': pk, 'result': 'updated', 'previous_status': row['status'], 'status': target})
+        elif row['status'] == target:
+            results.append({'id': pk, 'result': 'unchanged', 'status': target})
+        else:
+            results.append({'id': pk, 'result': 'invalid_transition', 'status': row['status']})
+    return results
+
+
+@transaction.atomic
+def cancel_order(order):
+    """Cancel all of `order`'s items, which must all still be PLACED, and put their stock back."""
+    rows = list(order.items.select_for_update().values('id', 'status', 'product_id', 'quantity', 'vendor_id'))
+    if any(row['status'] != 'PLACED' for row in rows):
+        raise OrderStatusError("only placed orders can be cancelled.")
+    order.items.filter(status='PLACED').update(status='CANCELLED', updated_at=timezone.now())
+    _restock(rows)
+    Order.refresh_totals([order.pk])
+    Order.refresh_statuses([order.pk])
+    invalidate_vendor_dashboards({row['vendor_id'] for row in rows})
+
+
+def _restock(rows):
+    # one UPDATE for every product of the cancelled lines
+    quantities = defaultdict(int)
+    for row in rows:
+        quantities[row['product_id']] += row['quantity']
+    increment_stock(quantities)
+    invalidate_products(quantities)
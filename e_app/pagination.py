@@ -0,0 +1,208 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    # planner estimate instead of COUNT(*), only postgres exposes one cheaply
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seek pagination: every page is `WHERE (key) < (last seen key) ORDER BY key LIMIT n`,
+    so page 1000 costs the same as page 1 and no COUNT(*) runs unless asked for.
+    The last column of every keyset must be unique (the primary key).
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    # ?ordering= value -> keyset columns
+    keyset_orderings = {
+        '-id': ('-id',),
+    }
+    default_ordering = '-id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page_queryset(queryset, request, view)
+        self.count = self.get_count(queryset, request)
+        return self.set_page(list(page))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # the same pages for async views, rows come through the async ORM
+        page = self.get_page_queryset(queryset, request, view)
+        self.count = await sync_to_async(self.get_count)(queryset, request)
+        return self.set_page([row async for row in page])
+
+    def get_page_queryset(self, queryset, request, view):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.keyset = self.keyset_orderings[self.ordering]
+
+        values = self.decode_cursor(request, queryset)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values))
+        return queryset.order_by(*self.keyset)[:self.page_size + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_data(self, data):
+        payload = {'next': self.get_next_link()}
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['results'] = data
+        return payload
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size < 1:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param, '').strip()
+        if ordering in self.keyset_orderings:
+            return ordering
+        return self.default_ordering
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'approx':
+            return estimate_count(queryset)
+        return None
+
+    # cursor encoding
+
+    def keyset_filter(self, values):
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), per column direction
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.keyset, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, row):
+        values = []
+        for field in self.keyset:
+            value = getattr(row, field.lstrip('-'))
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        raw = json.dumps({'o': self.ordering, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            payload = json.loads(raw)
+            if payload['o'] != self.ordering or len(payload['v']) != len(self.keyset):
+                raise ValueError
+            return [
+                self.get_output_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.keyset, payload['v'])
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_output_field(self, queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+
+class ProductKeysetPagination(KeysetPagination):
+    # keysets mirror ProductListView.ordering_fields and the (is_active, x, id) indexes
+    keyset_orderings = {
+        '-created_at': ('-created_at', '-id'),
+        'created_at': ('created_at', 'id'),
+        '-price': ('-price', '-id'),
+        'price': ('price', 'id'),
+        # only available on searches, see search.search_products
+        'relevance': ('-search_rank', '-id'),
+    }
+    default_ordering = '-created_at'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param, '').strip()
+        searching = 'search_rank' in queryset.query.annotations
+        if ordering == 'relevance' or (searching and ordering not in self.keyset_orderings):
+            return 'relevance' if searching else self.default_ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class VendorOrderPagination(KeysetPagination):
+    # newest first over the (vendor, status, id) / (vendor, id) OrderItem indexes
+    page_size = 25
+
+
+# pagination for optimization
+class HomeProductPagination(PageNumberPagination):
+    """
+    Page numbers by default. Sending `?cursor=` (empty for the first page) switches
+    to keyset pages that skip the COUNT(*) and the OFFSET scan; add `count=exact`
+    or `count=approx` to get a total back.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    keyset_class = ProductKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_paginator = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset_paginator = self.keyset_class()
+            return self.keyset_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 
 class IsVendor(permissions.BasePermission):
@@ -7,4 +9,14 @@ class IsVendor(permissions.BasePermission):
 
 class IsCustomer(permissions.BasePermission):
     def has_permission(self,request,view):
-        return request.user.is_authenticated and request.user.role == "customer"
\ No newline at end of file
+        return request.user.is_authenticated and request.user.role == "customer"
+
+
+class CanScrapeMetrics(permissions.BasePermission):
+    # staff, or a scraper sending "Authorization: Metrics <METRICS_TOKEN>"
+    # (not Bearer, which the JWT authentication would try to decode)
+    def has_permission(self,request,view):
+        token = getattr(settings,'METRICS_TOKEN','')
+        if token and constant_time_compare(request.headers.get('Authorization',''),f"Metrics {token}"):
+            return True
+        return bool(request.user and request.user.is_staff)
@@ -0,0 +1,291 @@
+"""
+Vendor catalog import and export.
+
+Imports read an uploaded CSV or JSON Lines file row by row (uploads over
+FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to disk by Django, so the file is
+never held in memory) and apply it in batches of IMPORT_BATCH_SIZE, each in
+its own transaction. Rows are matched to the vendor's products by slug:
+known slugs update the product, new or missing slugs create one, with slugs
+allocated set-wise (slugs.assign_slugs). A batch costs a fixed number of
+queries: categories, existing products, bulk_create, bulk_update and the
+bookkeeping the skipped Product signals would have done (search documents,
+cart totals, cache versions). Invalid rows are reported by line number and
+don't stop the rest of the file.
+
+Exports stream `values().iterator(chunk_size=...)` through a
+StreamingHttpResponse. Under ASGI they use the async iterator, since Django
+would otherwise buffer a sync iterator whole before sending it.
+"""
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .caching import invalidate_products, invalidate_vendor_dashboards
+from .models import Cart, Category, Product
+from .search import index_products
+from .slugs import assign_slugs
+
+IMPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+FILE_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_COLUMNS = ['slug', 'name', 'description', 'price', 'stock', 'category', 'is_active']
+# empty CSV cells mean "not given" except where blank is a value
+BLANK_ALLOWED = {'description', 'category'}
+
+
+class CatalogImportError(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Unable to import the file.'
+    default_code = 'import_error'
+
+
+class ProductRowSerializer(serializers.Serializer):
+    slug = serializers.SlugField(max_length=255, required=False)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(required=False, allow_blank=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock = serializers.IntegerField(min_value=0)
+    # category slug, blank for none
+    category = serializers.CharField(required=False, allow_blank=True)
+    is_active = serializers.BooleanField(required=False)
+
+    required_on_create = ('name', 'price', 'stock')
+
+
+def file_type(name, requested=None):
+    kind = (requested or name.rsplit('.', 1)[-1]).lower()
+    kind = {'ndjson': 'jsonl'}.get(kind, kind)
+    if kind not in FILE_TYPES:
+        raise CatalogImportError(f"Unsupported file type {kind!r}, expected one of: {', '.join(FILE_TYPES)}.")
+    return kind
+
+
+# reading
+
+def read_csv(upload):
+    reader = csv.DictReader(codecs.iterdecode(upload, 'utf-8-sig'))
+    try:
+        for row in reader:
+            yield reader.line_num, {
+                key: value for key, value in row.items()
+                if key is not None and value is not None and (value != '' or key in BLANK_ALLOWED)
+            }
+    except (csv.Error, UnicodeDecodeError) as exc:
+        yield reader.line_num + 1, exc
+
+
+def read_jsonl(upload):
+    try:
+        for line_num, line in enumerate(codecs.iterdecode(upload, 'utf-8-sig'), start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as exc:
+                yield line_num, exc
+    except UnicodeDecodeError as exc:
+        yield None, exc
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+# importing
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def import_products(vendor, rows, batch_size=IMPORT_BATCH_SIZE):
+    """Apply (line, row) pairs from READERS to `vendor`'s catalog."""
+    report = ImportReport()
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        _import_batch(vendor, batch, report)
+    return report
+
+
+def _validate(batch, report):
+    valid = []
+    for line, row in batch:
+        if isinstance(row, Exception):
+            report.error(line, {'non_field_errors': [f"Unreadable row: {row}"]})
+            continue
+        if not isinstance(row, dict):
+            report.error(line, {'non_field_errors': ["Expected an object."]})
+            continue
+        serializer = ProductRowSerializer(data=row, partial=True)
+        if not serializer.is_valid():
+            report.error(line, serializer.errors)
+            continue
+        valid.append((line, serializer.validated_data))
+    return valid
+
+
+def _import_batch(vendor, batch, report):
+    rows = _validate(batch, report)
+    if not rows:
+        return
+    category_slugs = {data['category'] for _, data in rows if data.get('category')}
+    categories = Category.objects.in_bulk(category_slugs, field_name='slug') if category_slugs else {}
+    slugs = {data['slug'] for _, data in rows if data.get('slug')}
+    existing = {
+        product.slug: product
+        for product in Product.objects.filter(vendor=vendor, slug__in=slugs).select_related('category')
+    } if slugs else {}
+
+    creates, updates, fields, seen = [], [], set(), set()
+    lines = []
+    for line, data in rows:
+        slug = data.get('slug')
+        if slug and slug in seen:
+            report.error(line, {'slug': ["Duplicate slug in this batch."]})
+            continue
+        if data.get('category') and data['category'] not in categories:
+            report.error(line, {'category': [f"Unknown category {data['category']!r}."]})
+            continue
+        values = dict(data)
+        if 'category' in values:
+            values['category'] = categories.get(values['category'])
+        product = existing.get(slug)
+        if product is None:
+            missing = [name for name in ProductRowSerializer.required_on_create if name not in values]
+            if missing:
+                report.error(line, {name: ["This field is required."] for name in missing})
+                continue
+            product = Product(vendor=vendor, **values)
+            creates.append(product)
+        else:
+            values.pop('slug', None)
+            if product.stock_shards and values.get('stock', product.stock) != product.stock:
+                report.error(line, {'stock': ["Stock of this product is sharded for a sale."]})
+                continue
+            for name, value in values.items():
+                setattr(product, name, value)
+            fields.update(values)
+            updates.append(product)
+        if slug:
+            seen.add(slug)
+        product.vendor = vendor
+        lines.append(line)
+
+    try:
+        with transaction.atomic():
+            _save_batch(vendor, creates, updates, fields)
+    except IntegrityError:
+        # a concurrent import or edit took one of the slugs
+        for line in lines:
+            report.error(line, {'non_field_errors': ["Conflicting concurrent change, retry this row."]})
+        return
+    report.created += len(creates)
+    report.updated += len(updates)
+
+
+def _save_batch(vendor, creates, updates, fields):
+    assign_slugs(creates, 'name', scope=('vendor_id',))
+    Product.objects.bulk_create(creates)
+    if creates and not connections[router.db_for_write(Product)].features.can_return_rows_from_bulk_insert:
+        # mysql: the inserts come back without pks, fetch them by their (vendor, slug)
+        creates = list(Product.objects.filter(vendor=vendor, slug__in=[product.slug for product in creates])
+                       .select_related('category', 'vendor'))
+    if updates and fields:
+        now = timezone.now()
+        for product in updates:
+            product.updated_at = now
+        Product.objects.bulk_update(updates, [*fields, 'updated_at'])
+    # what the Product signals would have done row by row
+    products = creates + updates
+    index_products(products)
+    if 'price' in fields:
+        carts = Cart.objects.filter(items__product__in=[product.pk for product in updates]).values('pk')
+        Cart.refresh_totals(carts)
+    invalidate_products([product.pk for product in products])
+    invalidate_vendor_dashboards([vendor.pk])
+
+
+# exporting
+
+def export_queryset(vendor):
+    # values(), not values_list(): aiterator can't drive a values_list iterable
+    return (
+        Product.objects.filter(vendor=vendor)
+        .order_by('id')
+        .values('slug', 'name', 'description', 'price', 'stock', 'is_active', category_slug=F('category__slug'))
+    )
+
+
+def _export_row(row):
+    return {
+        'slug': row['slug'],
+        'name': row['name'],
+        'description': row['description'],
+        'price': str(row['price']),
+        'stock': row['stock'],
+        'category': row['category_slug'] or '',
+        'is_active': row['is_active'],
+    }
+
+
+def _encode(kind, rows):
+    if kind == 'jsonl':
+        return ''.join(json.dumps(_export_row(row)) + '\n' for row in rows)
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, EXPORT_COLUMNS).writerows(_export_row(row) for row in rows)
+    return buffer.getvalue()
+
+
+def _header(kind):
+    if kind != 'csv':
+        return ''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    return buffer.getvalue()
+
+
+def export_chunks(queryset, kind, chunk_size=EXPORT_CHUNK_SIZE):
+    yield _header(kind)
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield _encode(kind, chunk)
+
+
+async def aexport_chunks(queryset, kind, chunk_size=EXPORT_CHUNK_SIZE):
+    yield _header(kind)
+    chunk = []
+    async for row in queryset.aiterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield _encode(kind, chunk)
+            chunk = []
+    if chunk:
+        yield _encode(kind, chunk)
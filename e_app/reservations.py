@@ -0,0 +1,193 @@
+"""
+Stock reservations.
+
+A cart line holds its quantity of the product for RESERVATION_TTL seconds
+(15 minutes by default); every change to the cart renews the cart's holds.
+Product.reserved is the sum of the holds on a product, so what is left to
+sell is `stock - reserved` on the product row itself (Product.available)
+and the catalog shows it without touching the reservations table.
+
+Holds are taken the way checkout takes stock (inventory.py): one conditional
+UPDATE that only raises `reserved` where `stock - reserved` covers it, so two
+carts can never hold the same last unit; a cart that can't get its units
+fails right away instead of at checkout. Checkout credits the buyer's own
+holds and turns them into the sale (inventory.decrement_stock). Expired holds
+stay counted until release_expired deletes them, in batches, from run_worker.
+Holds on hot-SKU products come out of their stock shards instead and leave
+the product row alone (inventory.py).
+
+Hold changes refresh the product's cached detail page, but cached list pages
+only when the product sells out or comes back: during a sale every cart
+click would otherwise flush the whole catalog cache. List cards may show a
+slightly stale `available` until the next product write.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .caching import invalidate_products
+from .inventory import hot_products, per_product, return_to_shards, take_from_shards
+from .models import Cart, Product, StockReservation
+from .upserts import upsert
+
+RESERVATION_TTL = 15 * 60
+RELEASE_BATCH_SIZE = 500
+
+
+class ReservationError(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Not enough stock available right now.'
+    default_code = 'out_of_stock'
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'RESERVATION_TTL', RESERVATION_TTL))
+
+
+def _hold(increases):
+    """Hold {product_id: units} where enough is unreserved; False, having held nothing, if any product is short."""
+    hot = hot_products(increases)
+    plain = {pid: units for pid, units in increases.items() if pid not in hot}
+    with transaction.atomic():
+        if plain:
+            wanted = per_product(plain)
+            updated = Product.objects.filter(pk__in=list(plain), stock_shards=0, stock__gte=F('reserved') + wanted).update(
+                reserved=F('reserved') + wanted,
+                # availability changed: other carts' and dashboards' validators read updated_at
+                updated_at=timezone.now(),
+            )
+            held = updated == len(plain)
+        else:
+            held = True
+        held = held and all(take_from_shards(pid, shards, increases[pid]) for pid, shards in hot.items())
+        if not held:
+            # undo the products that did have enough
+            transaction.set_rollback(True)
+    return held
+
+
+def _unhold(releases):
+    """Give {product_id: units} back, one UPDATE for all plain products."""
+    hot = hot_products(releases)
+    plain = {pid: units for pid, units in releases.items() if pid not in hot}
+    if plain:
+        Product.objects.filter(pk__in=list(plain)).update(
+            reserved=F('reserved') - per_product(plain),
+            updated_at=timezone.now(),
+        )
+    for pid, shards in hot.items():
+        return_to_shards(pid, shards, releases[pid])
+
+
+def reserve(cart, quantities):
+    """
+    Make `cart`'s holds match {product_id: quantity} (0 drops the hold) and renew
+    all of its holds. Raises ReservationError, for the caller to roll back, when
+    the units asked for aren't there. Must run inside the caller's transaction.
+    """
+    for attempt in range(2):
+        current = dict(
+            StockReservation.objects.select_for_update()
+            .filter(cart=cart, product_id__in=list(quantities)).values_list('product_id', 'quantity')
+        )
+        deltas = {pid: quantity - current.get(pid, 0) for pid, quantity in quantities.items()}
+        increases = {pid: delta for pid, delta in deltas.items() if delta > 0}
+        if not increases or _hold(increases):
+            break
+        if attempt:
+            raise ReservationError(_shortage_message(increases))
+        # the units may be held by expired holds nobody swept yet, this cart's included
+        release_expired(product_ids=list(increases))
+    decreases = {pid: -delta for pid, delta in deltas.items() if delta < 0}
+    if decreases:
+        _unhold(decreases)
+
+    expires_at = timezone.now() + _ttl()
+    dropped = [pid for pid, quantity in quantities.items() if not quantity and pid in current]
+    if dropped:
+        cart.reservations.filter(product_id__in=dropped).delete()
+    kept = {pid: quantity for pid, quantity in quantities.items() if quantity}
+    if kept:
+        upsert(
+            StockReservation,
+            [StockReservation(cart=cart, product_id=pid, quantity=quantity, expires_at=expires_at)
+             for pid, quantity in kept.items()],
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'expires_at', 'updated_at'],
+        )
+    cart.reservations.exclude(product_id__in=list(kept)).update(expires_at=expires_at)
+    _invalidate({**increases, **{pid: -units for pid, units in decreases.items()}})
+    return expires_at
+
+
+def _invalidate(changes):
+    # changes: {product_id: units held more (or fewer, negative)}, already applied
+    if not changes:
+        return
+    crossed = False
+    for pid, stock, reserved in Product.objects.filter(pk__in=list(changes), stock_shards=0).values_list(
+            'pk', 'stock', 'reserved'):
+        after = stock - reserved
+        crossed = crossed or (after > 0) != (after + changes[pid] > 0)
+    # hot products' rows only change when consolidate_stock runs, which invalidates them then
+    invalidate_products(changes, lists=crossed)
+
+
+def _shortage_message(increases):
+    for product in Product.objects.filter(pk__in=list(increases)).only('name', 'stock', 'reserved'):
+        if product.available < increases[product.pk]:
+            return f"Only {product.available} more of '{product.name}' available right now."
+    return ReservationError.default_detail
+
+
+def take_holds(customer, product_ids):
+    """Remove `customer`'s holds on `product_ids` for checkout, returning {product_id: units} to credit."""
+    holds = StockReservation.objects.select_for_update().filter(cart__customer=customer, product_id__in=list(product_ids))
+    held = dict(holds.values_list('product_id', 'quantity'))
+    if held:
+        holds.delete()
+    return held
+
+
+def _release(rows):
+    quantities = defaultdict(int)
+    for product_id, quantity in rows:
+        quantities[product_id] += quantity
+    if quantities:
+        _unhold(quantities)
+        _invalidate({pid: -units for pid, units in quantities.items()})
+
+
+def release_expired(batch_size=RELEASE_BATCH_SIZE, product_ids=None):
+    """Delete expired holds batch by batch and give their units back; returns how many were released."""
+    skip_locked = connections[router.db_for_write(StockReservation)].features.has_select_for_update_skip_locked
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+            if product_ids is not None:
+                expired = expired.filter(product_id__in=product_ids)
+            # holds a checkout or cart change is working on are left for the next round
+            locked = expired.select_for_update(skip_locked=skip_locked)
+            rows = list(locked.order_by('id').values_list('id', 'product_id', 'quantity')[:batch_size])
+            if not rows:
+                return released
+            StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+            _release([row[1:] for row in rows])
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
+
+
+@receiver(pre_delete, sender=Cart)
+def _cart_deleted(sender, instance, **kwargs):
+    # the cascade would drop the holds without giving the units back
+    _release(instance.reservations.values_list('product_id', 'quantity'))
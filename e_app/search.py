@@ -0,0 +1,225 @@
+"""
+Product search.
+
+Every product has a ProductSearchDocument holding its name, category name,
+vendor shop name and description. On postgres the document carries a weighted
+tsvector column (generated by the database, see migration 0015) and a trigram
+index on the name; elsewhere we keep our own inverted index in SearchTerm.
+Either way `search_products` returns the queryset filtered to matches and
+annotated with `search_rank`.
+"""
+import re
+from collections import Counter
+
+from django.db import connections
+from django.db.models import BooleanField, DecimalField, Exists, OuterRef, Q, Subquery, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+from .models import Category, Product, ProductSearchDocument, SearchTerm, Vendor
+from .upserts import upsert
+
+# relative weight of each document field in the fallback index (A/B/B/C on postgres)
+FIELD_WEIGHTS = {
+    'name': 8,
+    'category': 4,
+    'vendor': 4,
+    'description': 1,
+}
+# Product fields the document is built from
+INDEXED_FIELDS = frozenset({'name', 'description', 'category', 'category_id', 'vendor', 'vendor_id'})
+MAX_QUERY_TERMS = 8
+REINDEX_BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the to with'.split()
+)
+
+
+def stem(token):
+    # cheap plural folding so "shirts" finds "shirt"; the index and queries agree on it
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    for token in TOKEN_RE.findall((text or '').lower()):
+        if len(token) < 2 or token in STOP_WORDS:
+            continue
+        yield stem(token)[:64]
+
+
+def uses_postgres(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+# indexing
+
+def build_document(product):
+    return ProductSearchDocument(
+        product=product,
+        name=product.name,
+        category=product.category.name if product.category_id else '',
+        vendor=product.vendor.shop_name,
+        description=product.description or '',
+    )
+
+
+def build_terms(document):
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(getattr(document, field)):
+            weights[token] += weight
+    return [
+        SearchTerm(term=term, product_id=document.product_id, weight=weight)
+        for term, weight in weights.items()
+    ]
+
+
+def index_products(products):
+    """(Re)build search documents for the given products in a handful of queries."""
+    if not products:
+        return
+    documents = [build_document(product) for product in products]
+    upsert(
+        ProductSearchDocument,
+        documents,
+        unique_fields=['product'],
+        update_fields=['name', 'category', 'vendor', 'description', 'updated_at'],
+    )
+    if uses_postgres():
+        # search_vector is a generated column, nothing else to maintain
+        return
+    product_ids = [document.product_id for document in documents]
+    SearchTerm.objects.filter(product_id__in=product_ids).delete()
+    SearchTerm.objects.bulk_create(
+        [term for document in documents for term in build_terms(document)],
+        batch_size=1000,
+    )
+
+
+def reindex_product_ids(product_ids, batch_size=REINDEX_BATCH_SIZE):
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        index_products(list(
+            Product.objects.filter(pk__in=batch).select_related('category', 'vendor')
+        ))
+
+
+# keep documents fresh
+
+@receiver(post_save, sender=Product)
+def _product_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # stock, price and image saves don't touch the document
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    if not created and _is_current(build_document(instance)):
+        return
+    index_products([instance])
+
+
+def _is_current(document):
+    return ProductSearchDocument.objects.filter(
+        pk=document.product_id,
+        name=document.name,
+        category=document.category,
+        vendor=document.vendor,
+        description=document.description,
+    ).exists()
+
+
+@receiver(post_save, sender=Category)
+def _category_saved(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    # only documents that still carry the old name
+    stale = ProductSearchDocument.objects.filter(
+        product__category=instance).exclude(category=instance.name)
+    reindex_product_ids(stale.values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=Vendor)
+def _vendor_saved(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    stale = ProductSearchDocument.objects.filter(
+        product__vendor=instance).exclude(vendor=instance.shop_name)
+    reindex_product_ids(stale.values_list('product_id', flat=True))
+
+
+# querying
+
+def _postgres_search(queryset, query):
+    documents = ProductSearchDocument.objects.filter(product=OuterRef('pk'))
+    matches = documents.filter(RawSQL(
+        "search_vector @@ websearch_to_tsquery('english', %s) OR %s <%% name",
+        (query, query),
+        output_field=BooleanField(),
+    ))
+    # rounded so the rank survives a round trip through a pagination cursor
+    rank = documents.annotate(rank=RawSQL(
+        "ROUND((ts_rank_cd(search_vector, websearch_to_tsquery('english', %s)) "
+        "+ word_similarity(%s, name))::numeric, 6)",
+        (query, query),
+        output_field=DecimalField(max_digits=12, decimal_places=6),
+    )).values('rank')[:1]
+    return queryset.filter(Exists(matches)).annotate(search_rank=Subquery(rank))
+
+
+def _term_lookup(token, prefix):
+    # the last word is still being typed, let it match as a prefix
+    if prefix and len(token) >= 3:
+        return Q(term__startswith=token)
+    return Q(term=token)
+
+
+def _fallback_search(queryset, query):
+    tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not tokens:
+        return queryset.none()
+    any_term = Q()
+    for position, token in enumerate(tokens):
+        lookup = _term_lookup(token, prefix=position == len(tokens) - 1)
+        # every word has to match somewhere in the document
+        queryset = queryset.filter(Exists(
+            SearchTerm.objects.filter(lookup, product=OuterRef('pk'))
+        ))
+        any_term |= lookup
+    rank = (
+        SearchTerm.objects.filter(any_term, product=OuterRef('pk'))
+        .values('product').annotate(score=Sum('weight')).values('score')
+    )
+    return queryset.annotate(search_rank=Coalesce(Subquery(rank), 0))
+
+
+def search_products(queryset, query):
+    """Filter a Product queryset to `query` matches ordered by relevance."""
+    query = query.strip()
+    if not query:
+        return queryset
+    if uses_postgres(queryset.db):
+        queryset = _postgres_search(queryset, query)
+    else:
+        queryset = _fallback_search(queryset, query)
+    return queryset.order_by('-search_rank', '-id')
+
+
+class ProductSearchFilter(filters.BaseFilterBackend):
+    """Drop-in for SearchFilter on ProductListView, same `?search=` parameter."""
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        return search_products(queryset, request.query_params.get(self.search_param, ''))
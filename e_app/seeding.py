@@ -0,0 +1,247 @@
+"""
+Synthetic datasets.
+
+`seed_dataset` fills a database with vendors, products with image rows,
+customers with addresses and carts, and past orders. Rows are generated
+lazily and go in through bulk inserts, one transaction per batch, so millions
+of rows stream through in bounded memory. Per-row signals and Product.save's
+slug loop are skipped: slugs are numbered in memory the way Product.save
+would number them, after one pass over the slugs already in the table so a
+second dataset doesn't reuse them, and the denormalised columns (primary
+images, search documents, cart and order totals) are filled set-wise once
+per batch. The same seed on the same starting database always produces the
+same data. Bulk inserts need a backend that returns primary keys (postgres,
+sqlite).
+"""
+import random
+import re
+from array import array
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils.text import slugify
+
+from .models import (
+    Address, Cart, CartItem, Category, Customer, Order, OrderItem, Product, ProductImage, User, Vendor,
+)
+from .search import index_products
+
+SEED_PASSWORD = 'Bench@123'
+BATCH_SIZE = 2000
+# users and products kept on the returned Dataset to drive requests with
+SAMPLE_SIZE = 1000
+
+CATEGORIES = ['Shirts', 'Shoes', 'Watches', 'Bags', 'Phones', 'Laptops', 'Books', 'Toys', 'Kitchen', 'Garden']
+ADJECTIVES = ['Classic', 'Slim', 'Vintage', 'Sport', 'Premium', 'Organic', 'Compact', 'Wireless', 'Leather', 'Cotton']
+NOUNS = ['Shirt', 'Sneaker', 'Watch', 'Backpack', 'Phone', 'Laptop', 'Novel', 'Puzzle', 'Kettle', 'Planter']
+CITIES = ['Mumbai', 'Delhi', 'Pune', 'Chennai', 'Kolkata', 'Jaipur']
+
+
+@dataclass
+class DatasetSize:
+    vendors: int = 5
+    products: int = 500
+    images: int = 1
+    customers: int = 20
+    cart_items: int = 5
+    orders: int = 200
+    order_items: int = 3
+
+    def as_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class Dataset:
+    vendor_users: list
+    customer_users: list
+    product_ids: list
+    product_slugs: list
+    category_ids: list
+    address_ids: dict
+    # model name -> rows inserted
+    counts: dict = field(default_factory=dict)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Seeder:
+    def __init__(self, size, seed=0, batch_size=BATCH_SIZE, index_search=True, progress=None):
+        self.size = size
+        self.seed = seed
+        self.batch_size = batch_size
+        self.index_search = index_search
+        self.progress = progress
+        self.rng = random.Random(seed)
+        self.password = make_password(SEED_PASSWORD)
+        self.counts = {}
+        # one slot per product / customer, compact so millions of rows stay cheap
+        self.product_ids = array('q')
+        self.product_cents = array('q')
+        self.product_vendors = array('q')
+        self.customer_ids = array('q')
+        self.address_ids = array('q')
+
+    def insert(self, model, objects, label=None):
+        objects = model.objects.bulk_create(objects)
+        label = label or model._meta.model_name
+        self.counts[label] = self.counts.get(label, 0) + len(objects)
+        return objects
+
+    def stream(self, objects, handle):
+        """Run `handle(batch)` over `objects` a batch at a time, each batch in its own transaction."""
+        for batch in batched(objects, self.batch_size):
+            with transaction.atomic():
+                handle(batch)
+            if self.progress:
+                self.progress(dict(self.counts))
+
+    def pick_products(self, count):
+        return self.rng.sample(range(len(self.product_ids)), min(count, len(self.product_ids)))
+
+    def run(self):
+        size, seed, rng = self.size, self.seed, self.rng
+        categories = self.insert(Category, [
+            Category(name=f"{name} {seed}", slug=slugify(f"{name} {seed}")) for name in CATEGORIES
+        ])
+
+        vendors, vendor_users = [], []
+
+        def add_vendors(users):
+            users = self.insert(User, users, 'user')
+            vendors.extend(self.insert(Vendor, [
+                Vendor(user=user, shop_name=f"Bench Shop {seed}-{user.username.rsplit('-', 1)[1]}",
+                       slug=f"bench-shop-{seed}-{user.username.rsplit('-', 1)[1]}")
+                for user in users
+            ]))
+            vendor_users.extend(users[:SAMPLE_SIZE - len(vendor_users)])
+
+        self.stream(
+            (User(username=f"bench-vendor-{seed}-{i}", password=self.password, role='vendor')
+             for i in range(size.vendors)),
+            add_vendors,
+        )
+
+        sample = []
+
+        def add_products(products):
+            products = self.insert(Product, products)
+            for product in products:
+                self.product_ids.append(product.pk)
+                self.product_cents.append(int(product.price * 100))
+                self.product_vendors.append(product.vendor_id)
+            if size.images:
+                self.insert(ProductImage, [
+                    ProductImage(product=product, image=f"products/bench-{product.pk}-{n}.jpg", is_primary=n == 0)
+                    for product in products for n in range(size.images)
+                ])
+                Product.sync_primary_images(Product.objects.filter(pk__in=[product.pk for product in products]))
+            if self.index_search:
+                index_products(products)
+            sample.extend(products[:SAMPLE_SIZE - len(sample)])
+
+        if vendors:
+            self.stream(self.products(vendors, categories), add_products)
+
+        customer_users, sample_addresses = [], {}
+
+        def add_customers(users):
+            users = self.insert(User, users, 'user')
+            customers = self.insert(Customer, [Customer(user=user) for user in users])
+            addresses = self.insert(Address, [
+                Address(customer=customer, line=f"{n} Bench Street", city=rng.choice(CITIES), state='MH',
+                        pincode=f"{400000 + n % 100000}", is_default=True)
+                for n, customer in enumerate(customers, start=len(self.customer_ids))
+            ])
+            carts = self.insert(Cart, [Cart(customer=customer) for customer in customers])
+            if self.product_ids:
+                self.insert(CartItem, [
+                    CartItem(cart=cart, product_id=self.product_ids[index], quantity=rng.randint(1, 3))
+                    for cart in carts for index in self.pick_products(size.cart_items)
+                ])
+                Cart.refresh_totals([cart.pk for cart in carts])
+            for customer, address in zip(customers, addresses):
+                self.customer_ids.append(customer.pk)
+                self.address_ids.append(address.pk)
+                if len(sample_addresses) < SAMPLE_SIZE:
+                    sample_addresses[customer.user_id] = address.pk
+            customer_users.extend(users[:SAMPLE_SIZE - len(customer_users)])
+
+        self.stream(
+            (User(username=f"bench-customer-{seed}-{i}", password=self.password, role='customer')
+             for i in range(size.customers)),
+            add_customers,
+        )
+
+        def add_orders(orders):
+            orders = self.insert(Order, orders)
+            self.insert(OrderItem, [
+                OrderItem(order=order, product_id=self.product_ids[index], vendor_id=self.product_vendors[index],
+                          quantity=rng.randint(1, 4), price=Decimal(self.product_cents[index]) / 100)
+                for order in orders for index in self.pick_products(size.order_items)
+            ])
+            Order.refresh_totals([order.pk for order in orders])
+
+        if self.customer_ids and self.product_ids:
+            self.stream(self.orders(), add_orders)
+
+        return Dataset(
+            vendor_users=vendor_users,
+            customer_users=customer_users,
+            product_ids=[product.pk for product in sample],
+            product_slugs=[product.slug for product in sample],
+            category_ids=[category.pk for category in categories],
+            address_ids=sample_addresses,
+            counts=dict(self.counts),
+        )
+
+    def products(self, vendors, categories):
+        rng = self.rng
+        # base slug -> next suffix, numbered base, base-1, base-2... as Product.save does, but across
+        # all vendors, since the public detail route looks products up by slug alone
+        taken = self.slug_suffixes()
+        for i in range(self.size.products):
+            vendor = vendors[i % len(vendors)]
+            name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+            base = slugify(name)
+            n = taken.get(base, 0)
+            taken[base] = n + 1
+            yield Product(
+                vendor=vendor,
+                category=rng.choice(categories),
+                name=name,
+                slug=f"{base}-{n}" if n else base,
+                description=f"{name} from the {vendor.shop_name} catalog.",
+                price=Decimal(rng.randint(100, 500000)) / 100,
+                # plenty, so order benchmarks never run out
+                stock=1_000_000,
+            )
+
+    def slug_suffixes(self):
+        # next free suffix per generated base among existing products; one streamed pass, where
+        # slugs.assign_slugs would re-read every slug sharing these few bases for each batch
+        bases = {slugify(f"{adjective} {noun}") for adjective in ADJECTIVES for noun in NOUNS}
+        pattern = re.compile(r'^(.*?)(?:-(\d+))?$')
+        taken = {}
+        for slug in Product.objects.values_list('slug', flat=True).iterator(chunk_size=self.batch_size):
+            match = pattern.match(slug)
+            if match[1] in bases:
+                taken[match[1]] = max(taken.get(match[1], 0), int(match[2] or 0) + 1)
+        return taken
+
+    def orders(self):
+        for i in range(self.size.orders):
+            slot = i % len(self.customer_ids)
+            yield Order(customer_id=self.customer_ids[slot], address_id=self.address_ids[slot], total_amount=0)
+
+
+def seed_dataset(size=None, seed=0, **options):
+    """Insert a deterministic dataset; `options` are passed to Seeder (batch_size, index_search, progress)."""
+    return Seeder(size or DatasetSize(), seed, **options).run()
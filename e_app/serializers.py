@@ -1,9 +1,36 @@
 from rest_framework import serializers
 from .models import (User,Product,Payment,ProductImage,Order,OrderItem,Address,Cart,CartItem,Category,Customer,Vendor)
-from decimal import Decimal
 from django.db import transaction
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import token_for_user,user_with_profiles
+from .orders import MAX_TRANSITION_ITEMS,OrderStatusError,target_status
+
+
+def product_image_url(path,request=None):
+    # path is the stored name of the image file, e.g. Product.primary_image_path
+    if not path:
+        return None
+    url = ProductImage._meta.get_field('image').storage.url(path)
+    if request:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def sized_image_url(path,derivatives,size,request=None):
+    # JPEG of one derivative size (see e_app/images.py), the original until they are rendered
+    variant = (derivatives or {}).get(size)
+    return product_image_url(variant['jpeg'] if variant else path,request)
+
+
+def image_srcset(derivatives,request=None,kind='webp'):
+    if not derivatives:
+        return None
+    widths = {}
+    for variant in derivatives.values():
+        widths.setdefault(variant['width'],variant[kind])
+    return ", ".join(f"{product_image_url(path,request)} {width}w" for width,path in sorted(widths.items()))
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -18,24 +45,39 @@ class VendorSerializer(serializers.ModelSerializer):
 
 class VendorOrderSerializer(serializers.ModelSerializer):
     product = serializers.CharField(source = 'product.name',read_only=True)
-    customer = serializers.CharField(source = 'order.customer.username',read_only=True)
+    customer = serializers.CharField(source = 'order.customer.user.username',read_only=True)
     order_id = serializers.IntegerField(source='order.id',read_only=True)
     total_amount = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = OrderItem
-        fields = ['id','order_id','product','customer','quantity','total_amount','status','price','image']
+        fields = ['id','order_id','product','customer','quantity','total_amount','status','price','image','image_srcset']
         
     def get_total_amount(self,obj):
-        return obj.quantity * obj.product.price
+        return obj.subtotal()
     
     def get_image(self,obj):
-        primary_image = obj.product.images.filter(is_primary=True).first() or obj.product.images.first()
-        if primary_image:
-            request = self.context.get('request')
-            return request.build_absolute_uri(primary_image.image.url)
-        return None
+        product = obj.product
+        return sized_image_url(product.primary_image_path,product.primary_image_derivatives,'thumb',self.context.get('request'))
+    
+    def get_image_srcset(self,obj):
+        return image_srcset(obj.product.primary_image_derivatives,self.context.get('request'))
+
+class OrderItemStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1),min_length=1,max_length=MAX_TRANSITION_ITEMS)
+    status = serializers.CharField()
+    
+    def validate_ids(self,value):
+        # keep the caller's order for the per-item results
+        return list(dict.fromkeys(value))
+    
+    def validate_status(self,value):
+        try:
+            return target_status(value)
+        except OrderStatusError as exc:
+            raise serializers.ValidationError(exc.detail)
 
 class CustomerSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -51,11 +93,24 @@ class CategorySerializer(serializers.ModelSerializer):
         
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(use_url=True)
+    variants = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = ProductImage
-        fields = ['id','product','image','is_primary']
-        read_only_fields = ['id']
+        fields = ['id','product','image','is_primary','width','height','derivatives_status','variants','srcset']
+        read_only_fields = ['id','width','height','derivatives_status']
+    
+    def get_variants(self,obj):
+        # {"thumb": {"width", "height", "webp", "jpeg"}, "card": ..., "detail": ...}
+        request = self.context.get('request')
+        return {
+            size: {**variant,'webp':product_image_url(variant['webp'],request),'jpeg':product_image_url(variant['jpeg'],request)}
+            for size,variant in obj.derivatives.items()
+        }
+    
+    def get_srcset(self,obj):
+        return image_srcset(obj.derivatives,self.context.get('request'))
     
     def get_image(self,obj):
         request = self.context.get('request')
@@ -65,18 +120,18 @@ class ProductImageSerializer(serializers.ModelSerializer):
         
 class ProductListSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+    # derivative served as `image`
+    image_size = 'card'
     class Meta:
         model = Product 
-        fields = ['id', 'name','slug', 'price', 'image']
+        fields = ['id', 'name','slug', 'price', 'available', 'image','image_srcset']
         
     def get_image(self,obj):
-        primary_image = obj.images.filter(is_primary=True).first() or obj.images.first()
-        if primary_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(primary_image.image.url)
-            return primary_image.image.url
-        return None      
+        return sized_image_url(obj.primary_image_path,obj.primary_image_derivatives,self.image_size,self.context.get('request'))
+    
+    def get_image_srcset(self,obj):
+        return image_srcset(obj.primary_image_derivatives,self.context.get('request'))
 
 class ProductDetailSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
@@ -87,7 +142,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     category_id = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(),source='category',write_only=True,required=False,allow_null=True)
     class Meta:
         model = Product
-        fields = ['id','vendor','vendor_id','category_id','category','name','slug','description','price','stock','status','is_active','images']
+        fields = ['id','vendor','vendor_id','category_id','category','name','slug','description','price','stock','available','status','is_active','images']
         read_only_fields = ['id','slug','vendor','status','is_active']
         
     # handling img url 
@@ -105,13 +160,23 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         validated_data["vendor"] = self.context["request"].user.vendor_profile
         return super().create(validated_data)
         
+# compact product for cart lines, reads only Product columns
+class CartProductSerializer(ProductListSerializer):
+    image_size = 'thumb'
+    class Meta(ProductListSerializer.Meta):
+        fields = ['id','name','slug','price','stock','available','image','image_srcset']
+
 class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductDetailSerializer(read_only=True)
+    product = CartProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(),source='product',write_only=True)
     cart_id = serializers.PrimaryKeyRelatedField(queryset=Cart.objects.all(),source='cart',write_only=True)
+    subtotal = serializers.SerializerMethodField()
     class Meta:
         model = CartItem
-        fields = ['id','product','product_id','cart_id','quantity']
+        fields = ['id','product','product_id','cart_id','quantity','subtotal']
+    
+    def get_subtotal(self,obj):
+        return str(obj.subtotal())
     
     def validate_quantity(self, value):
         if value < 1:
@@ -119,15 +184,13 @@ class CartItemSerializer(serializers.ModelSerializer):
         return value
         
 class CartSerializer(serializers.ModelSerializer):
+    # expects items prefetched with their products, see CartView.get
     items = CartItemSerializer(many=True,read_only = True)
-    total_price = serializers.SerializerMethodField()
+    total_price = serializers.DecimalField(source='subtotal',max_digits=10,decimal_places=2,read_only=True)
     
     class Meta:
         model = Cart
-        fields = ['id','customer','items','total_price']
-        
-    def get_total_price(self,obj):
-        return sum((item.subtotal() for item in obj.items.all()),Decimal('0'))
+        fields = ['id','customer','item_count','subtotal','total_price','items']
             
 class AddressSerializer(serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
@@ -146,7 +209,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id','order_id','product','quantity','price','subtotal','status']
         
     def get_subtotal(self,obj):
-        return obj.product.price * obj.quantity
+        return obj.subtotal()
         
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(read_only=True,many=True)
@@ -268,23 +331,24 @@ class LoginSerializer(serializers.Serializer):
         if not username  or not password:
             raise serializers.ValidationError("Username and password are required")
         
-        user = User.objects.filter(username=username).first()
+        # profiles come with the user, they feed the role and the token claims
+        user = user_with_profiles(username=username)
         
         if user is None or not user.check_password(password):
             raise serializers.ValidationError("Invalid Username or Password")
         
         # find user role
-        if Customer.objects.filter(user = user).exists():
+        if hasattr(user,'customer_profile'):
             user_role = "customer"
         
-        elif Vendor.objects.filter(user=user).exists():
+        elif hasattr(user,'vendor_profile'):
             user_role = "vendor"
         
         else:
             user_role = "unknown" 
         
         # generate token 
-        refresh = RefreshToken.for_user(user)
+        refresh = token_for_user(user)
         return {
             
             'refresh': str(refresh),
@@ -312,6 +376,12 @@ class VendorProductSerializer(serializers.ModelSerializer):
         validated_data["vendor"] = vendor
         return super().create(validated_data)
     
+    def validate_stock(self,value):
+        # a hot product's stock lives in its shards, see inventory.py
+        if self.instance is not None and self.instance.stock_shards and value != self.instance.stock:
+            raise serializers.ValidationError("Stock of this product is sharded for a sale, restock it with `manage.py hot_stock`.")
+        return value
+    
     def update(self,instance,validated_data):
         validated_data.pop("vendor",None)
         return super().update(instance,validated_data)
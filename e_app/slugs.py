@@ -0,0 +1,110 @@
+"""
+Slug allocation.
+
+A new slug is `slugify(source)`, or `<base>-<n>` with the smallest free n
+when the base is taken within the model's uniqueness scope (per vendor for
+products, global for vendors and categories). All slugs sharing the base are
+fetched with one prefix query and the suffix is picked in memory, so the cost
+no longer grows with the number of collisions.
+
+Two requests can still pick the same slug at once; `save_with_slug` saves in
+a savepoint and, when the insert loses that race on the slug, allocates
+again. `assign_slugs` fills slugs for a batch of unsaved objects (importers,
+bulk_create) with one prefix query per scope.
+"""
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+SLUG_RETRIES = 5
+# bases per prefix query in assign_slugs
+PREFIX_BATCH = 100
+
+
+def slug_base(instance, source):
+    max_length = instance._meta.get_field('slug').max_length
+    base = slugify(getattr(instance, source) or '') or instance._meta.model_name
+    # room for a "-<n>" suffix
+    return base[:max_length - 8].rstrip('-')
+
+
+def pick_slug(base, taken):
+    """`base`, or `base-<n>` with the smallest n not in `taken`."""
+    if base not in taken:
+        return base
+    pattern = re.compile(rf'^{re.escape(base)}-(\d+)$')
+    used = {int(match[1]) for slug in taken if (match := pattern.match(slug))}
+    n = 1
+    while n in used:
+        n += 1
+    return f"{base}-{n}"
+
+
+def _scope_filter(instance, scope):
+    # scope is a tuple of attnames, e.g. ('vendor_id',)
+    return {field: getattr(instance, field) for field in scope}
+
+
+def taken_slugs(model, scope_filter, bases):
+    """Slugs in scope starting with any of `bases`, one query."""
+    prefixes = reduce(or_, (Q(slug__startswith=base) for base in bases))
+    return set(model._default_manager.filter(prefixes, **scope_filter).values_list('slug', flat=True))
+
+
+def allocate_slug(instance, source, scope=()):
+    base = slug_base(instance, source)
+    taken = taken_slugs(type(instance), _scope_filter(instance, scope), [base])
+    instance.slug = pick_slug(base, taken)
+    return instance.slug
+
+
+def save_with_slug(instance, save, source, scope=()):
+    """
+    Call `save()` (the model's super().save) with a freshly allocated slug,
+    allocating again if a concurrent insert took it first.
+    """
+    using = router.db_for_write(type(instance), instance=instance)
+    for attempt in range(SLUG_RETRIES):
+        allocate_slug(instance, source, scope)
+        try:
+            with transaction.atomic(using=using):
+                return save()
+        except IntegrityError:
+            lost_race = type(instance)._default_manager.filter(
+                slug=instance.slug, **_scope_filter(instance, scope)
+            ).exclude(pk=instance.pk).exists()
+            instance.slug = ''
+            if not lost_race or attempt == SLUG_RETRIES - 1:
+                raise
+
+
+def assign_slugs(objects, source, scope=()):
+    """
+    Give every object without a slug a unique one, also unique among the
+    batch. Objects that already have a slug keep it and reserve it.
+    """
+    if not objects:
+        return objects
+    model = type(objects[0])
+    groups = {}
+    for obj in objects:
+        key = tuple(sorted(_scope_filter(obj, scope).items()))
+        groups.setdefault(key, []).append(obj)
+    for key, members in groups.items():
+        bases = {id(obj): slug_base(obj, source) for obj in members if not obj.slug}
+        if not bases:
+            continue
+        unique_bases = sorted(set(bases.values()))
+        taken = set()
+        for start in range(0, len(unique_bases), PREFIX_BATCH):
+            taken |= taken_slugs(model, dict(key), unique_bases[start:start + PREFIX_BATCH])
+        taken |= {obj.slug for obj in members if obj.slug}
+        for obj in members:
+            if not obj.slug:
+                obj.slug = pick_slug(bases[id(obj)], taken)
+                taken.add(obj.slug)
+    return objects
@@ -1,6 +1,17 @@
 from rest_framework.test import APITestCase
 from django.urls import reverse
 from rest_framework import status
+import shutil
+import tempfile
+from decimal import Decimal
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.utils import timezone
+from .models import User,Vendor,Customer,Category,Product,ProductImage,Address,Cart,CartItem,Order,OrderItem,StockReservation,StockShard,deferred_order_totals
+from .jobs import job
 
 
 # Create your tests here.
@@ -15,4 +26,1475 @@ class TestUserRegisration(APITestCase):
         response = self.client.post(url,data)
         self.assertEqual(response.status_code,status.HTTP_201_CREATED)
         self.assertEqual(response.data['username'],data['username'])
-        
\ No newline at end of file
+        
+
+# shared fixtures for the api tests below
+TINY_GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+            b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+
+def make_vendor(username="vendor",shop_name="Shop"):
+    user = User.objects.create_user(username=username,password="Test@123",role="vendor")
+    return Vendor.objects.create(user=user,shop_name=shop_name)
+
+
+def make_customer(username="customer"):
+    user = User.objects.create_user(username=username,password="Test@123",role="customer")
+    return Customer.objects.create(user=user)
+
+
+def make_product(vendor,name="T-Shirt",price="100.00",stock=10,category=None):
+    return Product.objects.create(vendor=vendor,name=name,price=Decimal(price),stock=stock,category=category)
+
+
+class MediaTestCase(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root,ignore_errors=True)
+        super().tearDownClass()
+
+    def add_image(self,product,is_primary=False,name="img.gif"):
+        return ProductImage.objects.create(
+            product=product,is_primary=is_primary,
+            image=SimpleUploadedFile(name,TINY_GIF,content_type="image/gif"),
+        )
+
+
+class TestPrimaryImagePointer(MediaTestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.product = make_product(self.vendor)
+
+    def test_pointer_follows_image_writes(self):
+        first = self.add_image(self.product)
+        second = self.add_image(self.product,is_primary=True)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image_id,second.id)
+        self.assertEqual(self.product.primary_image_path,second.image.name)
+
+        second.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image_id,first.id)
+
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertIsNone(self.product.primary_image_id)
+        self.assertEqual(self.product.primary_image_path,"")
+
+    def test_product_list_reads_pointer_without_image_queries(self):
+        for i in range(5):
+            product = make_product(self.vendor,name=f"Item {i}")
+            self.add_image(product,is_primary=True)
+        url = reverse('products-list')
+        # one COUNT for the page number pagination, one SELECT for the page
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        images = [p['image'] for p in response.data['results']]
+        self.assertEqual(len(images),6)
+        self.assertTrue(all(images[:5]))
+        self.assertIsNone(images[5])
+
+
+class TestCatalogCursorPagination(APITestCase):
+    def setUp(self):
+        cache.clear()
+        vendor = make_vendor()
+        # duplicate prices so the id tie-breaker matters
+        for i in range(7):
+            make_product(vendor,name=f"Item {i}",price=str(100 + (i % 3)))
+
+    def walk(self,params):
+        url = reverse('products-list')
+        seen = []
+        query = dict(params,cursor='',page_size=3)
+        while True:
+            # no COUNT(*): one SELECT per page
+            with self.assertNumQueries(1):
+                response = self.client.get(url,query)
+            self.assertEqual(response.status_code,status.HTTP_200_OK)
+            self.assertNotIn('count',response.data)
+            seen.extend(response.data['results'])
+            if not response.data['next']:
+                return seen
+            query['cursor'] = response.data['next'].split('cursor=')[1].split('&')[0]
+
+    def test_walks_every_ordering_without_gaps(self):
+        expected = list(Product.objects.order_by('-created_at','-id').values_list('id',flat=True))
+        self.assertEqual([p['id'] for p in self.walk({})],expected)
+
+        by_price = self.walk({'ordering':'price'})
+        expected = list(Product.objects.order_by('price','id').values_list('id',flat=True))
+        self.assertEqual([p['id'] for p in by_price],expected)
+
+    def test_filters_and_optional_count(self):
+        url = reverse('products-list')
+        response = self.client.get(url,{'cursor':'','price__gte':'101','count':'exact'})
+        self.assertEqual(response.data['count'],4)
+        self.assertTrue(all(Decimal(p['price']) >= 101 for p in response.data['results']))
+
+    def test_rejects_cursor_from_another_ordering(self):
+        url = reverse('products-list')
+        response = self.client.get(url,{'cursor':'','page_size':2})
+        cursor = response.data['next'].split('cursor=')[1].split('&')[0]
+        response = self.client.get(url,{'cursor':cursor,'ordering':'price'})
+        self.assertEqual(response.status_code,status.HTTP_404_NOT_FOUND)
+
+
+class TestProductSearch(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor(shop_name="Blue Harbor Outfitters")
+        self.category = Category.objects.create(name="Footwear")
+        self.by_name = make_product(self.vendor,name="Running Shoes")
+        self.by_description = make_product(self.vendor,name="Trail Socks")
+        self.by_description.description = "pairs well with running shoes"
+        self.by_description.save()
+        self.by_category = make_product(self.vendor,name="Sandals",category=self.category)
+        make_product(make_vendor("other","Other Shop"),name="Coffee Mug")
+
+    def search(self,term,**params):
+        response = self.client.get(reverse('products-list'),dict(params,search=term))
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        return [p['id'] for p in response.data['results']]
+
+    def test_ranks_name_matches_above_description_matches(self):
+        self.assertEqual(self.search("running shoe"),[self.by_name.id,self.by_description.id])
+
+    def test_matches_category_vendor_and_prefixes(self):
+        self.assertEqual(self.search("footwear"),[self.by_category.id])
+        self.assertEqual(len(self.search("harbor")),3)
+        self.assertEqual(self.search("sand"),[self.by_category.id])
+        self.assertEqual(self.search("nothing matches"),[])
+
+    def test_index_follows_category_and_vendor_renames(self):
+        self.category.name = "Beachwear"
+        self.category.save()
+        self.assertEqual(self.search("beachwear"),[self.by_category.id])
+        self.assertEqual(self.search("footwear"),[])
+        self.vendor.shop_name = "Seaside Supply"
+        self.vendor.save()
+        self.assertEqual(len(self.search("seaside")),3)
+
+    def test_reindexes_without_conflict_target(self):
+        # mysql: no ON CONFLICT (...), the upsert replaces the rows instead
+        from unittest import mock
+        from .models import ProductSearchDocument
+        with mock.patch.object(connection.features,'supports_update_conflicts_with_target',False):
+            self.by_name.name = "Walking Boots"
+            self.by_name.save()
+            make_product(self.vendor,name="Hiking Poles")
+        self.assertEqual(ProductSearchDocument.objects.get(product=self.by_name).name,"Walking Boots")
+        self.assertEqual(ProductSearchDocument.objects.count(),Product.objects.count())
+        self.assertEqual(self.search("walking"),[self.by_name.id])
+        self.assertEqual(len(self.search("hiking")),1)
+
+    def test_skips_reindex_when_text_is_unchanged(self):
+        def index_writes(**save):
+            with CaptureQueriesContext(connection) as queries:
+                self.by_name.save(**save)
+            return [q['sql'] for q in queries if 'searchterm' in q['sql'] or 'INSERT' in q['sql']]
+
+        self.by_name.stock = 3
+        self.assertEqual(index_writes(update_fields=['stock']),[])
+        self.by_name.price = Decimal("5.00")
+        self.assertEqual(index_writes(),[])
+        self.by_name.name = "Racing Shoes"
+        self.assertNotEqual(index_writes(),[])
+        self.assertEqual(self.search("racing"),[self.by_name.id])
+
+    def test_combines_with_filters_and_cursor_pages(self):
+        self.assertEqual(self.search("harbor",category=self.category.id),[self.by_category.id])
+        response = self.client.get(reverse('products-list'),{'search':'harbor','cursor':'','page_size':2})
+        first = [p['id'] for p in response.data['results']]
+        cursor = response.data['next'].split('cursor=')[1].split('&')[0]
+        response = self.client.get(reverse('products-list'),{'search':'harbor','cursor':cursor,'page_size':2})
+        rest = [p['id'] for p in response.data['results']]
+        self.assertEqual(sorted(first + rest),sorted([self.by_name.id,self.by_description.id,self.by_category.id]))
+
+
+class TestProductFacets(APITestCase):
+    def setUp(self):
+        cache.clear()
+        vendor = make_vendor()
+        self.shoes = Category.objects.create(name="Shoes")
+        self.hats = Category.objects.create(name="Hats")
+        make_product(vendor,name="Runner",price="100.00",category=self.shoes)
+        make_product(vendor,name="Boot",price="300.00",category=self.shoes)
+        make_product(vendor,name="Cap",price="3000.00",stock=0,category=self.hats)
+        # all of it held in carts
+        held = make_product(vendor,name="Sticker",price="50.00",stock=2)
+        Product.objects.filter(pk=held.pk).update(reserved=2)
+
+    def facets(self,url_name='products-list',**params):
+        response = self.client.get(reverse(url_name),dict(params,cursor=''))
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        return response.json()
+
+    def test_counts_each_facet_with_one_query(self):
+        # the page, then one grouped query per facet
+        with self.assertNumQueries(4):
+            data = self.facets(facets='1')
+        facets = data['facets']
+        self.assertEqual([(c['name'],c['count']) for c in facets['category']],[("Shoes",2),("Hats",1),(None,1)])
+        prices = {bucket['min']:bucket['count'] for bucket in facets['price']}
+        self.assertEqual(prices,{0:2,250:1,500:0,1000:0,2500:1,5000:0,10000:0})
+        self.assertEqual(facets['price'][-1]['max'],None)
+        self.assertEqual(facets['stock'],{'in_stock':2,'out_of_stock':2})
+        self.assertNotIn('facets',self.facets())
+
+    def test_facets_follow_filters_but_ignore_their_own(self):
+        data = self.facets(facets='category,stock',category=self.shoes.id)
+        self.assertEqual({p['name'] for p in data['results']},{"Runner","Boot"})
+        self.assertNotIn('price',data['facets'])
+        # the other categories are still counted
+        self.assertEqual(len(data['facets']['category']),3)
+        self.assertEqual(data['facets']['stock'],{'in_stock':2,'out_of_stock':0})
+        data = self.facets(facets='category,stock',category=self.shoes.id,in_stock='false')
+        self.assertEqual(data['results'],[])
+        self.assertEqual([(c['name'],c['count']) for c in data['facets']['category']],[("Hats",1),(None,1)])
+        self.assertEqual(data['facets']['stock'],{'in_stock':2,'out_of_stock':0})
+        data = self.facets(facets='category,price',search='boot',price__lte='500')
+        self.assertEqual([(c['name'],c['count']) for c in data['facets']['category']],[("Shoes",1)])
+        self.assertEqual(sum(bucket['count'] for bucket in data['facets']['price']),1)
+        response = self.client.get(reverse('products-list'),{'facets':'colour'})
+        self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
+
+    def test_async_list_matches(self):
+        params = {'facets':'1','price__gte':'60'}
+        self.assertEqual(self.facets('async-products-list',**params)['facets'],self.facets(**params)['facets'])
+        self.assertEqual(self.client.get(reverse('async-products-list'),{'facets':'colour'}).status_code,400)
+
+
+def make_address(customer):
+    return Address.objects.create(customer=customer,line="1 Main St",city="Pune",state="MH",pincode="411001",is_default=True)
+
+
+class TestOrderPlacement(APITestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.address = make_address(self.customer)
+        self.vendor = make_vendor()
+        self.products = [make_product(self.vendor,name=f"Item {i}",price="10.00",stock=5) for i in range(6)]
+        self.client.force_authenticate(self.customer.user)
+        self.url = reverse('customer-orders')
+
+    def order(self,lines):
+        payload = {"address_id":self.address.id,"items":[{"product_id":p.id,"quantity":q} for p,q in lines]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url,payload,format='json')
+        return response,len(queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        response,one_line = self.order([(self.products[0],1)])
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        response,six_lines = self.order([(p,2) for p in self.products])
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        self.assertEqual(one_line,six_lines)
+        self.assertEqual(Decimal(response.data['total_amount']),Decimal('120.00'))
+        self.assertEqual(response.data['address']['id'],self.address.id)
+
+    def test_refuses_to_oversell_and_rolls_back(self):
+        response,_ = self.order([(self.products[0],2),(self.products[1],6)])
+        self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(),0)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock,5)
+
+    def test_cart_checkout_sets_vendor_and_takes_stock(self):
+        cart = Cart.objects.get(customer=self.customer)
+        CartItem.objects.create(cart=cart,product=self.products[0],quantity=3)
+        response = self.client.post(self.url,{"address_id":self.address.id},format='json')
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        item = OrderItem.objects.get()
+        self.assertEqual(item.vendor_id,self.vendor.id)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock,2)
+        self.assertFalse(cart.items.exists())
+
+
+class TestOrderTotals(APITestCase):
+    def setUp(self):
+        vendor = make_vendor()
+        self.order = Order.objects.create(customer=make_customer(),total_amount=Decimal('0'))
+        self.products = [make_product(vendor,name=f"Item {i}",price="10.00") for i in range(5)]
+
+    def add_items(self):
+        return [OrderItem.objects.create(order=self.order,product=p,vendor=p.vendor,quantity=2,price=p.price) for p in self.products]
+
+    def test_item_writes_keep_total_from_stored_prices(self):
+        items = self.add_items()
+        # a later price change must not rewrite what the customer paid
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal('99.00'))
+        items[1].quantity = 3
+        items[1].save()
+        items[2].delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount,Decimal('90.00'))
+
+    def test_deferred_scope_refreshes_once(self):
+        items = self.add_items()
+        with CaptureQueriesContext(connection) as queries:
+            with deferred_order_totals():
+                for item in items:
+                    item.quantity = 1
+                    item.save()
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "e_app_order"')]
+        self.assertEqual(len(updates),1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount,Decimal('50.00'))
+
+
+class TestOrderCancellation(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+        self.address = make_address(self.customer)
+        self.vendor = make_vendor()
+        self.products = [make_product(self.vendor,name=f"Item {i}",price="10.00",stock=5) for i in range(5)]
+        self.client.force_authenticate(self.customer.user)
+
+    def place(self,products):
+        payload = {"address_id":self.address.id,"items":[{"product_id":p.id,"quantity":2} for p in products]}
+        return Order.objects.get(pk=self.client.post(reverse('customer-orders'),payload,format='json').data['id'])
+
+    def cancel(self,order):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('customer-order-detail',kwargs={'pk':order.pk}))
+        return response,len(queries)
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('stock',flat=True))
+
+    def test_cancel_restores_stock_in_constant_queries(self):
+        small = self.place(self.products[:1])
+        large = self.place(self.products)
+        self.assertEqual(self.stock(),[1,3,3,3,3])
+        response,one_line = self.cancel(small)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        _,five_lines = self.cancel(large)
+        self.assertEqual(one_line,five_lines)
+        self.assertEqual(self.stock(),[5]*5)
+        large.refresh_from_db()
+        self.assertEqual((large.status,large.total_amount),('cancelled',Decimal('0')))
+        self.assertEqual(set(large.items.values_list('status',flat=True)),{"CANCELLED"})
+        # twice is refused, and gives nothing back twice
+        self.assertEqual(self.cancel(large)[0].status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock(),[5]*5)
+
+    def test_refuses_once_a_vendor_moved_an_item(self):
+        order = self.place(self.products[:2])
+        OrderItem.objects.filter(order=order,product=self.products[0]).update(status="ACCEPTED")
+        self.assertEqual(self.cancel(order)[0].status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(order.items.order_by('id').values_list('status',flat=True)),["ACCEPTED","PLACED"])
+        self.assertEqual(self.stock()[:2],[3,3])
+
+        # a vendor cancelling one line restocks it and drops it from the total
+        self.client.force_authenticate(self.vendor.user)
+        item = order.items.get(product=self.products[1])
+        self.client.post(reverse('vendor-orders-status'),{'ids':[item.id],'status':'CANCELLED'},format='json')
+        order.refresh_from_db()
+        self.assertEqual((order.status,order.total_amount),('processing',Decimal('20.00')))
+        self.assertEqual(self.stock()[:2],[3,5])
+
+
+class TestVendorDashboard(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.customer = make_customer()
+        self.address = make_address(self.customer)
+        self.products = [make_product(self.vendor,name=f"Item {i}",stock=50) for i in range(3)]
+        self.client.force_authenticate(self.vendor.user)
+        self.url = reverse('vendor-dashboard')
+
+    def place(self,count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                order = Order.objects.create(customer=self.customer,total_amount=Decimal('0'))
+                product = self.products[i % 3]
+                OrderItem.objects.create(order=order,product=product,vendor=self.vendor,quantity=1,price=product.price)
+
+    def test_cache_miss_cost_does_not_depend_on_data_size(self):
+        self.place(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        self.place(20)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+        self.assertEqual(len(small),len(large))
+        self.assertEqual(response.data['stats'],{
+            "total_products":3,"total_orders":22,"pending_orders":22,"completed_orders":0,
+        })
+
+    def test_events_invalidate_the_cached_dashboard(self):
+        self.assertEqual(self.client.get(self.url).data['stats']['total_orders'],0)
+        item_url = reverse('customer-orders')
+        self.client.force_authenticate(self.customer.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(item_url,{"address_id":self.address.id,"items":[{"product_id":self.products[0].id,"quantity":1}]},format='json')
+        self.client.force_authenticate(self.vendor.user)
+        self.assertEqual(self.client.get(self.url).data['stats']['total_orders'],1)
+
+        item = OrderItem.objects.get()
+        item.status = "DELIVERD"
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(self.client.get(self.url).data['stats']['completed_orders'],1)
+
+
+class TestVendorOrderFeed(APITestCase):
+    def setUp(self):
+        self.vendor = make_vendor()
+        self.products = [make_product(self.vendor,name=f"Item {i}",stock=50) for i in range(3)]
+        self.client.force_authenticate(self.vendor.user)
+        self.url = reverse('vendor-orders')
+
+    def place(self,count,status="PLACED"):
+        items = []
+        for i in range(count):
+            order = Order.objects.create(customer=make_customer(f"buyer{OrderItem.objects.count()}"),total_amount=Decimal('0'))
+            product = self.products[i % 3]
+            items.append(OrderItem.objects.create(order=order,product=product,vendor=self.vendor,quantity=1,price=product.price,status=status))
+        return items
+
+    def get(self,params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url,params or {})
+        return response,len(queries)
+
+    def test_page_cost_does_not_grow_with_rows(self):
+        self.place(2)
+        response,small = self.get()
+        self.place(20)
+        response,large = self.get({'page_size':20})
+        self.assertEqual(small,large)
+        self.assertEqual(len(response.data['results']),20)
+        self.assertEqual(response.data['results'][0]['customer'],"buyer21")
+        # other vendors' items never show up
+        other = make_vendor("other","Other")
+        OrderItem.objects.create(order=Order.objects.create(customer=make_customer("x"),total_amount=0),
+                                 product=make_product(other),vendor=other,price=Decimal('1.00'))
+        self.assertEqual(self.client.get(self.url,{'count':'exact'}).data['count'],22)
+
+    def test_cursor_walk_and_filters(self):
+        placed = self.place(3)
+        shipped = self.place(2,status="SHIPPED")
+        seen,url = [],self.url
+        while url:
+            data = self.client.get(url,{'page_size':2} if url == self.url else None).data
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(seen,[item.id for item in reversed(placed + shipped)])
+
+        data = self.client.get(self.url,{'status':'SHIPPED,DELIVERD'}).data
+        self.assertEqual([row['id'] for row in data['results']],[item.id for item in reversed(shipped)])
+
+        old = timezone.now() - timezone.timedelta(days=10)
+        OrderItem.objects.filter(pk=placed[0].pk).update(created_at=old)
+        data = self.client.get(self.url,{'created_before':old.date().isoformat()}).data
+        self.assertEqual([row['id'] for row in data['results']],[placed[0].id])
+        data = self.client.get(self.url,{'created_after':timezone.now().date().isoformat()}).data
+        self.assertEqual(len(data['results']),4)
+
+        self.assertEqual(self.client.get(self.url,{'created_after':'yesterday'}).status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url,{'cursor':'bogus'}).status_code,status.HTTP_404_NOT_FOUND)
+
+
+class TestOrderStatusTransitions(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.other = make_vendor("other","Other")
+        customer = make_customer()
+        self.order = Order.objects.create(customer=customer,total_amount=Decimal('0'))
+        self.items = [
+            OrderItem.objects.create(order=self.order,product=make_product(self.vendor,name=f"Item {i}"),vendor=self.vendor,price=Decimal('10.00'))
+            for i in range(3)
+        ]
+        self.foreign = OrderItem.objects.create(order=self.order,product=make_product(self.other),vendor=self.other,price=Decimal('5.00'))
+        self.client.force_authenticate(self.vendor.user)
+        self.url = reverse('vendor-orders-status')
+
+    def move(self,ids,target):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url,{'ids':ids,'status':target},format='json')
+        return response,len(queries)
+
+    def test_bulk_transition_reports_each_item(self):
+        OrderItem.objects.filter(pk=self.items[2].pk).update(status="SHIPPED")
+        ids = [item.id for item in self.items] + [self.foreign.id,999]
+        response,count = self.move(ids,"PACKED")
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'],2)
+        self.assertEqual([r['result'] for r in response.data['results']],
+                         ['updated','updated','invalid_transition','not_found','not_found'])
+        self.assertEqual(OrderItem.objects.get(pk=self.foreign.pk).status,"PLACED")
+        # same cost for 2 items as for 1
+        _,single = self.move([self.items[0].id],"SHIPPED")
+        self.assertEqual(count,single)
+
+        response,_ = self.move([self.items[0].id],"SHIPPED")
+        self.assertEqual(response.data['results'][0]['result'],'unchanged')
+        self.assertEqual(self.move([1],"RETURNED")[0].status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.move([],"SHIPPED")[0].status_code,status.HTTP_400_BAD_REQUEST)
+
+    def test_order_status_rolls_forward(self):
+        def order_status():
+            self.order.refresh_from_db()
+            return self.order.status
+        ids = [item.id for item in self.items]
+        self.move(ids[:1],"ACCEPTED")
+        self.assertEqual(order_status(),'processing')
+        self.move(ids,"SHIPPED")
+        # the other vendor's item hasn't shipped yet
+        self.assertEqual(order_status(),'processing')
+        self.client.force_authenticate(self.other.user)
+        self.move([self.foreign.id],"CANCELLED")
+        self.assertEqual(order_status(),'shipped')
+        self.client.force_authenticate(self.vendor.user)
+        # the frontend's spelling
+        response,_ = self.move(ids,"DELIVERED")
+        self.assertEqual(response.data['status'],"DELIVERD")
+        self.assertEqual(order_status(),'delivered')
+
+    def test_single_item_patch_checks_transitions(self):
+        url = reverse('vendor-order-detail',kwargs={'pk':self.items[0].id})
+        response = self.client.patch(url,{'status':'SHIPPED'},format='json')
+        self.assertEqual(response.data['new_status'],"SHIPPED")
+        response = self.client.patch(url,{'status':'ACCEPTED'},format='json')
+        self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
+        url = reverse('vendor-order-detail',kwargs={'pk':self.foreign.id})
+        self.assertEqual(self.client.patch(url,{'status':'SHIPPED'},format='json').status_code,status.HTTP_404_NOT_FOUND)
+
+
+class TestCatalogResponseCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.category = Category.objects.create(name="Shirts")
+        self.product = make_product(self.vendor,category=self.category)
+        make_product(self.vendor,name="Hat")
+
+    def get(self,url,**params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url,params)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        return response,len(queries)
+
+    def test_repeat_reads_skip_the_database(self):
+        list_url = reverse('products-list')
+        detail_url = reverse('products-detail',kwargs={'slug':self.product.slug})
+        for url in (list_url,detail_url,reverse('categories-list')):
+            _,first = self.get(url)
+            self.assertGreater(first,0)
+            _,second = self.get(url)
+            self.assertEqual(second,0)
+        # query string order doesn't matter
+        self.get(list_url,page_size=5,ordering='price')
+        _,queries = self.get(list_url,ordering='price',page_size=5)
+        self.assertEqual(queries,0)
+
+    def test_writes_invalidate_only_what_they_touch(self):
+        detail_url = reverse('products-detail',kwargs={'slug':self.product.slug})
+        list_url = reverse('products-list')
+        self.get(detail_url)
+        self.get(list_url,search='tops')
+        self.get(reverse('categories-list'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Tops"
+            self.category.save()
+        response,queries = self.get(detail_url)
+        self.assertGreater(queries,0)
+        self.assertEqual(response.data['category']['name'],"Tops")
+        # searches rank on category and shop names
+        response,_ = self.get(list_url,search='tops')
+        self.assertEqual([p['id'] for p in response.data['results']],[self.product.id])
+        self.get(list_url,search='seaside')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendor.shop_name = "Seaside"
+            self.vendor.save()
+        response,_ = self.get(list_url,search='seaside')
+        self.assertEqual(len(response.data['results']),2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('5.00')
+            self.product.save()
+        response,_ = self.get(list_url)
+        prices = {p['id']:p['price'] for p in response.data['results']}
+        self.assertEqual(prices[self.product.id],'5.00')
+
+
+class TestConditionalGet(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.product = make_product(self.vendor)
+        self.customer = make_customer()
+
+    def test_catalog_revalidation(self):
+        url = reverse('products-detail',kwargs={'slug':self.product.slug})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('Last-Modified',response)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries),0)
+        response = self.client.get(reverse('products-list'),HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('5.00')
+            self.product.save()
+        response = self.client.get(url,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'],etag)
+
+    def test_cache_outage_serves_fresh_responses_without_validators(self):
+        from unittest import mock
+        url = reverse('products-detail',kwargs={'slug':self.product.slug})
+        etag = self.client.get(url)['ETag']
+
+        class DownCache:
+            # django-redis with IGNORE_EXCEPTIONS: reads miss, writes vanish
+            def get(self,key,default=None): return default
+            def get_many(self,keys): return {}
+            def add(self,*args,**kwargs): return False
+            def set(self,*args,**kwargs): pass
+            def delete_many(self,keys): pass
+
+        with mock.patch('e_app.caching.cache',DownCache()),mock.patch('e_app.views.cache',DownCache()):
+            Product.objects.filter(pk=self.product.pk).update(price=Decimal('7.00'))
+            for target in (url,reverse('products-list')):
+                response = self.client.get(target,HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,status.HTTP_200_OK)
+                self.assertNotIn('ETag',response)
+                self.assertNotIn('Last-Modified',response)
+            self.assertEqual(self.client.get(url).data['price'],'7.00')
+            self.client.force_authenticate(self.vendor.user)
+            self.assertEqual(self.client.get(reverse('vendor-dashboard')).status_code,status.HTTP_200_OK)
+
+    def test_cart_revalidation(self):
+        self.client.force_authenticate(self.customer.user)
+        url = reverse('customer-cart')
+        item = CartItem.objects.create(cart=self.customer.cart,product=self.product,quantity=1)
+        other = CartItem.objects.create(cart=self.customer.cart,product=make_product(self.vendor,name="Hat"),quantity=1)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('private',response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,status.HTTP_304_NOT_MODIFIED)
+        # user, customer profile, cart, aggregate
+        self.assertLessEqual(len(queries),4)
+
+        other.delete()
+        response = self.client.get(url,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertEqual(len(response.data['items']),1)
+        etag = response['ETag']
+
+        Product.objects.filter(pk=item.product_id).update(price=Decimal('1.00'),updated_at=timezone.now())
+        response = self.client.get(url,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+
+
+class TestCartTotals(APITestCase):
+    def setUp(self):
+        self.vendor = make_vendor()
+        self.customer = make_customer()
+        self.cart = self.customer.cart
+        self.client.force_authenticate(self.customer.user)
+
+    def test_totals_follow_lines_and_prices(self):
+        shirt = make_product(self.vendor,price="100.00")
+        hat = make_product(self.vendor,name="Hat",price="25.50")
+        line = CartItem.objects.create(cart=self.cart,product=shirt,quantity=2)
+        CartItem.objects.create(cart=self.cart,product=hat,quantity=1)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count,self.cart.subtotal),(3,Decimal('225.50')))
+
+        shirt.price = Decimal('90.00')
+        shirt.save()
+        line.quantity = 1
+        line.save()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count,self.cart.subtotal),(2,Decimal('115.50')))
+
+        hat.delete()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count,self.cart.subtotal),(1,Decimal('90.00')))
+
+    def test_only_price_changes_reprice_carts(self):
+        shirt = make_product(self.vendor,price="100.00")
+        CartItem.objects.create(cart=self.cart,product=shirt,quantity=2)
+        self.cart.refresh_from_db()
+        stamp = self.cart.updated_at
+
+        shirt = Product.objects.get(pk=shirt.pk)
+        shirt.description = "now in blue"
+        shirt.save()
+        shirt.price = Decimal('80.00')
+        shirt.save(update_fields=['stock'])
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.updated_at,self.cart.subtotal),(stamp,Decimal('200.00')))
+
+        shirt.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.subtotal,Decimal('160.00'))
+        self.assertNotEqual(self.cart.updated_at,stamp)
+
+    def test_cart_read_is_constant_queries(self):
+        def read():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('customer-cart'))
+            self.assertEqual(response.status_code,status.HTTP_200_OK)
+            return response,len(queries)
+
+        CartItem.objects.create(cart=self.cart,product=make_product(self.vendor),quantity=1)
+        _,small = read()
+        for i in range(10):
+            CartItem.objects.create(cart=self.cart,product=make_product(self.vendor,name=f"Item {i}"),quantity=2)
+        response,large = read()
+        self.assertEqual(small,large)
+        self.assertEqual(response.data['item_count'],21)
+        self.assertEqual(response.data['total_price'],'2100.00')
+        line = response.data['items'][0]
+        self.assertEqual(set(line['product']),{'id','name','slug','price','stock','available','image','image_srcset'})
+        self.assertEqual(line['subtotal'],'100.00')
+
+
+class TestCartBatch(APITestCase):
+    def setUp(self):
+        self.vendor = make_vendor()
+        self.customer = make_customer()
+        self.cart = self.customer.cart
+        self.client.force_authenticate(self.customer.user)
+        self.shirt = make_product(self.vendor,price="100.00")
+        self.hat = make_product(self.vendor,name="Hat",price="10.00")
+        self.mug = make_product(self.vendor,name="Mug",price="5.00")
+
+    def batch(self,*operations):
+        return self.client.post(reverse('customer-cart-batch'),{'operations':list(operations)},format='json')
+
+    def lines(self):
+        return dict(self.cart.items.values_list('product_id','quantity'))
+
+    def test_operations_fold_and_apply_together(self):
+        CartItem.objects.create(cart=self.cart,product=self.mug,quantity=4)
+        CartItem.objects.create(cart=self.cart,product=self.hat,quantity=1)
+        response = self.batch(
+            {'op':'add','product_id':self.shirt.id,'quantity':1},
+            {'op':'add','product_id':self.shirt.id,'quantity':2},
+            {'op':'add','product_id':self.hat.id,'quantity':2},
+            {'op':'set','product_id':self.mug.id,'quantity':1},
+            {'op':'add','product_id':self.mug.id,'quantity':1},
+        )
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertEqual(self.lines(),{self.shirt.id:3,self.hat.id:3,self.mug.id:2})
+        self.assertEqual((response.data['item_count'],response.data['total_price']),(8,'340.00'))
+
+        response = self.batch({'op':'remove','product_id':self.hat.id},{'op':'set','product_id':self.mug.id,'quantity':0})
+        self.assertEqual(self.lines(),{self.shirt.id:3})
+        self.assertEqual(response.data['total_price'],'300.00')
+
+    def test_set_without_conflict_target(self):
+        # mysql: lines and holds are replaced instead of upserted
+        from unittest import mock
+        CartItem.objects.create(cart=self.cart,product=self.mug,quantity=4)
+        with mock.patch.object(connection.features,'supports_update_conflicts_with_target',False):
+            response = self.batch({'op':'set','product_id':self.mug.id,'quantity':2},{'op':'set','product_id':self.hat.id,'quantity':1})
+            self.assertEqual(response.status_code,status.HTTP_200_OK)
+            self.batch({'op':'set','product_id':self.hat.id,'quantity':3})
+        self.assertEqual(self.lines(),{self.mug.id:2,self.hat.id:3})
+        self.assertEqual(dict(StockReservation.objects.values_list('product_id','quantity')),{self.mug.id:2,self.hat.id:3})
+        self.hat.refresh_from_db()
+        self.assertEqual(self.hat.reserved,3)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count,self.cart.subtotal),(5,Decimal('40.00')))
+
+    def test_invalid_batch_changes_nothing(self):
+        CartItem.objects.create(cart=self.cart,product=self.mug,quantity=1)
+        response = self.batch({'op':'remove','product_id':self.mug.id},{'op':'add','product_id':999,'quantity':1})
+        self.assertEqual(response.status_code,status.HTTP_404_NOT_FOUND)
+        response = self.batch({'op':'add','product_id':self.hat.id,'quantity':0})
+        self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.lines(),{self.mug.id:1})
+
+    def test_single_add_increments_existing_line(self):
+        url = reverse('customer-cart')
+        response = self.client.post(url,{'product_id':self.hat.id,'quantity':2},format='json')
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        response = self.client.post(url,{'product_id':self.hat.id,'quantity':3},format='json')
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'],5)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count,self.cart.subtotal),(5,Decimal('50.00')))
+
+
+class TestStockReservations(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.product = make_product(self.vendor,stock=5)
+        self.buyers = [make_customer(f"buyer{i}") for i in range(2)]
+
+    def add(self,buyer,quantity,product=None):
+        self.client.force_authenticate(buyer.user)
+        product = product or self.product
+        return self.client.post(reverse('customer-cart-batch'),{'operations':[{'op':'add','product_id':product.id,'quantity':quantity}]},format='json')
+
+    def product_state(self):
+        self.product.refresh_from_db()
+        return self.product.stock,self.product.reserved
+
+    def test_cart_lines_hold_stock(self):
+        self.assertEqual(self.add(self.buyers[0],3).status_code,status.HTTP_200_OK)
+        self.assertEqual(self.product_state(),(5,3))
+        # only 2 left for everyone else
+        response = self.add(self.buyers[1],3)
+        self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CartItem.objects.filter(cart__customer=self.buyers[1]).exists())
+        self.assertEqual(self.add(self.buyers[1],2).status_code,status.HTTP_200_OK)
+        listed = self.client.get(reverse('products-detail',kwargs={'slug':self.product.slug})).data
+        self.assertEqual((listed['stock'],listed['available']),(5,0))
+
+        # dropping the line gives the units back
+        line = CartItem.objects.get(cart__customer=self.buyers[0])
+        self.client.force_authenticate(self.buyers[0].user)
+        self.client.delete(reverse('customer-cart-item',kwargs={'pk':line.pk}))
+        self.assertEqual(self.product_state(),(5,2))
+        self.assertFalse(StockReservation.objects.filter(cart__customer=self.buyers[0]).exists())
+
+    def test_checkout_turns_holds_into_the_sale(self):
+        self.add(self.buyers[0],3)
+        self.add(self.buyers[1],2)
+        address = make_address(self.buyers[0])
+        self.client.force_authenticate(self.buyers[0].user)
+        # another buyer's held units can't be bought around their cart
+        other = make_product(self.vendor,name="Mug",stock=1)
+        response = self.client.post(reverse('customer-orders'),{"address_id":address.id,"items":[{"product_id":self.product.id,"quantity":4}]},format='json')
+        self.assertEqual(response.status_code,status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('customer-orders'),{"address_id":address.id},format='json')
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        self.assertEqual(self.product_state(),(2,2))
+        self.assertEqual(StockReservation.objects.count(),1)
+        self.assertEqual(self.add(self.buyers[0],1,other).status_code,status.HTTP_200_OK)
+
+    def test_expired_holds_are_released(self):
+        from .reservations import release_expired
+        self.add(self.buyers[0],4)
+        StockReservation.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        # a buyer who needs the units sweeps the expired holds on the way
+        self.assertEqual(self.add(self.buyers[1],5).status_code,status.HTTP_200_OK)
+        self.assertEqual(self.product_state(),(5,5))
+        self.assertEqual(StockReservation.objects.get().cart.customer,self.buyers[1])
+
+        products = [make_product(self.vendor,name=f"Item {i}",stock=5) for i in range(3)]
+        for product in products:
+            self.add(self.buyers[0],1,product)
+        StockReservation.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(release_expired(batch_size=2),4)
+        self.assertEqual(list(Product.objects.values_list('reserved',flat=True).distinct()),[0])
+
+    def test_holds_refresh_lists_only_when_stock_runs_out(self):
+        list_url = reverse('products-list')
+
+        def cards():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(list_url)
+            return len(queries),{p['id']:p['available'] for p in response.data['results']}[self.product.id]
+
+        cards()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add(self.buyers[0],2)
+        self.assertEqual(cards(),(0,5))
+        detail = self.client.get(reverse('products-detail',kwargs={'slug':self.product.slug})).data
+        self.assertEqual(detail['available'],3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add(self.buyers[1],3)
+        queries,available = cards()
+        self.assertGreater(queries,0)
+        self.assertEqual(available,0)
+
+    def test_other_carts_holds_change_the_cart_etag(self):
+        self.add(self.buyers[0],1)
+        url = reverse('customer-cart')
+        response = self.client.get(url)
+        self.assertEqual(response.data['items'][0]['product']['available'],4)
+        self.add(self.buyers[1],3)
+        self.client.force_authenticate(self.buyers[0].user)
+        response = self.client.get(url,HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertEqual(response.data['items'][0]['product']['available'],1)
+        # and when they let go again
+        etag = response['ETag']
+        self.client.force_authenticate(self.buyers[1].user)
+        self.client.post(reverse('customer-cart-batch'),{'operations':[{'op':'remove','product_id':self.product.id}]},format='json')
+        self.client.force_authenticate(self.buyers[0].user)
+        self.assertEqual(self.client.get(url,HTTP_IF_NONE_MATCH=etag).status_code,status.HTTP_200_OK)
+
+    def test_checkout_sweeps_expired_holds(self):
+        self.add(self.buyers[0],5)
+        StockReservation.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        address = make_address(self.buyers[1])
+        self.client.force_authenticate(self.buyers[1].user)
+        response = self.client.post(reverse('customer-orders'),{"address_id":address.id,"items":[{"product_id":self.product.id,"quantity":2}]},format='json')
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        self.assertEqual(self.product_state(),(3,0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_short_batch_holds_nothing_before_the_retry(self):
+        scarce = make_product(self.vendor,name="Last one",stock=1)
+        self.add(self.buyers[0],1,scarce)
+        StockReservation.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.client.force_authenticate(self.buyers[1].user)
+        response = self.client.post(reverse('customer-cart-batch'),{'operations':[
+            {'op':'add','product_id':self.product.id,'quantity':1},
+            {'op':'add','product_id':scarce.id,'quantity':1},
+        ]},format='json')
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        # the first, failed pass must not leave its unit on the product that had enough
+        self.assertEqual(self.product_state(),(5,1))
+        scarce.refresh_from_db()
+        self.assertEqual(scarce.reserved,1)
+
+
+class TestHotStock(APITestCase):
+    def setUp(self):
+        from .inventory import shard_stock
+        cache.clear()
+        self.vendor = make_vendor()
+        self.product = make_product(self.vendor,stock=10)
+        self.customer = make_customer()
+        self.address = make_address(self.customer)
+        shard_stock(self.product.id,4)
+        self.client.force_authenticate(self.customer.user)
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('index').values_list('stock',flat=True))
+
+    def order(self,quantity):
+        return self.client.post(reverse('customer-orders'),{"address_id":self.address.id,"items":[{"product_id":self.product.id,"quantity":quantity}]},format='json')
+
+    def test_checkouts_take_from_shards(self):
+        from .inventory import consolidate_stock
+        self.assertEqual(self.shards(),[3,3,2,2])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.order(1).status_code,status.HTTP_201_CREATED)
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE "e_app_product"')])
+        # more than any one shard holds, taken from several
+        self.assertEqual(self.order(4).status_code,status.HTTP_201_CREATED)
+        self.assertIn(0,self.shards())
+        self.assertEqual(self.order(6).status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sum(self.shards()),5)
+
+        self.assertEqual(consolidate_stock(),[self.product.id])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock,self.product.available),(5,5))
+        # the drained shard got evened out
+        self.assertEqual(sorted(self.shards()),[1,1,1,2])
+
+    def test_holds_cancels_and_switching_back(self):
+        from .inventory import consolidate_stock,unshard_stock
+        self.client.post(reverse('customer-cart-batch'),{'operations':[{'op':'add','product_id':self.product.id,'quantity':4}]},format='json')
+        self.assertEqual(sum(self.shards()),6)
+        order = self.client.post(reverse('customer-orders'),{"address_id":self.address.id},format='json').data
+        self.assertEqual((sum(self.shards()),StockReservation.objects.count()),(6,0))
+        self.client.delete(reverse('customer-order-detail',kwargs={'pk':order['id']}))
+        self.assertEqual(sum(self.shards()),10)
+
+        self.client.force_authenticate(self.vendor.user)
+        url = reverse('vendor-products-detail',kwargs={'pk':self.product.id})
+        self.assertEqual(self.client.patch(url,{'stock':50},format='json').status_code,status.HTTP_400_BAD_REQUEST)
+        consolidate_stock()
+        unshard_stock(self.product.id)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock,self.product.reserved,self.product.stock_shards),(10,0,0))
+        self.assertEqual(self.shards(),[])
+
+    def test_consolidation_leaves_products_switched_back_meanwhile(self):
+        from unittest import mock
+        from . import inventory
+        other = make_product(self.vendor,name="Mug",stock=10)
+        inventory.shard_stock(other.id,2)
+        self.order(1)
+        self.client.post(reverse('customer-orders'),{"address_id":self.address.id,"items":[{"product_id":other.id,"quantity":2}]},format='json')
+        rebalance = inventory._rebalance
+
+        def switch_back(product_id,shards):
+            # lands between consolidate_stock's snapshot and its write of the mug
+            if product_id == self.product.id:
+                inventory.unshard_stock(other.id)
+                inventory.decrement_stock({other.id:3})
+            return rebalance(product_id,shards)
+
+        with mock.patch.object(inventory,'_rebalance',switch_back):
+            self.assertEqual(inventory.consolidate_stock(),[self.product.id])
+        other.refresh_from_db()
+        self.assertEqual((other.stock,other.stock_shards),(5,0))
+
+
+class TestClaimsAuthentication(APITestCase):
+    def setUp(self):
+        self.vendor = make_vendor()
+        self.customer = make_customer()
+        self.product = make_product(self.vendor)
+
+    def login(self,username):
+        response = self.client.post(reverse('login'),{'username':username,'password':"Test@123"},format='json')
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.data
+
+    def user_queries(self,url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        tables = ('"e_app_user"','"e_app_customer"','"e_app_vendor"')
+        return [q['sql'] for q in queries if q['sql'].startswith('SELECT') and any(f'FROM {t}' in q['sql'] for t in tables)]
+
+    def test_login_claims_skip_profile_queries(self):
+        data = self.login("customer")
+        self.assertEqual(data['user_role'],"customer")
+        CartItem.objects.create(cart=self.customer.cart,product=self.product)
+        self.assertEqual(self.user_queries(reverse('customer-cart')),[])
+
+        self.login("vendor")
+        self.assertEqual(self.user_queries(reverse('vendor-orders')),[])
+        # role claim still gates the customer endpoints
+        self.assertEqual(self.client.get(reverse('customer-cart')).status_code,status.HTTP_403_FORBIDDEN)
+
+    def test_token_endpoint_and_refresh_keep_claims(self):
+        response = self.client.post(reverse('token_obtain_pair'),{'username':"vendor",'password':"Test@123"},format='json')
+        response = self.client.post(reverse('token_refresh'),{'refresh':response.data['refresh']},format='json')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.user_queries(reverse('vendor-orders')),[])
+
+    def test_refresh_picks_up_role_and_profile_changes(self):
+        refresh = self.login("customer")['refresh']
+        user = self.customer.user
+        user.role = 'vendor'
+        user.save()
+        Vendor.objects.create(user=user,shop_name="New shop")
+        response = self.client.post(reverse('token_refresh'),{'refresh':refresh},format='json')
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get(reverse('vendor-orders')).status_code,status.HTTP_200_OK)
+        # nor can a deactivated user keep refreshing
+        user.is_active = False
+        user.save()
+        response = self.client.post(reverse('token_refresh'),{'refresh':response.data['refresh']},format='json')
+        self.assertEqual(response.status_code,status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_without_claims_still_work(self):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        token = RefreshToken.for_user(self.customer.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token.access_token}")
+        # user row and customer profile from the database
+        self.assertEqual(len(self.user_queries(reverse('customer-cart'))),2)
+
+
+class TestAsyncCatalog(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.category = Category.objects.create(name="Shirts")
+        for i in range(5):
+            make_product(self.vendor,name=f"Shirt {i}",price=f"{10 + i}.00",category=self.category)
+        make_product(make_vendor("other","Other"),name="Mug")
+
+    def test_payloads_match_sync_views(self):
+        params = {'cursor':'','page_size':2,'ordering':'price','category':self.category.id}
+        sync = self.client.get(reverse('products-list'),params).json()
+        async_ = self.client.get(reverse('async-products-list'),params).json()
+        self.assertEqual(async_['results'],sync['results'])
+        # same cursors, only the path differs
+        self.assertEqual(async_['next'].replace('/async',''),sync['next'])
+        page2 = self.client.get(async_['next']).json()
+        self.assertEqual([p['name'] for p in page2['results']],["Shirt 2","Shirt 3"])
+
+        product = Product.objects.get(name="Shirt 0")
+        self.assertEqual(
+            self.client.get(reverse('async-products-detail',kwargs={'slug':product.slug})).json(),
+            self.client.get(reverse('products-detail',kwargs={'slug':product.slug})).json(),
+        )
+        self.assertEqual(
+            self.client.get(reverse('async-categories-list')).json(),
+            self.client.get(reverse('categories-list')).json(),
+        )
+
+    def test_storefront_and_errors(self):
+        response = self.client.get(reverse('async-vendor-storefront',kwargs={'slug':self.vendor.slug}),{'search':'shirt'})
+        data = response.json()
+        self.assertEqual(data['vendor']['shop_name'],"Shop")
+        self.assertEqual(len(data['results']),5)
+        self.assertEqual(self.client.get(reverse('async-products-list'),{'price__gte':'x'}).status_code,400)
+        self.assertEqual(self.client.get(reverse('async-products-list'),{'cursor':'bogus'}).status_code,404)
+        self.assertEqual(self.client.get(reverse('async-vendor-storefront',kwargs={'slug':'nope'})).status_code,404)
+        self.assertEqual(self.client.post(reverse('async-products-list')).status_code,405)
+
+
+class TestBenchmarkSuite(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seeded_scenarios_run_cleanly(self):
+        from .benchmarking import endpoint_scenarios,run_scenario
+        from .seeding import DatasetSize,seed_dataset
+        dataset = seed_dataset(DatasetSize(vendors=2,products=20,customers=3,orders=5))
+        self.assertEqual(Product.objects.exclude(primary_image_path='').count(),20)
+        self.assertEqual(Order.objects.filter(total_amount=0).count(),0)
+        for scenario in endpoint_scenarios(dataset):
+            result = run_scenario(self.client,scenario,iterations=3)
+            self.assertEqual(result['errors'],0,scenario.name)
+            self.assertIsNotNone(result['p95_ms'])
+
+    def test_generate_data_streams_batches(self):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('generate_data',vendors=2,products=25,images=2,customers=7,cart_items=2,orders=11,
+                     order_items=2,seed=3,batch_size=4,stdout=out)
+        self.assertIn('rows/s',out.getvalue())
+        products = Product.objects.filter(vendor__slug__startswith='bench-shop-3-')
+        self.assertEqual(products.count(),25)
+        self.assertEqual(products.values('slug').distinct().count(),25)
+        self.assertEqual(ProductImage.objects.filter(product__in=products).count(),50)
+        self.assertFalse(products.filter(primary_image__isnull=True).exists())
+        self.assertEqual(Order.objects.count(),11)
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.total_amount,sum(item.price*item.quantity for item in order.items.all()))
+        self.assertFalse(Cart.objects.exclude(item_count=0).filter(subtotal=0).exists())
+
+        # a second dataset next to the first keeps public slugs unique
+        call_command('generate_data',vendors=2,products=25,images=0,customers=2,cart_items=0,orders=0,
+                     order_items=1,seed=4,batch_size=4,stdout=StringIO())
+        self.assertEqual(Product.objects.values('slug').distinct().count(),50)
+        slug = Product.objects.filter(vendor__slug__startswith='bench-shop-4-').first().slug
+        self.assertEqual(self.client.get(reverse('products-detail',kwargs={'slug':slug})).status_code,status.HTTP_200_OK)
+
+    def test_compare_flags_regressions(self):
+        from .benchmarking import compare_results
+        baseline = {'endpoints':{'cart':{'p95_ms':10.0,'queries_mean':3.0,'errors':0}}}
+        same = {'endpoints':{'cart':{'p95_ms':11.0,'queries_mean':3.0,'errors':0}}}
+        worse = {'endpoints':{'cart':{'p95_ms':20.0,'queries_mean':4.0,'errors':0}}}
+        self.assertEqual(compare_results(same,baseline),[])
+        self.assertEqual(len(compare_results(worse,baseline)),2)
+
+
+class TestInstrumentation(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.product = make_product(self.vendor)
+        self.staff = User.objects.create_user(username="ops",password="Test@123",is_staff=True)
+
+    def test_server_timing_only_for_staff(self):
+        url = reverse('products-detail',kwargs={'slug':self.product.slug})
+        response = self.client.get(url)
+        self.assertNotIn('Server-Timing',response)
+        self.client.force_authenticate(self.staff)
+        cache.clear()
+        response = self.client.get(url)
+        timing = response['Server-Timing']
+        self.assertRegex(timing,r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn('cache;desc="hit=0 miss=1"',timing)
+        response = self.client.get(url)
+        self.assertIn('db;dur=0.0;desc="0 queries"',response['Server-Timing'])
+        self.assertIn('cache;desc="hit=1 miss=0"',response['Server-Timing'])
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse('products-list'))
+        url = reverse('metrics')
+        self.assertIn(self.client.get(url).status_code,(status.HTTP_401_UNAUTHORIZED,status.HTTP_403_FORBIDDEN))
+        response = self.client.get(url,HTTP_AUTHORIZATION="Metrics scrape-me")
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram',body)
+        self.assertRegex(body,r'http_request_duration_seconds_count\{view="ProductListView",action="list"\} [1-9]')
+        self.assertIn('http_request_db_queries_bucket{view="ProductListView",action="list",le="+Inf"}',body)
+        self.assertIn('http_response_cache_total{view="ProductListView",action="list",result="miss"}',body)
+
+
+class TestSlugAllocation(APITestCase):
+    def setUp(self):
+        self.vendor = make_vendor()
+
+    def test_one_query_whatever_the_collisions(self):
+        for _ in range(6):
+            make_product(self.vendor)
+        Product.objects.filter(slug='t-shirt-3').delete()
+        with CaptureQueriesContext(connection) as captured:
+            product = make_product(self.vendor)
+        self.assertEqual(product.slug,'t-shirt-3')
+        self.assertEqual(sum('LIKE' in query['sql'] for query in captured.captured_queries),1)
+        # other vendors and similar names don't count
+        self.assertEqual(make_product(make_vendor("v2","Other"),name="T Shirt").slug,'t-shirt')
+        self.assertEqual(make_product(self.vendor,name="T-Shirt Red").slug,'t-shirt-red')
+
+    def test_vendor_and_category_collisions(self):
+        self.assertEqual(make_vendor("v2","Shop!").slug,'shop-1')
+        Category.objects.create(name="Shoes")
+        self.assertEqual(Category.objects.create(name="Shoes?").slug,'shoes-1')
+
+    def test_retries_when_a_concurrent_insert_wins(self):
+        from unittest import mock
+        from . import slugs
+        make_product(self.vendor)
+        real = slugs.taken_slugs
+        calls = []
+        def stale(*args):
+            # the first lookup misses a row inserted concurrently
+            calls.append(args)
+            return set() if len(calls) == 1 else real(*args)
+        with mock.patch.object(slugs,'taken_slugs',stale):
+            product = make_product(self.vendor)
+        self.assertEqual(product.slug,'t-shirt-1')
+        self.assertEqual(len(calls),2)
+
+    def test_bulk_assignment(self):
+        from .slugs import assign_slugs
+        make_product(self.vendor)
+        other = make_vendor("v2","Other")
+        products = [Product(vendor=self.vendor,name="T-Shirt",price=1,stock=1) for _ in range(3)]
+        products += [Product(vendor=other,name="T-Shirt",price=1,stock=1),
+                     Product(vendor=self.vendor,name="Cap",price=1,stock=1,slug='t-shirt-2')]
+        with CaptureQueriesContext(connection) as captured:
+            assign_slugs(products,'name',scope=('vendor_id',))
+        self.assertEqual(len(captured),2)
+        self.assertEqual([product.slug for product in products],['t-shirt-1','t-shirt-3','t-shirt-4','t-shirt','t-shirt-2'])
+        Product.objects.bulk_create(products)
+
+
+class TestCatalogImportExport(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.category = Category.objects.create(name="Tops")
+        self.existing = make_product(self.vendor,name="Old Tee",price="10.00",stock=1)
+        self.client.force_authenticate(self.vendor.user)
+
+    def upload(self,name,body,**data):
+        return self.client.post(reverse('vendor-products-bulk-import'),
+                                dict(data,file=SimpleUploadedFile(name,body.encode())),format='multipart')
+
+    def test_csv_import_creates_updates_and_reports(self):
+        body = ("slug,name,description,price,stock,category,is_active\n"
+                "old-tee,,,12.50,,tops,\n"
+                ",Tee,plain,5.00,3,,\n"
+                ",Tee,,5.00,4,tops,False\n"
+                "new-cap,Cap,,x,1,,\n"
+                ",Hat,,1.00,1,nope,\n"
+                "missing,,,1.00,,,\n")
+        response = self.upload("catalog.csv",body)
+        self.assertEqual(response.status_code,status.HTTP_200_OK)
+        self.assertEqual((response.data['created'],response.data['updated'],response.data['failed']),(2,1,3))
+        self.assertEqual([error['row'] for error in response.data['errors']],[5,6,7])
+        self.assertIn('price',response.data['errors'][0]['errors'])
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.price,self.existing.name,self.existing.category),(Decimal('12.50'),"Old Tee",self.category))
+        tees = Product.objects.filter(vendor=self.vendor,name="Tee").order_by('id')
+        self.assertEqual([(p.slug,p.stock,p.is_active) for p in tees],[('tee',3,True),('tee-1',4,False)])
+        self.assertTrue(Product.objects.filter(search_document__name="Tee").exists())
+
+    def test_import_without_returned_pks(self):
+        # mysql's bulk INSERT doesn't hand back ids
+        from unittest import mock
+        with mock.patch.object(type(connection.features),'can_return_rows_from_bulk_insert',False):
+            response = self.upload("catalog.jsonl",'{"name":"Scarf","price":"3.00","stock":2}\n')
+        self.assertEqual(response.data['created'],1)
+        self.assertTrue(Product.objects.filter(search_document__name="Scarf").exists())
+
+    def test_import_queries_do_not_grow_with_rows(self):
+        def run(count,prefix):
+            lines = "".join(f'{{"name":"{prefix} {i}","price":"1.00","stock":1}}\n' for i in range(count))
+            with CaptureQueriesContext(connection) as captured:
+                response = self.upload("catalog.jsonl",lines)
+            self.assertEqual(response.data['created'],count)
+            return len(captured)
+        self.assertEqual(run(5,"A"),run(40,"B"))
+
+    def test_export_round_trips(self):
+        make_product(self.vendor,name="Tee",category=self.category)
+        response = self.client.get(reverse('vendor-products-bulk-export'))
+        self.assertEqual(response['Content-Type'],'text/csv')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.splitlines()[0],'slug,name,description,price,stock,category,is_active')
+        self.assertIn('tee,Tee,,100.00,10,tops,True',body)
+        response = self.upload("again.csv",body)
+        self.assertEqual((response.data['created'],response.data['updated'],response.data['failed']),(0,2,0))
+        response = self.client.get(reverse('vendor-products-bulk-export'),{'type':'jsonl'})
+        import json
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['slug'] for row in rows],['old-tee','tee'])
+        self.assertEqual(self.client.get(reverse('vendor-products-bulk-export'),{'type':'xml'}).status_code,400)
+
+    async def test_export_streams_async_under_asgi(self):
+        from asgiref.sync import sync_to_async
+        from .authentication import token_for_user
+        token = await sync_to_async(lambda: str(token_for_user(self.vendor.user).access_token))()
+        response = await self.async_client.get(reverse('vendor-products-bulk-export'),
+                                               headers={'Authorization':f"Bearer {token}"})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('old-tee,Old Tee',body)
+
+
+@override_settings(JOBS_EAGER=True)
+class TestImageDerivatives(MediaTestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_vendor()
+        self.product = make_product(self.vendor)
+
+    def photo(self,size=(2000,1000),mode='RGBA',name="photo.png"):
+        import io
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new(mode,size,(200,10,10,128) if mode == 'RGBA' else (200,10,10)).save(buffer,'PNG')
+        return SimpleUploadedFile(name,buffer.getvalue(),content_type="image/png")
+
+    def test_upload_renders_derivatives_after_commit(self):
+        self.client.force_authenticate(self.vendor.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('product-images-list'),
+                                        {'product':self.product.id,'image':self.photo()},format='multipart')
+        self.assertEqual(response.status_code,status.HTTP_201_CREATED)
+        image = ProductImage.objects.get()
+        self.assertEqual((image.derivatives_status,image.width,image.height),('ready',2000,1000))
+        self.assertEqual({size:(v['width'],v['height']) for size,v in image.derivatives.items()},
+                         {'thumb':(160,80),'card':(480,240),'detail':(1200,600)})
+        storage = image.image.storage
+        self.assertTrue(all(storage.exists(v[kind]) for v in image.derivatives.values() for kind in ('webp','jpeg')))
+
+        card = self.client.get(reverse('products-list')).data['results'][0]
+        self.assertTrue(card['image'].endswith(f"/products/derived/{image.id}/card.jpg"))
+        self.assertIn("card.webp 480w",card['image_srcset'])
+        detail = self.client.get(reverse('products-detail',kwargs={'slug':self.product.slug})).data
+        self.assertTrue(detail['images'][0]['variants']['detail']['webp'].endswith("detail.webp"))
+        self.assertTrue(detail['images'][0]['image'].endswith(".png"))
+
+    def test_backfill_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        small = ProductImage.objects.create(product=self.product,image=self.photo((100,50),'RGB'))
+        broken = ProductImage.objects.create(product=make_product(self.vendor,name="Cap"),
+                                             image=SimpleUploadedFile("bad.png",b"not an image"))
+        out = StringIO()
+        call_command('process_images',stdout=out)
+        self.assertIn("1 failed, 1 ready",out.getvalue())
+        small.refresh_from_db()
+        # never upscaled, equal sizes collapse in the srcset
+        self.assertEqual({v['width'] for v in small.derivatives.values()},{100})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image_derivatives,small.derivatives)
+        self.assertEqual(ProductImage.objects.get(pk=broken.pk).derivatives_status,'failed')
+        from .serializers import image_srcset
+        self.assertNotIn(",",image_srcset(small.derivatives))
+
+
+JOB_CALLS = []
+
+
+@job('tests.record')
+def record_job(value,fail=0):
+    JOB_CALLS.append(value)
+    if len(JOB_CALLS) <= fail:
+        raise RuntimeError("boom")
+
+
+class TestJobQueue(APITestCase):
+    def setUp(self):
+        JOB_CALLS.clear()
+        self.calls = JOB_CALLS
+        self.record = record_job
+
+    def test_enqueue_is_transactional_and_workers_claim_once(self):
+        from django.db import transaction
+        from .jobs import claim_jobs,run_claimed
+        from .models import Job
+        try:
+            with transaction.atomic():
+                self.record.enqueue(1)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(Job.objects.exists())
+        self.record.enqueue(2)
+        self.record.enqueue(3)
+        first = claim_jobs('w1',limit=1)
+        second = claim_jobs('w2',limit=5)
+        self.assertEqual([len(first),len(second),len(claim_jobs('w3'))],[1,1,0])
+        self.assertEqual(run_claimed(first[0]),'done')
+        done = Job.objects.get(pk=first[0].pk)
+        self.assertEqual((done.status,done.attempts,done.locked_by),('done',1,''))
+        self.assertIsNotNone(done.duration_ms)
+        self.assertEqual(self.calls,[2])
+
+    def test_retries_with_backoff_then_fails(self):
+        from datetime import timedelta
+        from .jobs import claim_jobs,run_claimed
+        from .metrics import registry
+        from .models import Job
+        queued = self.record.enqueue(1,fail=2)
+        Job.objects.filter(pk=queued.pk).update(max_attempts=2)
+        self.assertEqual(run_claimed(claim_jobs('w')[0]),'retry')
+        retry = Job.objects.get(pk=queued.pk)
+        self.assertEqual(retry.status,'queued')
+        self.assertIn("boom",retry.last_error)
+        self.assertGreater(retry.run_at,timezone.now()+timedelta(seconds=5))
+        self.assertEqual(claim_jobs('w'),[])
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(run_claimed(claim_jobs('w')[0]),'failed')
+        self.assertEqual(Job.objects.get(pk=queued.pk).status,'failed')
+        self.assertIn('job_duration_seconds_count{job="tests.record",result="failed"}',registry.render())
+
+    def test_expired_lease_is_reclaimed(self):
+        from datetime import timedelta
+        from .jobs import claim_jobs,run_claimed
+        from .models import Job
+        self.record.enqueue(1)
+        stale = claim_jobs('dead')[0]
+        Job.objects.update(locked_at=timezone.now()-timedelta(hours=1))
+        taken = claim_jobs('alive')[0]
+        self.assertEqual(taken.attempts,2)
+        # the dead worker's late result doesn't overwrite the new owner's
+        run_claimed(stale)
+        self.assertEqual(Job.objects.get().status,'running')
+        self.assertEqual(run_claimed(taken),'done')
+
+        # a job that keeps killing its worker gives up after max_attempts
+        Job.objects.update(status='running',attempts=Job.objects.get().max_attempts,locked_at=timezone.now()-timedelta(hours=1))
+        self.assertEqual(claim_jobs('alive'),[])
+        self.assertEqual(Job.objects.get().status,'failed')
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_and_worker_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import Job
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record.enqueue(1)
+        self.assertEqual(self.calls,[1])
+        with override_settings(JOBS_EAGER=False):
+            self.record.enqueue(2)
+            self.record.enqueue(3)
+        out = StringIO()
+        call_command('run_worker',burst=True,keep_days=0,stdout=out)
+        self.assertIn("2 done",out.getvalue())
+        self.assertEqual(sorted(self.calls),[1,2,3])
+        self.assertEqual(set(Job.objects.values_list('status',flat=True)),{'done'})
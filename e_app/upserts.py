@@ -0,0 +1,30 @@
+"""
+Upserts for every backend we run on.
+
+bulk_create(update_conflicts=True, unique_fields=...) is INSERT ... ON
+CONFLICT (...) DO UPDATE on postgres and sqlite. MySQL's ON DUPLICATE KEY
+UPDATE has no conflict target and Django refuses `unique_fields` there, so
+on backends without one the rows with the same keys are deleted and the new
+ones inserted, in one transaction.
+"""
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+
+def upsert(model, objs, unique_fields, update_fields):
+    """Insert `objs`, or update `update_fields` of the rows that have the same `unique_fields`."""
+    if not objs:
+        return
+    using = router.db_for_write(model)
+    if connections[using].features.supports_update_conflicts_with_target:
+        model.objects.using(using).bulk_create(
+            objs, update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields,
+        )
+        return
+    fields = [model._meta.get_field(name) for name in unique_fields]
+    keys = Q()
+    for obj in objs:
+        keys |= Q(**{field.attname: getattr(obj, field.attname) for field in fields})
+    with transaction.atomic(using=using):
+        model.objects.using(using).filter(keys).delete()
+        model.objects.using(using).bulk_create(objs)
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductImageViewSet,RegisterCustomerView,VendorProductViewSet, ProductListView,CartView,VendorDashboardView, OrderView,AdminOrderView,CustomerAddressViewSet,LoginView,RegisterVendorView,VendorOrderView
+from .views import CategoryViewSet, ProductImageViewSet,RegisterCustomerView,VendorProductViewSet, ProductListView,CartView,CartBatchView,VendorDashboardView, OrderView,AdminOrderView,CustomerAddressViewSet,LoginView,RegisterVendorView,VendorOrderView,VendorOrderStatusView,MetricsView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from . import async_views
 # Register viewsets with a router (ProductListView is a ModelViewSet)
 router = DefaultRouter()
 router.register(r'products', ProductListView, basename='products')
@@ -26,6 +27,8 @@ urlpatterns = [
    
     # path('vendor/dashboard/<int:pk>/', VendorProductView.as_view(), name='vendor-product-detail'),
     path('vendor/orders/',VendorOrderView.as_view(),name='vendor-orders'),
+    path('vendor/orders/<int:pk>/',VendorOrderView.as_view(),name='vendor-order-detail'),
+    path('vendor/orders/status/',VendorOrderStatusView.as_view(),name='vendor-orders-status'),
     path('dashboard/',VendorDashboardView.as_view(),name="vendor-dashboard"),
    
     # Customer endpoints (orders and cart) - APIView-based
@@ -33,7 +36,16 @@ urlpatterns = [
     path('customer/orders/<int:pk>/', OrderView.as_view(), name='customer-order-detail'),
     path('customer/cart/', CartView.as_view(), name='customer-cart'),
     path('customer/cart/<int:pk>/', CartView.as_view(), name='customer-cart-item'),
+    path('customer/cart/batch/', CartBatchView.as_view(), name='customer-cart-batch'),
     path('customer/addresses/',customer_address,name='customer-addresses'),
     path('admin/orders/<int:pk>/',AdminOrderView.as_view(), name='admin-orders'),
     
+    path('metrics/',MetricsView.as_view(),name='metrics'),
+    
+    # async catalog reads (e_app/async_views.py), for ASGI workers
+    path('async/products/',async_views.product_list,name='async-products-list'),
+    path('async/products/<slug:slug>/',async_views.product_detail,name='async-products-detail'),
+    path('async/categories/',async_views.category_list,name='async-categories-list'),
+    path('async/vendors/<slug:slug>/',async_views.vendor_storefront,name='async-vendor-storefront'),
+    
 ]
@@ -1,20 +1,31 @@
 from django.shortcuts import render,get_object_or_404,redirect
+from django.http import HttpResponse,StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from rest_framework.views import APIView
-from rest_framework import viewsets,filters
+from rest_framework import generics,viewsets,filters
+from rest_framework.decorators import action
 from rest_framework import status
 from django.contrib.auth import authenticate 
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated,AllowAny,IsAdminUser
 from rest_framework.response import Response
-from .permissions import IsVendor,IsCustomer
+from .permissions import IsVendor,IsCustomer,CanScrapeMetrics
 from .models import (User,Product,Payment,ProductImage,Order,OrderItem,Address,Cart,CartItem,Category,Customer,Vendor)
 from decimal import Decimal
 from rest_framework.parsers import MultiPartParser,FormParser
 from django.db import transaction
-from django.db.models import F,Prefetch
+from django.db.models import F,Prefetch,Count,Max,Q
 from rest_framework.exceptions import PermissionDenied
-from . serializers import VendorProductSerializer,CustomerRegisterSerializer,LoginSerializer,CartSerializer,VendorRegisterSerializer,UserSerializer,OrderSerializer,VendorSerializer,VendorOrderSerializer,AddressSerializer,PaymentSerializer,ProductListSerializer,ProductDetailSerializer,CartItemSerializer,CategorySerializer,CustomerSerializer,OrderItemSerializer,ProductImageSerializer
-from rest_framework.pagination import PageNumberPagination
+from . serializers import VendorProductSerializer,CustomerRegisterSerializer,LoginSerializer,CartSerializer,VendorRegisterSerializer,UserSerializer,OrderSerializer,VendorSerializer,VendorOrderSerializer,AddressSerializer,PaymentSerializer,ProductListSerializer,ProductDetailSerializer,CartItemSerializer,CategorySerializer,CustomerSerializer,OrderItemSerializer,OrderItemStatusSerializer,ProductImageSerializer
+from .pagination import HomeProductPagination,VendorOrderPagination
+from .search import ProductSearchFilter,search_products
+from .facets import ProductFilter,product_facets,requested_facets
+from .caching import ENTRY_TIMEOUT,CachedResponseMixin,vendor_dashboard_key
+from .conditional import latest,make_etag,not_modified,set_validators
+from .metrics import record_cache,registry
+from .carts import apply_cart_operations,parse_cart_operations,prefetch_cart_lines
+from .orders import OrderStatusError,VendorOrderFilter,cancel_order,order_for_response,parse_order_lines,place_cart_order,place_order,target_status,transition_items
+from .product_io import FILE_TYPES,READERS,aexport_chunks,export_chunks,export_queryset,file_type,import_products
 from django.core.cache import cache
 from django_filters.rest_framework import DjangoFilterBackend
 
@@ -59,8 +70,11 @@ class VendorProductViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated,IsVendor]
     
     def get_queryset(self):
-        return Product.objects.filter(
-            vendor=self.request.user.vendor_profile).prefetch_related("images")
+        queryset = Product.objects.filter(vendor=self.request.user.vendor_profile)
+        if self.action == 'list':
+            # list cards read Product.primary_image_path
+            return queryset
+        return queryset.prefetch_related("images")
     
     def list(self,request,*args,**kwargs):
         serializer = ProductListSerializer(
@@ -70,6 +84,27 @@ class VendorProductViewSet(viewsets.ModelViewSet):
     
     def perform_create(self,serializer):
         serializer.save(vendor = self.request.user.vendor_profile)
+    
+    # bulk catalog import / export, see product_io.py
+    @action(detail=False,methods=['post'],url_path='import',parser_classes=[MultiPartParser,FormParser])
+    def bulk_import(self,request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error":"Upload the catalog as a 'file' field."},status=status.HTTP_400_BAD_REQUEST)
+        kind = file_type(upload.name,request.data.get('type'))
+        report = import_products(request.user.vendor_profile,READERS[kind](upload))
+        return Response(report.as_dict(),status=status.HTTP_200_OK)
+    
+    @action(detail=False,methods=['get'],url_path='export')
+    def bulk_export(self,request):
+        kind = file_type('',request.query_params.get('type','csv'))
+        vendor = request.user.vendor_profile
+        queryset = export_queryset(vendor)
+        # an ASGI server can only stream an async iterator without buffering it
+        chunks = aexport_chunks if isinstance(request._request,ASGIRequest) else export_chunks
+        response = StreamingHttpResponse(chunks(queryset,kind),content_type=FILE_TYPES[kind])
+        response['Content-Disposition'] = f'attachment; filename="{vendor.slug}-products.{kind}"'
+        return response
 
 # productImage add and delete for vendor
 class ProductImageViewSet(viewsets.ModelViewSet):
@@ -96,50 +131,56 @@ class ProductImageViewSet(viewsets.ModelViewSet):
         if product.vendor != self.request.user.vendor_profile:
             raise PermissionDenied("You do not own this product.")
         
-        is_first = not ProductImage.objects.filter(
-            product=product, is_primary=True).exists()
+        # first upload becomes primary, Product.primary_image is synced by signal
+        is_first = product.primary_image_id is None
         serializer.save(is_primary=is_first)
         
         
     
     def perform_update(self,serializer):
         # only one primary image per product
-        instance = self.get_object()
-        if self.request.data.get("is_primary")==True:
-            ProductImage.objects.filter(product=instance.product).update(is_primary=False)
+        instance = serializer.instance
+        if serializer.validated_data.get("is_primary"):
+            ProductImage.objects.filter(product_id=instance.product_id).exclude(pk=instance.pk).update(is_primary=False)
         serializer.save()
 
 # vendor order view
 
-class VendorOrderView(APIView):
+class VendorOrderView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated,IsVendor]
+    serializer_class = VendorOrderSerializer
+    pagination_class = VendorOrderPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = VendorOrderFilter
+    
+    def get_queryset(self):
+        # customer name and thumbnail come from the joins, one query per page
+        return OrderItem.objects.filter(vendor=self.request.user.vendor_profile).select_related(
+            'order__customer__user','product').defer('product__description')
     
     def get(self,request):
-        vendor = request.user.vendor_profile
-        order_item = OrderItem.objects.filter(vendor=vendor).select_related('order','product').order_by('-id')
-        serializer = VendorOrderSerializer(order_item,many=True,context={"request":request})
-        return Response(serializer.data,status=status.HTTP_200_OK)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(page,many=True)
+        return self.get_paginated_response(serializer.data)
     
     def patch(self,request,pk):
         vendor = request.user.vendor_profile 
         try:
-            order_item = OrderItem.objects.get(id=pk,vendor=vendor)
-        except OrderItem.DoesNotExist:
+            new_status = target_status(request.data.get("status"))
+        except OrderStatusError as exc:
+            return Response({"error":exc.detail},status=status.HTTP_400_BAD_REQUEST)
+        
+        result = transition_items(vendor,[pk],new_status)[0]
+        if result['result'] == 'not_found':
             return Response(
                 {"error":"Order not found or unauthorized"},
                 status=status.HTTP_404_NOT_FOUND
             )
-        new_status = request.data.get("status")
-        allowed_status = ["ACCEPTED","PACKED","SHIPPED","DELIVERD","CANCELLED"]
-        
-        if new_status not in allowed_status:
+        if result['result'] == 'invalid_transition':
             return Response(
-                {"error":"Invalid status value"},
+                {"error":f"Cannot move an order from {result['status']} to {new_status}"},
                 status=status.HTTP_400_BAD_REQUEST
-                
             )
-        order_item.status = new_status
-        order_item.save()
         
         return Response(
             {
@@ -147,33 +188,74 @@ class VendorOrderView(APIView):
                 "new_status":new_status
             }, status=status.HTTP_200_OK
         )
+
+
+class VendorOrderStatusView(APIView):
+    """Move many of the vendor's order items to one status, e.g. {"ids":[1,2,3],"status":"SHIPPED"}."""
+    permission_classes = [IsAuthenticated,IsVendor]
+    
+    def post(self,request):
+        serializer = OrderItemStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        new_status = serializer.validated_data['status']
+        results = transition_items(request.user.vendor_profile,serializer.validated_data['ids'],new_status)
+        return Response({
+            "status":new_status,
+            "updated":sum(1 for result in results if result['result'] == 'updated'),
+            "results":results,
+        },status=status.HTTP_200_OK)
         
         
-# pagination for optimization
-class HomeProductPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
 # for all users 
 
-class ProductListView(viewsets.ModelViewSet):
+class ProductListView(CachedResponseMixin,viewsets.ModelViewSet):
     permission_classes = [AllowAny]
     queryset = Product.objects.filter(is_active=True).select_related('category').prefetch_related('images').order_by('-created_at')
     pagination_class = HomeProductPagination
-    filter_backends = [DjangoFilterBackend,filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name']
+    # ?search= is ranked full text over name, description, category and shop name
+    filter_backends = [DjangoFilterBackend,ProductSearchFilter, filters.OrderingFilter]
     ordering_fields = ['price', 'created_at']
-    filterset_fields = {
-        'category':['exact'],
-        'price':['gte','lte'],
-    }
+    filterset_class = ProductFilter
     lookup_field = "slug"
     lookup_url_kwarg = "slug"
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # list cards read Product.primary_image_path, skip the images prefetch
+            return queryset.prefetch_related(None)
+        return queryset.select_related('vendor__user')
+    
     def get_serializer_class(self):
         if self.action == 'list':
             return ProductListSerializer
         return ProductDetailSerializer
     
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        names = requested_facets(self.request.query_params)
+        if names:
+            response.data['facets'] = product_facets(self.facet_queryset, names)
+        return response
+    
+    def facet_queryset(self, ignore):
+        # the list's search and filters without the facet's own parameters
+        params = self.request.query_params.copy()
+        for param in ignore:
+            params.pop(param, None)
+        queryset = ProductFilter(params, queryset=super().get_queryset(), request=self.request).qs
+        return search_products(queryset, params.get('search', ''))
+    
+    def get_cache_tags(self):
+        if self.action == 'list':
+            # facets carry category names
+            return ['product-list','categories'] if requested_facets(self.request.query_params) else ['product-list']
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg]}
+        product = Product.objects.filter(is_active=True,**lookup).values('id','category_id','vendor_id').first()
+        if product is None:
+            return None
+        return [f"product:{product['id']}",f"category:{product['category_id']}",f"vendor:{product['vendor_id']}"]
+    
    
    
 # add carts items
@@ -183,49 +265,65 @@ class CartView(APIView):
     def get(self,request):
         customer = request.user.customer_profile
         cart,created = Cart.objects.get_or_create(customer=customer)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data,status=status.HTTP_200_OK)
+        # every line change stamps the cart (Cart.refresh_totals), products cover the rest
+        stamps = cart.items.aggregate(products=Max('product__updated_at'))
+        etag = make_etag(cart.pk,cart.updated_at,request.accepted_media_type,stamps['products'])
+        last_modified = latest(cart.updated_at,stamps['products'])
+        response = not_modified(request,etag,last_modified,private=True)
+        if response is not None:
+            return response
+        serializer = CartSerializer(prefetch_cart_lines(cart),context={'request':request})
+        return set_validators(Response(serializer.data,status=status.HTTP_200_OK),etag,last_modified,private=True)
     
     def post(self,request):
         customer = request.user.customer_profile
         cart,created = Cart.objects.get_or_create(customer=customer)
-        data = request.data.copy()
-        # handling duplicate carts items
-        product = Product.objects.get(id=data['product_id'])
-        existing_item = CartItem.objects.filter(cart=cart,product=product).first()
-        
-        if existing_item:
-            existing_item.quantity += int(data['quantity'])
-            existing_item.save()
-            return Response(CartItemSerializer(existing_item).data,status=status.HTTP_200_OK)
-        
-        # create new cart item
-        data['cart_id'] = cart.id
-        serializer = CartItemSerializer(data=data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data,status=status.HTTP_201_CREATED)
-        return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
+        changes = parse_cart_operations([{
+            'op':'add',
+            'product_id':request.data.get('product_id'),
+            'quantity':request.data.get('quantity',1),
+        }])
+        [product_id] = changes
+        created = not cart.items.filter(product_id=product_id).exists()
+        # an atomic increment, a duplicate add adds to the existing line
+        apply_cart_operations(cart,changes)
+        item = cart.items.select_related('product').get(product_id=product_id)
+        serializer = CartItemSerializer(item,context={'request':request})
+        return Response(serializer.data,status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
             
     def patch(self,request,pk):
         customer = request.user.customer_profile
         cart = get_object_or_404(Cart,customer=customer)
         cart_item = get_object_or_404(CartItem,pk=pk,cart=cart)
-        data = request.data.copy()
-        
-       
-        serializer = CartItemSerializer(cart_item,data=data,partial = True)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data,status=status.HTTP_200_OK)
-        return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
+        serializer = CartItemSerializer(cart_item,data=request.data,partial = True)
+        if not serializer.is_valid():
+            return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
+        # only the quantity changes, through the batch path so totals and the stock hold follow
+        quantity = serializer.validated_data.get('quantity',cart_item.quantity)
+        apply_cart_operations(cart,{cart_item.product_id:('set',quantity)})
+        cart_item.refresh_from_db()
+        return Response(CartItemSerializer(cart_item,context={'request':request}).data,status=status.HTTP_200_OK)
     
     def delete(self,request,pk):
         customer = request.user.customer_profile
         cart = get_object_or_404(Cart,customer=customer)
         cart_item = get_object_or_404(CartItem,pk=pk,cart=cart)
-        cart_item.delete()
+        apply_cart_operations(cart,{cart_item.product_id:('set',0)})
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# many add / set / remove operations in one request and one transaction
+class CartBatchView(APIView):
+    permission_classes = [IsAuthenticated,IsCustomer]
+    
+    def post(self,request):
+        customer = request.user.customer_profile
+        cart,created = Cart.objects.get_or_create(customer=customer)
+        payload = request.data.get('operations') if isinstance(request.data,dict) else request.data
+        apply_cart_operations(cart,parse_cart_operations(payload))
+        cart.refresh_from_db()
+        serializer = CartSerializer(prefetch_cart_lines(cart),context={'request':request})
+        return Response(serializer.data,status=status.HTTP_200_OK)
       
         
         
@@ -247,96 +345,35 @@ class OrderView(APIView):
     
     def post(self,request):
         customer = request.user.customer_profile
-        data = request.data.copy()
+        data = request.data
         
         # handling address for order
         address_id = data.get("address_id")
         if not address_id:
-            return Response({"detail":"address_id is required"})
+            return Response({"detail":"address_id is required"},status=status.HTTP_400_BAD_REQUEST)
         try:
             address = Address.objects.get(id=address_id,customer=customer)
         except Address.DoesNotExist:
             return Response({"detail":"Invalid address_id"},status=status.HTTP_400_BAD_REQUEST)
 
-        # If items provided in request, create order directly from them
+        # If items provided in request, create order directly from them,
+        # otherwise create order from existing cart
         items_payload = data.get('items')
-
         if items_payload:
-            if not isinstance(items_payload, list) or not items_payload:
-                return Response({"detail": "`items` must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Validate and prepare items
-            validated = []
-            for idx, it in enumerate(items_payload):
-                prod_id = it.get('product_id') or it.get('product')
-                qty = it.get('quantity')
-                if prod_id is None or qty is None:
-                    return Response({"detail": f"Each item must include 'product_id' and 'quantity' (item index {idx})."}, status=status.HTTP_400_BAD_REQUEST)
-                try:
-                    product = Product.objects.get(pk=prod_id)
-                except Product.DoesNotExist:
-                    return Response({"detail": f"Product with id {prod_id} not found."}, status=status.HTTP_404_NOT_FOUND)
-                try:
-                    qty = int(qty)
-                except Exception:
-                    return Response({"detail": f"Quantity must be an integer (item index {idx})."}, status=status.HTTP_400_BAD_REQUEST)
-                if qty < 1:
-                    return Response({"detail": "Quantity must be at least 1."}, status=status.HTTP_400_BAD_REQUEST)
-                if product.stock < qty:
-                    return Response({"detail": f"Not enough stock for product '{product.name}' (requested {qty}, available {product.stock})."}, status=status.HTTP_400_BAD_REQUEST)
-                validated.append((product, qty))
-
-            # create order and items atomically to ensure consistency
-            with transaction.atomic():
-                order = Order.objects.create(customer=customer, total_amount=Decimal('0'))
-                for product, qty in validated:
-                    OrderItem.objects.create(order=order, product=product,vendor=product.vendor, quantity=qty, price=product.price)
-                # ensure totals are recalculated and saved
-                order.update_total()
-                # Optionally decrement stock here (commented):
-                for product, qty in validated:
-                    product.stock = F('stock') - qty
-                    product.save()
-
-            # Refresh from DB to get latest related items and totals
-            order.refresh_from_db()
-            order_serializer = OrderSerializer(order)
-            return Response(order_serializer.data, status=status.HTTP_201_CREATED)
-
-        # Otherwise, create order from existing cart
-        cart = get_object_or_404(Cart, customer=customer)
-        if not cart.items.exists():
-            return Response({"detail": "Cart is empty. Provide items to order or add items to cart."}, status=status.HTTP_400_BAD_REQUEST)
+            order = place_order(customer,address,parse_order_lines(items_payload))
+        else:
+            cart = get_object_or_404(Cart, customer=customer)
+            order = place_cart_order(customer,address,cart)
 
-        # create order, move items (atomic)
-        with transaction.atomic():
-            order = Order.objects.create(customer=customer, total_amount=Decimal('0'))
-            for item in cart.items.all():
-                OrderItem.objects.create(order=order, product=item.product, quantity=item.quantity, price=item.product.price)
-            # clear cart items after creating order items
-            cart.items.all().delete()
-            order.update_total()
-
-        order.refresh_from_db()
-        order_serializer = OrderSerializer(order)
+        order_serializer = OrderSerializer(order_for_response(order.pk))
         return Response(order_serializer.data, status=status.HTTP_201_CREATED)
     
 
     def delete(self,request,pk):
         customer = request.user.customer_profile
         order = get_object_or_404(Order,pk=pk,customer=customer)
-        
-        items = order.items.all()
-        if any(item.status != 'PLACED' for item in items):
-            return Response({"detail":"only placed orders can be cancelled."},
-                            status=status.HTTP_400_BAD_REQUEST)
-        
-        order.status = 'CANCELLED'
-        order.save()
-        # updating status of each item 
-        for item in items:
-            item.status = "CANCELLED"
-            item.save()
+        # one set-based pass whatever the number of items, see orders.cancel_order
+        cancel_order(order)
         return Response({'detail':" Order cancelled successfully."},
                         status=status.HTTP_200_OK)
     
@@ -378,55 +415,42 @@ class VendorDashboardView(APIView):
     def get(self, request):
         vendor = request.user.vendor_profile
         
-        # cache 
-        cache_key = f"vendor_dashboard_{vendor.id}"
-        cached_data = cache.get(cache_key)
+        # cache, invalidated by product / order item events (see caching.py)
+        cache_key = vendor_dashboard_key(vendor.id)
+        cached_data = cache.get(cache_key) if cache_key else None
+        record_cache(hit=cached_data is not None)
         if cached_data:
             return Response(cached_data)
         
+        # all order stats in one conditional aggregate over OrderItem.vendor
+        stats = OrderItem.objects.filter(vendor=vendor).aggregate(
+            total_orders=Count("id"),
+            pending_orders=Count("id",filter=~Q(status__in=["DELIVERD","CANCELLED"])),
+            completed_orders=Count("id",filter=Q(status="DELIVERD")),
+        )
+        stats = {"total_products": Product.objects.filter(vendor=vendor).count(), **stats}
 
-        stats = {
-            "total_products": Product.objects.filter(vendor=vendor).count(),
-            "total_orders":OrderItem.objects.filter(product__vendor=vendor).count(),
-            "pending_orders": OrderItem.objects.filter(product__vendor=vendor).exclude(status__in=["DELIVERD","CANCELLED"]).count(),
-            "completed_orders":OrderItem.objects.filter(product__vendor=vendor, status="DELIVERD").count(),
-            
-        }
-
-        # Recent products with images
+        # Recent products, images come from Product.primary_image_path
         recent_products = Product.objects.filter(
             vendor=vendor
-        ).prefetch_related("images").order_by("-created_at")[:5]
+        ).order_by("-created_at")[:5]
 
         recent_products_data = ProductListSerializer(
             recent_products, many=True, context={"request": request}
         ).data
 
-        # Recent orders (correct relationship)
-        recent_orders = OrderItem.objects.filter(
-            product__vendor=vendor
-        ).select_related("order", "product").order_by("-id")[:5]
+        vendor_items = OrderItem.objects.filter(vendor=vendor).select_related("order","product").order_by("-id")
 
         recent_orders_data = OrderItemSerializer(
-            recent_orders, many=True, context={"request": request}
+            vendor_items[:5], many=True, context={"request": request}
         ).data
         
-        pending_orders =OrderItem.objects.filter(
-            product__vendor=vendor
-        
-        ).exclude(status__in=["DELIVERD","CANCELLED"]).select_related("order","product").order_by("-id")[:5]
-        
         pending_orders_data = OrderItemSerializer(
-            pending_orders,many=True,context={"request":request}
+            vendor_items.exclude(status__in=["DELIVERD","CANCELLED"])[:5],many=True,context={"request":request}
         ).data
         
-        completed_orders = OrderItem.objects.filter(
-            product__vendor=vendor,
-            status="DELIVERD"
-        ).select_related("order","product").order_by("-id")[:5]
-        
         completed_orders_data = OrderItemSerializer(
-            completed_orders,many=True,context={"request":request}
+            vendor_items.filter(status="DELIVERD")[:5],many=True,context={"request":request}
         ).data
         
         data = {
@@ -438,18 +462,26 @@ class VendorDashboardView(APIView):
             
         }
         
-        cache.set(cache_key,data,60)
+        if cache_key:
+            cache.set(cache_key,data,ENTRY_TIMEOUT)
 
         return Response(data)
 
 
         
 # category viewset 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(CachedResponseMixin,viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    permission_classes = [AllowAny]   
-        
-       
+    permission_classes = [AllowAny]
+    
+    def get_cache_tags(self):
+        return ['categories']
+
 
-    
\ No newline at end of file
+# Prometheus scrape endpoint, see e_app/metrics.py
+class MetricsView(APIView):
+    permission_classes = [CanScrapeMetrics]
+    
+    def get(self,request):
+        return HttpResponse(registry.render(),content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover everything below (e_app/metrics.py)
+    'e_app.metrics.MetricsMiddleware',
     # added cors and whitenoise 
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -94,7 +96,8 @@ WSGI_APPLICATION = 'ecom.wsgi.application'
 if os.environ.get('DATABASE_URL'):
     DATABASES = {"default": dj_database_url.config(
         default=os.environ.get('DATABASE_URL'),
-        conn_max_age=600,
+        # 0 under ASGI (render.yaml), connections don't outlive their request thread there
+        conn_max_age=config('DB_CONN_MAX_AGE',default=600,cast=int),
         ssl_require=True
         
     )}
@@ -121,7 +124,8 @@ AUTH_USER_MODEL = 'e_app.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES' : (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication that trusts the role/profile claims, see e_app/authentication.py
+        'e_app.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS':[
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -131,6 +135,33 @@ REST_FRAMEWORK = {
     ],
 }
 
+# CACHE
+# shared redis cache in production (set REDIS_URL), per-process memory locally and in tests
+REDIS_URL = config('REDIS_URL',default='')
+if REDIS_URL:
+    CACHES = {
+        'default':{
+            'BACKEND':'django_redis.cache.RedisCache',
+            'LOCATION':REDIS_URL,
+            'KEY_PREFIX':'ecom',
+            'OPTIONS':{
+                'CLIENT_CLASS':'django_redis.client.DefaultClient',
+                # a cache outage degrades to cache misses instead of 500s
+                'IGNORE_EXCEPTIONS':True,
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default':{
+            'BACKEND':'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION':'ecom',
+        }
+    }
+
+# public catalog responses, invalidated by tags (e_app/caching.py) so the timeout only bounds memory
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT',default=60*60,cast=int)
+
 # JWT Configuration
 
 SIMPLE_JWT = {
@@ -138,8 +169,10 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS':True,
     'AUTH_HEADER_TYPES': ('Bearer',),
-    
-        
+    # tokens carry role and profile ids so requests skip the user/profile queries
+    'TOKEN_OBTAIN_SERIALIZER':'e_app.authentication.TokenObtainPairWithClaimsSerializer',
+    'TOKEN_REFRESH_SERIALIZER':'e_app.authentication.TokenRefreshWithClaimsSerializer',
+    'TOKEN_USER_CLASS':'e_app.authentication.ClaimsUser',
 }
 
 # Password validation
@@ -192,19 +225,43 @@ CORS_ALLOW_CREDENTIALS = True
 # csrf settings
 CSRF_TRUSTED_ORIGINS = ["https://frontend-uctm.onrender.com",]
 
-# LOGGING FOR DUBUGGING
-# LOGGINNG = {
-#     'version': 1,
-#     'disable_existing_loggers': False,
-#     'handlers': {
-#         'console': {
-#             'class': 'logging.StreamHandler'},
-#     'root':{
-#         'handlers':['console'],
-#         'level':'INFO',},
-#     }
-    
-# }
+# BACKGROUND JOBS (e_app/jobs.py), run by `manage.py run_worker`
+# eager: run each job in-process right after its transaction commits, no worker needed
+JOBS_EAGER = config('JOBS_EAGER',default=False,cast=bool)
+# a job running longer than this is assumed dead and handed to another worker
+JOBS_LEASE_SECONDS = config('JOBS_LEASE_SECONDS',default=600,cast=int)
+
+# STOCK RESERVATIONS (e_app/reservations.py): how long a cart line holds its units,
+# expired holds are released by run_worker
+RESERVATION_TTL = config('RESERVATION_TTL',default=900,cast=int)
+
+# INSTRUMENTATION
+# requests slower than this are logged with their db / serializer breakdown
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS',default=1000,cast=int)
+# lets a Prometheus scraper read api/metrics/ with "Authorization: Metrics <token>", staff can always
+METRICS_TOKEN = config('METRICS_TOKEN',default='')
+
+# LOGGING
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format':'%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter':'simple',
+        },
+    },
+    'root':{
+        'handlers':['console'],
+        'level':config('LOG_LEVEL',default='INFO'),
+    },
+    'loggers':{
+        'e_app.metrics':{'level':'INFO'},
+    },
+}
 
 
 
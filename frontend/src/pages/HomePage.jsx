@@ -11,7 +11,9 @@ export default function HomePage() {
   const [products, setProducts] = useState([]);
   const [categories, setCategories] = useState([]);
 
-  const [page, setPage] = useState(1);
+  // keyset pagination: "" is the first page, nextCursor comes from res.data.next
+  const [cursor, setCursor] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
   const [hasMore, setHasMore] = useState(true);
   const [loading, setLoading] = useState(false);
 
@@ -22,6 +24,10 @@ export default function HomePage() {
   const [minPrice, setMinPrice] = useState("");
   const [maxPrice, setMaxPrice] = useState("");
   const [sort, setSort] = useState("");
+  const [inStock, setInStock] = useState(false);
+
+  // counts for the current search and filters, sent with the first page
+  const [facets, setFacets] = useState(null);
 
   // block access for vendors
   useEffect(()=> {
@@ -34,7 +40,7 @@ export default function HomePage() {
   useEffect(() => {
     const timer = setTimeout(() => {
       setDebouncedSearch(search);
-      setPage(1); 
+      setCursor(""); 
     }, 500);
 
     return () => clearTimeout(timer);
@@ -60,13 +66,15 @@ export default function HomePage() {
   //Build URL (NOT in dependencies!)
   const buildUrl = () => {
     const params = new URLSearchParams();
-    params.append("page", page);
+    params.append("cursor", cursor);
 
     if (debouncedSearch) params.append("search", debouncedSearch);
     if (category) params.append("category", category);
     if (minPrice) params.append("price__gte", minPrice);
     if (maxPrice) params.append("price__lte", maxPrice);
     if (sort) params.append("ordering", sort);
+    if (inStock) params.append("in_stock", "true");
+    if (cursor === "") params.append("facets", "1");
 
     return `products/?${params.toString()}`;
   };
@@ -79,8 +87,9 @@ export default function HomePage() {
       const url = buildUrl();
       const res = await api.get(url);
 
-      if (page === 1) {
+      if (cursor === "") {
         setProducts(res.data.results);
+        setFacets(res.data.facets);
       } else {
         setProducts(prev => {
           const merged = [...prev, ...res.data.results];
@@ -89,7 +98,9 @@ export default function HomePage() {
         });
       }
 
-      setHasMore(res.data.next !== null);
+      const next = res.data.next ? new URL(res.data.next).searchParams.get("cursor") : null;
+      setNextCursor(next);
+      setHasMore(next !== null);
     } catch (err) {
       if (err.response?.status ===404) {
         setHasMore(false); // stop scroll when no more pages
@@ -100,7 +111,7 @@ export default function HomePage() {
     } finally {
       setLoading(false);
     }
-  }, [page, debouncedSearch, category, minPrice, maxPrice, sort]);
+  }, [cursor, debouncedSearch, category, minPrice, maxPrice, sort, inStock]);
 
 
   //Auto fetch when filters or page change
@@ -112,27 +123,38 @@ export default function HomePage() {
 
   //Reset infinite scroll when filters change
   useEffect(() => {
-    setPage(1);
+    setCursor("");
+    setNextCursor(null);
     setHasMore(true);
-    }, [debouncedSearch, category, minPrice, maxPrice, sort]);
+    }, [debouncedSearch, category, minPrice, maxPrice, sort, inStock]);
 
 
   //Infinite Scroll
   useEffect(() => {
     const handleScroll = () => {
-      if (!hasMore || loading) return;
+      if (!hasMore || loading || !nextCursor) return;
 
       if (
         window.innerHeight + document.documentElement.scrollTop + 200 >=
         document.documentElement.offsetHeight
       ) {
-        setPage(prev => prev + 1);
+        setCursor(nextCursor);
       }
     };
 
     window.addEventListener("scroll", handleScroll);
     return () => window.removeEventListener("scroll", handleScroll);
-  }, [hasMore, loading]);
+  }, [hasMore, loading, nextCursor]);
+
+
+  const categoryCounts = new Map((facets?.category || []).map((c) => [c.id, c.count]));
+  const countLabel = (id) => (facets ? ` (${categoryCounts.get(id) || 0})` : "");
+
+  const pickPriceBucket = (bucket) => {
+    setMinPrice(String(bucket.min));
+    // price__lte is inclusive, the bucket's max is not
+    setMaxPrice(bucket.max === null ? "" : String(bucket.max - 0.01));
+  };
 
 
   return (
@@ -156,7 +178,7 @@ export default function HomePage() {
         >
           <option value="">All Categories</option>
           {categories.map((c) => (
-            <option key={c.id} value={c.id}>{c.name}</option>
+            <option key={c.id} value={c.id}>{c.name}{countLabel(c.id)}</option>
           ))}
         </select>
 
@@ -186,8 +208,32 @@ export default function HomePage() {
           <option value="-price">Price: High → Low</option>
           <option value="-created_at">Newest First</option>
         </select>
+
+        <label className="flex items-center gap-1">
+          <input
+            type="checkbox"
+            checked={inStock}
+            onChange={(e) => setInStock(e.target.checked)}
+          />
+          In stock{facets?.stock ? ` (${facets.stock.in_stock})` : ""}
+        </label>
       </div>
 
+      {/* Price buckets for the current search and filters */}
+      {facets?.price && (
+        <div className="flex flex-wrap gap-2 mb-6 text-sm">
+          {facets.price.filter((b) => b.count > 0).map((b) => (
+            <button
+              key={b.min}
+              className="border px-2 py-1 rounded hover:bg-gray-100"
+              onClick={() => pickPriceBucket(b)}
+            >
+              ₹{b.min}{b.max === null ? "+" : `–${b.max}`} ({b.count})
+            </button>
+          ))}
+        </div>
+      )}
+
       {/* Product Grid */}
       <div className="grid grid-cols-1 sm:grid-cols-2 md:grid-cols-3 gap-6">
         {products.map((p) => (
@@ -196,11 +242,21 @@ export default function HomePage() {
             onClick={() => navigate(`/product/${p.slug}`)}
             className="bg-white shadow-md rounded-lg p-4 cursor-pointer hover:shadow-lg transition"
           >
-            <img
-              src={p.image || "/placeholder.png"}
-              alt={p.name}
-              className="w-full h-48 object-cover rounded-md"
-            />
+            <picture>
+              {p.image_srcset && (
+                <source
+                  type="image/webp"
+                  srcSet={p.image_srcset}
+                  sizes="(min-width: 768px) 33vw, (min-width: 640px) 50vw, 100vw"
+                />
+              )}
+              <img
+                src={p.image || "/placeholder.png"}
+                alt={p.name}
+                className="w-full h-48 object-cover rounded-md"
+                loading="lazy"
+              />
+            </picture>
             <h3 className="font-semibold text-lg mt-3">{p.name}</h3>
             <p className="text-gray-600">₹{p.price}</p>
           </div>
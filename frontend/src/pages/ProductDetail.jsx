@@ -51,7 +51,8 @@ export default function ProductDetail() {
       });
       alert("Added to cart");
     } catch (err) {
-      alert("Failed to add product to cart");
+      // e.g. the last units are held in other carts
+      alert(err.response?.data?.detail || "Failed to add product to cart");
     }
   };
 
@@ -70,20 +71,30 @@ export default function ProductDetail() {
     return <h2 className="text-center mt-10 text-red-600">{error}</h2>;
   }
 
+  const firstImage = product.images?.[0];
   const mainImage =
-    product.images?.[0]?.image || "/placeholder.png";
+    firstImage?.variants?.detail?.jpeg || firstImage?.image || "/placeholder.png";
 
   return (
     <div className="max-w-5xl mx-auto p-6 grid grid-cols-1 md:grid-cols-2 gap-8">
       
       {/* Product Images */}
       <div>
-        <img
-          src={mainImage}
-          alt={product.name}
-          className="w-full h-96 object-cover rounded-lg shadow-lg"
-          loading="lazy"
-        />
+        <picture>
+          {firstImage?.srcset && (
+            <source
+              type="image/webp"
+              srcSet={firstImage.srcset}
+              sizes="(min-width: 768px) 50vw, 100vw"
+            />
+          )}
+          <img
+            src={mainImage}
+            alt={product.name}
+            className="w-full h-96 object-cover rounded-lg shadow-lg"
+            loading="lazy"
+          />
+        </picture>
       </div>
 
       {/* Product Info */}
@@ -99,13 +110,13 @@ export default function ProductDetail() {
         </p>
 
         <p className="text-gray-500 mb-6">
-          Stock: {product.stock > 0 ? product.stock : "Out of stock"}
+          Stock: {product.available > 0 ? product.available : "Out of stock"}
         </p>
 
         <div className="flex gap-4">
           <button
             onClick={handleAddToCart}
-            disabled={product.stock === 0}
+            disabled={product.available === 0}
             className="bg-yellow-500 text-black px-6 py-2 rounded-lg
                        hover:bg-yellow-600 font-semibold disabled:opacity-50"
           >
@@ -114,7 +125,7 @@ export default function ProductDetail() {
 
           <button
             onClick={handleBuyNow}
-            disabled={product.stock === 0}
+            disabled={product.available === 0}
             className="bg-blue-600 text-white px-6 py-2 rounded-lg
                        hover:bg-blue-700 font-semibold disabled:opacity-50"
           >
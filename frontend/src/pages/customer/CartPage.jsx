@@ -35,7 +35,9 @@ useEffect(()=> {
   const handleRemove = async (id) => {
     try {
         await api.delete(`customer/cart/${id}/`);
+        const removed = cartItems.find((item) => item.id === id);
         setCartItems((prev) => prev.filter((item) => item.id !==id));
+        if (removed) setTotal((prev) => (Number(prev) - Number(removed.subtotal)).toFixed(2));
         
     }catch (error) {
         console.error("failed to remove item:",error);
@@ -70,7 +72,7 @@ useEffect(()=> {
           >
             <div className="flex items-center gap-4">
               <img
-                src={item.product?.images?.[0]?.image}
+                src={item.product?.image || "/placeholder.png"}
                 alt={item.product?.name}
                 className="w-20 h-20 object-cover rounded"
               />
@@ -132,7 +132,7 @@ return (
           >
             <div className="flex gap-3 items-center">
               <img
-                src={item.product?.images?.[0]?.image}
+                src={item.product?.image || "/placeholder.png"}
                 alt={item.product.name}
                 className="w-20 h-20 object-cover rounded"
               />